@@ -0,0 +1,216 @@
+"""
+Offline batch analysis: re-scores recorded drives without Flask, overlays or
+JPEG encoding, one file per worker process. Every file gets the same summary
+as a live session (SessionManager.get_summary), written as one JSON line to
+the results file as soon as it finishes, so an interrupted run picks up
+where it stopped. An aggregate over all files is printed at the end.
+
+    python analyze.py "archive/2024-*/*.mp4" --output results.jsonl
+    python analyze.py clips/*.mp4 --workers 8 --output results.jsonl --aggregate nightly.json
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import cv2
+from config import DISTRACTION_PITCH, DISTRACTION_YAW, FACE_LOST_SECONDS
+
+# Per-process components, built once by init_worker and reused for every file
+worker = {}
+
+
+def init_worker(tracking):
+    from src.detector import Detector
+    # One file per core: keep OpenCV from spawning its own thread pool in each worker
+    cv2.setNumThreads(1)
+    detector = Detector(tracking=tracking)
+    detector.warm_up(640, 480)
+    worker["detector"] = detector
+
+
+def analyze_file(path):
+    """
+    Runs enhancement, detection, head pose, assessment and session analytics
+    over every frame of one file, as fast as it decodes.
+    Returns a result record (summary, frames, timing) or an error record.
+    """
+    from src.sources import VideoFileSource
+    from src.vision_utils import LowLightEnhancer
+    from src.head_pose import HeadPoseEstimator
+    from src.assessor import Assessor
+    from src.analytics import SessionManager
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        source = VideoFileSource(path, realtime=False)
+    except Exception as e:
+        return {"file": path, "error": str(e)}
+
+    detector = worker["detector"]
+    detector.roi = None # Don't track into a new file from the last one
+    enhancer = LowLightEnhancer()
+    head_pose = HeadPoseEstimator(source.width, source.height)
+    assessor = Assessor()
+    session = SessionManager(live=False, session_id=os.path.splitext(os.path.basename(path))[0])
+
+    frames = faces = 0
+    timestamp = 0.0
+    lost_since = None
+    try:
+        for captured in source.frames():
+            frames += 1
+            timestamp = captured.timestamp
+            frame, is_low_light = enhancer.apply(captured.image)
+            session.update_state("LOW_LIGHT", is_low_light, timestamp=timestamp)
+
+            ear, mar, points = detector.process_frame(frame)
+            if points is None:
+                head_pose.reset()
+                # Same as the live pipeline: a driver out of view ends the face-based episodes
+                lost_since = timestamp if lost_since is None else lost_since
+                if timestamp - lost_since >= FACE_LOST_SECONDS:
+                    assessor.face_lost()
+                    for kind in ("DROWSY", "YAWN", "DISTRACTED"):
+                        session.update_state(kind, False, timestamp=timestamp)
+                continue
+            faces += 1
+            lost_since = None
+
+            assessor.update(ear, mar, timestamp=timestamp)
+            pitch, yaw, _ = head_pose.estimate(points, timestamp=timestamp)
+            distracted = abs(pitch) > DISTRACTION_PITCH or abs(yaw) > DISTRACTION_YAW
+
+            session.log_data(ear, mar, pitch, yaw, timestamp=timestamp)
+            session.update_state("DROWSY", assessor.is_drowsy(), timestamp=timestamp)
+            session.update_state("YAWN", assessor.is_yawning(), timestamp=timestamp)
+            session.update_state("DISTRACTED", distracted, timestamp=timestamp)
+    except Exception as e:
+        return {"file": path, "error": str(e), "frames": frames}
+    finally:
+        source.stop()
+
+    session.advance(timestamp)
+    session.close_episodes(timestamp)
+    wall = time.perf_counter() - start
+    return {
+        "file": path,
+        "summary": session.get_summary(),
+        "episodes": session.events,
+        "frames": frames,
+        "faces": faces,
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(time.process_time() - cpu_start, 3),
+        "fps": round(frames / wall, 1) if wall > 0 else 0.0,
+    }
+
+
+def expand(patterns):
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        files.extend(matches if matches else [pattern] if os.path.isfile(pattern) else [])
+    return list(dict.fromkeys(files)) # De-duplicate, keep order
+
+
+def load_done(path):
+    # Files that already have a successful result line (a torn last line is ignored)
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "error" not in record:
+                    done[record["file"]] = record
+    return done
+
+
+def throughput(records, wall, workers):
+    # Only the files analyzed in this run
+    ok = [r for r in records if "error" not in r]
+    frames = sum(r["frames"] for r in ok)
+    worker_seconds = sum(r["wall_seconds"] for r in ok)
+    return {
+        "files": len(records),
+        "frames": frames,
+        "workers": workers,
+        "fps_total": round(frames / wall, 1) if wall > 0 else 0.0,
+        "fps_per_core": round(frames / worker_seconds, 1) if worker_seconds > 0 else 0.0,
+    }
+
+
+def aggregate(records):
+    ok = [r for r in records if "error" not in r]
+    duration = sum(r["summary"]["duration_seconds"] for r in ok)
+
+    def total(group, key):
+        return round(sum(r["summary"][group][key] for r in ok), 3)
+
+    return {
+        "files": len(records),
+        "failed": [r["file"] for r in records if "error" in r],
+        "duration_seconds": duration,
+        "frames": sum(r["frames"] for r in ok),
+        "counts": {key: int(total("counts", key)) for key in ("drowsy", "distracted", "yawn")},
+        "seconds": {key: total("seconds", key) for key in ("drowsy", "distracted", "yawn", "low_light", "auth_lost")},
+        # Duration-weighted, so a 2-minute clip doesn't count as much as a 2-hour drive
+        "score": round(sum(r["summary"]["score"] * r["summary"]["duration_seconds"] for r in ok) / duration, 1) if duration else None,
+        "lowest_scores": [{"file": r["file"], "score": r["summary"]["score"]}
+                          for r in sorted(ok, key=lambda r: r["summary"]["score"])[:10]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score recorded drives offline in parallel")
+    parser.add_argument("inputs", nargs="+", help="Video files or glob patterns (quote globs, ** is supported)")
+    parser.add_argument("--output", default="analysis_results.jsonl", help="Per-file results, also the resume state")
+    parser.add_argument("--aggregate", help="Write the aggregate JSON to this file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--tracking", action="store_true", help="Use the ROI-tracking detector")
+    parser.add_argument("--restart", action="store_true", help="Ignore previous results instead of resuming")
+    args = parser.parse_args()
+
+    files = expand(args.inputs)
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = load_done(args.output)
+    pending = [f for f in files if f not in done]
+    print(f"{len(files)} files, {len(done)} already done, {len(pending)} to analyze", file=sys.stderr)
+
+    records = [done[f] for f in files if f in done]
+    analyzed = []
+    workers = 0
+    start = time.perf_counter()
+    if pending:
+        # Spawned like the fleet workers: each process loads its own MediaPipe graph
+        context = multiprocessing.get_context("spawn")
+        workers = min(args.workers, len(pending))
+        with context.Pool(workers, initializer=init_worker, initargs=(args.tracking,)) as pool, \
+                open(args.output, "a") as out:
+            for i, record in enumerate(pool.imap_unordered(analyze_file, pending), 1):
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                records.append(record)
+                analyzed.append(record)
+                if "error" in record:
+                    status = f"ERROR {record['error']}"
+                else:
+                    status = f"score {record['summary']['score']}, {record['frames']} frames @ {record['fps']} FPS"
+                print(f"[{i}/{len(pending)}] {record['file']}: {status}", file=sys.stderr)
+    wall = time.perf_counter() - start
+
+    result = aggregate(records)
+    result["throughput"] = throughput(analyzed, wall, workers)
+    output = json.dumps(result, indent=2)
+    if args.aggregate:
+        with open(args.aggregate, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == '__main__':
+    main()
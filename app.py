@@ -1,19 +1,24 @@
-from flask import Flask, render_template, Response, jsonify
-import cv2
-import numpy as np
+from flask import Flask, render_template, Response, jsonify, request, send_from_directory
+import socket
+import threading
 import time
 import json
-import threading
-from config import CAMERA_ID, FRAME_WIDTH, FRAME_HEIGHT, ALARM_FILE
-from src.camera import Camera
+import os
+from werkzeug.serving import make_server
+from config import (CAMERA_ID, FRAME_WIDTH, FRAME_HEIGHT, ALARM_FILE, STREAMS, SESSION_LOG_DIR, STREAM_MAX_FPS,
+                    ENROLL_FRAMES, SERVER, SERVER_THREADS, SERVER_SNDBUF_KB, HISTORY_DB, HISTORY_SERIES_RESOLUTION,
+                    CLIP_DIR)
+from src.sources import open_source
 from src.detector import Detector
 from src.assessor import Assessor
 from src.alerter import Alerter
 from src.head_pose import HeadPoseEstimator
 from src.analytics import SessionManager
 from src.identity import IdentityManager
-from src.vision_utils import enhance_low_light
-import src.ui as ui
+from src.pipeline import Pipeline
+from src.metrics import metrics
+from src.fleet import Fleet
+from src.history import HistoryStore
 
 app = Flask(__name__)
 
@@ -24,148 +29,126 @@ assessor = None
 alerter = None
 head_pose = None
 session_manager = None
+identity_manager = None
+
+# Single processing loop shared by every viewer
+pipeline = None
+
+# Multi-stream mode (config.STREAMS), one worker process per stream
+fleet = None
+
+# FaceMesh graph, loaded and warmed up once (in the background at boot) and shared by every session
+shared_detector = None
+model_lock = threading.Lock()
+model_load_seconds = None
 
-# Global State for API
-current_status = {
-    "ear": 0,
-    "mar": 0,
-    "pitch": 0,
-    "yaw": 0,
-    "drowsy": False,
-    "yawning": False,
-    "distracted": False,
-    "authenticated": False,
-    "auth_score": 0.0,
-    "low_light": False,
-    "fps": 0
-}
-lock = threading.Lock()
+# Session history, opened on first use
+history = None
+history_lock = threading.Lock()
+
+def get_history():
+    global history
+    if HISTORY_DB is None:
+        return None
+    with history_lock:
+        if history is None:
+            history = HistoryStore(HISTORY_DB, series_resolution=HISTORY_SERIES_RESOLUTION)
+    return history
+
+def load_models():
+    global shared_detector, model_load_seconds
+    with model_lock:
+        if shared_detector is None:
+            start = time.monotonic()
+            warm = Detector()
+            warm.warm_up(FRAME_WIDTH, FRAME_HEIGHT)
+            model_load_seconds = time.monotonic() - start
+            metrics.gauge("model_load_seconds", lambda: model_load_seconds)
+            shared_detector = warm
+    return shared_detector
+
+def preload_models():
+    # Server answers right away; /start_session only waits if it races the warm-up
+    threading.Thread(target=load_models, daemon=True).start()
 
 def init_system():
-    global camera, detector, assessor, alerter, head_pose, session_manager, identity_manager
+    global camera, detector, assessor, alerter, head_pose, session_manager, identity_manager, pipeline
     if camera is None:
-        camera = Camera(src=CAMERA_ID, width=FRAME_WIDTH, height=FRAME_HEIGHT).start()
-        detector = Detector()
+        requested_at = time.monotonic()
+        camera = open_source(CAMERA_ID, width=FRAME_WIDTH, height=FRAME_HEIGHT).start()
+        detector = load_models()
         assessor = Assessor()
         alerter = Alerter(ALARM_FILE)
         head_pose = HeadPoseEstimator(FRAME_WIDTH, FRAME_HEIGHT)
-        session_manager = SessionManager()
+        session_manager = SessionManager(log_dir=SESSION_LOG_DIR, history=get_history())
         identity_manager = IdentityManager()
+        pipeline = Pipeline(camera, detector, assessor, alerter, head_pose, session_manager,
+                            identity_manager).start(requested_at=requested_at)
 
-# Global Identity State
-identity_manager = None
-user_authenticated = False
-user_score = 1.0 # MSE Score
+def gen_frames(subscription):
+    # Frames are analysed and encoded once by the pipeline, we only forward them.
+    # A slow client blocks only here; meanwhile its slot keeps just the newest frame.
+    try:
+        for frame in subscription:
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+            # Resumed once the server took the frame
+            metrics.observe("client_frame_lag_seconds", subscription.mark_sent())
+    finally:
+        subscription.close()
 
-def gen_frames():
-    global current_status, user_authenticated, user_score
-    
-    prev_time = 0
-    
-    while True:
-        frame = camera.read()
-        if frame is None:
-            break
-            
-        # FPS
-        curr_time = time.time()
-        fps = 1 / (curr_time - prev_time) if (curr_time - prev_time) > 0 else 0
-        prev_time = curr_time
-        
-        # Process
-        # Low Light Enhancement
-        frame, is_low_light = enhance_low_light(frame)
+def gen_events(subscription, keepalive=15.0):
+    # Server-Sent Events: full status first, then only the fields that changed.
+    # Each client holds just the latest status, so slow clients skip states instead of queueing them.
+    last = {}
+    try:
+        yield "retry: 2000\n\n"
+        while True:
+            status = subscription.get(timeout=keepalive)
+            if status is None:
+                if subscription.broadcaster.closed:
+                    break
+                yield ": keepalive\n\n"
+                continue
+            delta = {k: v for k, v in status.items() if last.get(k) != v}
+            last = status
+            if delta:
+                yield f"data: {json.dumps(delta)}\n\n"
+    finally:
+        subscription.close()
 
-        ear, mar, landmarks = detector.process_frame(frame)
-        pitch, yaw, roll = 0, 0, 0
-        distracted = False
-        
-        # Identity Verification (Happens every frame if landmarks exist, but we only block/allow based on state)
-        if landmarks and identity_manager:
-            if identity_manager.profile:
-                match, score = identity_manager.verify_user(landmarks)
-                user_authenticated = match
-                user_score = score
-            else:
-                user_authenticated = False # No profile yet
-                
-        if landmarks:
-            # Drowsiness & Yawn
-            assessor.update(ear, mar)
-            drowsy = assessor.is_drowsy()
-            yawning = assessor.is_yawning()
-            
-            # Head Pose
-            rot_vec, trans_vec = head_pose.get_pose(landmarks)
-            pitch, yaw, roll = head_pose.get_euler_angles(rot_vec)
-
-            # Normalization...
-            if pitch < -90:
-                pitch += 180
-            elif pitch > 90:
-                pitch -= 180
-            
-            # Distraction Logic (Relaxed thresholds)
-            if abs(pitch) > 30 or abs(yaw) > 50:
-                distracted = True
-                
-            # Update Global State
-            with lock:
-                current_status = {
-                    "ear": float(ear),
-                    "mar": float(mar),
-                    "pitch": float(pitch),
-                    "yaw": float(yaw),
-                    "drowsy": drowsy,
-                    "yawning": yawning,
-                    "distracted": distracted,
-                    "bpm": assessor.get_bpm(),
-                    "fps": fps,
-                    "authenticated": user_authenticated,
-                    "auth_score": float(user_score),
-                    "low_light": is_low_light
-                }
-            
-            # Analytics
-            session_manager.log_data(ear, mar, pitch, yaw)
-            if drowsy: session_manager.log_event("DROWSY")
-            if yawning: session_manager.log_event("YAWN")
-            if distracted: session_manager.log_event("DISTRACTED")
-            
-            # Alerts
-            if drowsy:
-                alerter.alert()
-                cv2.putText(frame, "DROWSY!", (10, 300), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            elif distracted:
-                # alerter.alert() # Optional: alert on distraction too?
-                cv2.putText(frame, "DISTRACTED!", (10, 380), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
-            else:
-                alerter.stop()
-                
-            if yawning:
-                cv2.putText(frame, "YAWNING!", (10, 340), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-
-            # Draw Landmarks
-            h, w = frame.shape[:2]
-            ui.draw_landmarks(frame, landmarks, w, h, detector)
-            
-            # Draw Pose Axis (Nose tip)
-            # Projected nose tip
-            nose_end_point2D, _ = cv2.projectPoints(np.array([(0.0, 0.0, 1000.0)]), rot_vec, trans_vec, head_pose.camera_matrix, head_pose.dist_coeffs)
-            p1 = (int(landmarks.landmark[1].x * w), int(landmarks.landmark[1].y * h))
-            p2 = (int(nose_end_point2D[0][0][0]), int(nose_end_point2D[0][0][1]))
-            cv2.line(frame, p1, p2, (255, 0, 0), 2)
-
-        # Encode header
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+def frame_stream(broadcaster):
+    # ?fps=N lets a client (e.g. a small dashboard tile) ask for fewer frames
+    max_fps = request.args.get('fps', STREAM_MAX_FPS, type=float)
+    client = f"{request.remote_addr}:{request.environ.get('REMOTE_PORT', '')}"
+    return Response(gen_frames(broadcaster.subscribe(max_fps=max_fps, name=client)),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+def event_stream(broadcaster):
+    return Response(gen_events(broadcaster.subscribe()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/ready')
+def ready():
+    # Health check: 200 once the detection model is loaded and warm,
+    # in fleet mode once every worker is running and processing frames
+    if fleet is not None:
+        body = {
+            "ready": fleet.ready(),
+            "streams": {stream_id: handle.ready() for stream_id, handle in fleet.streams.items()},
+        }
+        return jsonify(body), 200 if body["ready"] else 503
+    body = {
+        "ready": shared_detector is not None,
+        "model_load_seconds": model_load_seconds,
+        "time_to_first_frame": pipeline.first_frame_seconds if pipeline else None,
+    }
+    return jsonify(body), 200 if body["ready"] else 503
+
 @app.route('/start_session')
 def start_session():
     init_system()
@@ -173,59 +156,184 @@ def start_session():
 
 @app.route('/register_face')
 def register_face():
-    # camera, identity_manager, detector are read from global scope
+    # pipeline and identity_manager are read from global scope
     try:
         if identity_manager is None:
             return jsonify({"status": "error", "message": "Identity Manager not initialized. Restart session."})
             
-        # We need a fresh frame
-        if camera and camera.started:
-            # Try a few frames to get a face
-            for i in range(10):
-                frame = camera.read()
-                if frame is None:
-                    continue
-                    
-                ear, mar, landmarks = detector.process_frame(frame)
-                if landmarks:
-                    try:
-                        if identity_manager.save_profile(landmarks):
-                            return jsonify({"status": "success", "message": "Face registered successfully!"})
-                    except Exception as e:
-                        print(f"Error saving profile: {e}")
-                        return jsonify({"status": "error", "message": f"Save failed: {str(e)}"})
-                time.sleep(0.1)
-            return jsonify({"status": "error", "message": "No face detected. Look at the camera."})
+        # Reuse the landmarks the pipeline already computed instead of running FaceMesh a second time
+        if pipeline and pipeline.started:
+            name = request.args.get('name', 'driver').strip() or 'driver'
+            # Collect several distinct frames, the profile is their median
+            samples = []
+            last = None
+            deadline = time.time() + 5.0
+            while len(samples) < ENROLL_FRAMES and time.time() < deadline:
+                points = pipeline.get_latest_landmarks()
+                if points is not None and points is not last:
+                    samples.append(points)
+                    last = points
+                time.sleep(0.05)
+            if not samples:
+                return jsonify({"status": "error", "message": "No face detected. Look at the camera."})
+            try:
+                identity_manager.enroll(name, samples)
+                return jsonify({"status": "success", "message": f"Face registered for {name} ({len(samples)} frames)!"})
+            except Exception as e:
+                print(f"Error saving profile: {e}")
+                return jsonify({"status": "error", "message": f"Save failed: {str(e)}"})
         return jsonify({"status": "error", "message": "Camera not started."})
     except Exception as e:
         print(f"Register endpoint error: {e}")
         return jsonify({"status": "error", "message": f"Server Error: {str(e)}"})
 
+@app.route('/drivers')
+def drivers():
+    if identity_manager is None:
+        return jsonify([])
+    return jsonify(identity_manager.names())
+
+@app.route('/history')
+def history_series():
+    """
+    EAR/MAR/pitch/yaw of the current session, downsampled server-side.
+    ?from=&to= are session seconds (a negative from counts back from now),
+    ?points= per series, ?columns=ear,mar, ?mode=minmax|lttb.
+    """
+    if session_manager is None:
+        return jsonify({"error": "no session"}), 409
+    series = session_manager.data_points
+    now = session_manager.now()
+    t1 = request.args.get('from', 0.0, type=float)
+    if t1 < 0:
+        t1 = max(0.0, now + t1)
+    t2 = request.args.get('to', now, type=float)
+    points = max(2, min(request.args.get('points', 300, type=int), 2000))
+    columns = [c for c in request.args.get('columns', '').split(',') if c] or None
+    mode = request.args.get('mode', 'minmax')
+    if columns and any(c not in series.columns for c in columns):
+        return jsonify({"error": f"columns must be among {', '.join(series.columns)}"}), 400
+    if mode not in ('minmax', 'lttb'):
+        return jsonify({"error": "mode must be minmax or lttb"}), 400
+    result = series.query(t1, t2, points=points, columns=columns, mode=mode)
+    return jsonify({"from": t1, "to": t2, "mode": mode, **result})
+
+@app.route('/sessions')
+def sessions():
+    # Newest first; ?before=<start_time of the last row> pages back
+    store = get_history()
+    if store is None:
+        return jsonify([])
+    limit = min(request.args.get('limit', 50, type=int), 1000)
+    return jsonify(store.sessions(driver=request.args.get('driver'),
+                                  before=request.args.get('before', type=float), limit=limit))
+
+@app.route('/sessions/<session_id>')
+def session_detail(session_id):
+    store = get_history()
+    result = store.session(session_id) if store else None
+    if result is None:
+        return jsonify({"error": "unknown session"}), 404
+    return jsonify(result)
+
+@app.route('/clips/<path:name>')
+def clip(name):
+    # Event clips, named in the "clip" field of an episode
+    if not CLIP_DIR:
+        return jsonify({"error": "clip recording disabled"}), 404
+    return send_from_directory(os.path.abspath(CLIP_DIR), name, mimetype='video/mp4')
+
+@app.route('/drivers/drowsy_weekly')
+def drowsy_weekly():
+    # Minutes of drowsiness per driver and week, over the last ?weeks= weeks
+    store = get_history()
+    if store is None:
+        return jsonify([])
+    weeks = request.args.get('weeks', 12, type=int)
+    return jsonify(store.weekly_drowsy_minutes(time.time() - weeks * 7 * 86400, driver=request.args.get('driver')))
+
 @app.route('/video_feed')
 def video_feed():
-    if camera is None or not camera.started:
+    if pipeline is None or not pipeline.started:
         # Return a placeholder or empty response if not started
         # For simplicity, we can just return a 204 No Content or a blank image generator
         # But clients might hang. Let's just ensure it doesn't crash.
         return Response("", mimetype='multipart/x-mixed-replace; boundary=frame')
-    return Response(gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return frame_stream(pipeline.broadcaster)
 
 @app.route('/status')
 def status():
     # Only return status if running
-    if camera and camera.started:
-        with lock:
-            return jsonify(current_status)
+    if pipeline and pipeline.started:
+        return jsonify(pipeline.get_status())
     return jsonify({"error": "stopped"})
 
+@app.route('/clients')
+def clients():
+    # Per-viewer delivery stats: frames sent/skipped, delivered FPS and lag
+    result = []
+    if pipeline is not None:
+        result += [{"stream": None, **stats} for stats in pipeline.broadcaster.client_stats()]
+    if fleet is not None:
+        for stream_id, handle in fleet.streams.items():
+            result += [{"stream": stream_id, **stats} for stats in handle.broadcaster.client_stats()]
+    return jsonify(result)
+
+@app.route('/streams')
+def streams():
+    if fleet is None:
+        return jsonify([])
+    return jsonify([{"id": stream_id, **handle.get_status()} for stream_id, handle in fleet.streams.items()])
+
+@app.route('/stream/<stream_id>/video_feed')
+def stream_video_feed(stream_id):
+    handle = fleet.get(stream_id) if fleet else None
+    if handle is None:
+        return jsonify({"error": "unknown stream"}), 404
+    return frame_stream(handle.broadcaster)
+
+@app.route('/stream/<stream_id>/status')
+def stream_status(stream_id):
+    handle = fleet.get(stream_id) if fleet else None
+    if handle is None:
+        return jsonify({"error": "unknown stream"}), 404
+    return jsonify(handle.get_status())
+
+@app.route('/stream/<stream_id>/events')
+def stream_events(stream_id):
+    handle = fleet.get(stream_id) if fleet else None
+    if handle is None:
+        return jsonify({"error": "unknown stream"}), 404
+    return event_stream(handle.status_broadcaster)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.enabled:
+        return Response("metrics disabled\n", status=404, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/events')
+def events():
+    if pipeline is None or not pipeline.started:
+        return jsonify({"error": "stopped"}), 409
+    return event_stream(pipeline.status_broadcaster)
+
 @app.route('/stop_session')
 def stop_session():
-    global camera, alerter
+    global camera, alerter, pipeline
     
+    # Stop the processing loop first so analytics are final
+    if pipeline:
+        pipeline.stop()
+        pipeline = None
+
     # Generate Report
     report = {}
     if session_manager:
         report = session_manager.save_report()
+        if session_manager.history:
+            # So the report can be loaded from /sessions/<id> right away
+            session_manager.history.flush()
     
     # Stop Components
     if camera: 
@@ -239,9 +347,38 @@ def stop_session():
 
 
 
+def serve(flask_app, host='0.0.0.0', port=5000):
+    """
+    Production mode (SERVER = "waitress"): a thread per connection. Both
+    servers get a small per-connection send buffer, so a slow client pushes
+    back on its own generator (which then skips frames) instead of megabytes
+    of stale JPEGs queueing in the server or the kernel.
+    Falls back to the Flask development server.
+    """
+    sndbuf = (socket.SOL_SOCKET, socket.SO_SNDBUF, SERVER_SNDBUF_KB * 1024)
+    if SERVER == "waitress":
+        try:
+            from waitress import serve as waitress_serve
+        except ImportError:
+            print("waitress is not installed, using the development server")
+        else:
+            # Accepted sockets inherit the listening socket's options
+            waitress_serve(flask_app, host=host, port=port, threads=SERVER_THREADS, channel_timeout=30,
+                           outbuf_high_watermark=SERVER_SNDBUF_KB * 1024, socket_options=[sndbuf])
+            return
+    server = make_server(host, port, flask_app, threaded=True)
+    server.socket.setsockopt(*sndbuf)
+    server.serve_forever()
+
 if __name__ == '__main__':
+    if STREAMS:
+        fleet = Fleet(STREAMS).start()
+    else:
+        preload_models()
     try:
-        app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False) # use_reloader=False because of threading
+        serve(app)
     finally:
+        if fleet: fleet.stop()
+        if pipeline: pipeline.stop()
         if camera: camera.stop()
         if alerter: alerter.stop()
@@ -0,0 +1,252 @@
+"""
+Pipeline benchmark: feeds a recorded clip (or synthetic frames) through the same
+components gen_frames() uses and reports per-stage latency percentiles,
+end-to-end throughput and peak RSS as JSON.
+
+    python benchmark.py --video drive.mp4 --frames 600 --output bench.json
+    python benchmark.py --synthetic --compare bench.json
+    python benchmark.py --video drive.mp4 --tracking
+    python benchmark.py --video drive.mp4 --check-tracking
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import cv2
+import numpy as np
+from config import FRAME_WIDTH, FRAME_HEIGHT
+from src.detector import Detector, NUM_LANDMARKS
+from src.head_pose import HeadPoseEstimator
+from src.identity import IdentityManager
+from src.assessor import Assessor
+from src.vision_utils import LowLightEnhancer
+from src.sources import VideoFileSource
+import src.ui as ui
+
+STAGES = ["enhance", "inference", "ear_mar", "pose", "identity", "assess", "draw", "encode"]
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None # Windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def synthetic_frames(count, width, height, seed=0):
+    # Smooth gradient + noise, with a bright ellipse so brightness varies like a real cab
+    rng = np.random.default_rng(seed)
+    base = np.tile(np.linspace(20, 120, width, dtype=np.float32), (height, 1))
+    for i in range(count):
+        frame = (base + rng.normal(0, 8, (height, width))).clip(0, 255).astype(np.uint8)
+        frame = cv2.merge([frame, frame, frame])
+        cv2.ellipse(frame, (width // 2 + (i % 20) - 10, height // 2), (90, 120), 0, 0, 360, (150, 160, 180), -1)
+        yield frame
+
+def synthetic_landmarks(width, height, seed=0):
+    # Face-sized point cloud, used when FaceMesh finds no face in synthetic frames
+    rng = np.random.default_rng(seed)
+    points = np.empty((NUM_LANDMARKS, 3), dtype=np.float32)
+    points[:, 0] = rng.uniform(width * 0.35, width * 0.65, NUM_LANDMARKS)
+    points[:, 1] = rng.uniform(height * 0.25, height * 0.75, NUM_LANDMARKS)
+    points[:, 2] = rng.normal(0, 10, NUM_LANDMARKS)
+    return points
+
+def percentiles(samples_ms):
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    if arr.size == 0:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {
+        "count": int(arr.size),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3)
+    }
+
+# Largest acceptable deviation of ROI tracking from full-frame detection
+TRACKING_TOLERANCE = {"ear": 0.02, "mar": 0.03, "pitch": 3.0, "yaw": 3.0}
+
+def run(frames, width, height, warmup=10, tracking=False):
+    detector = Detector(tracking=tracking)
+    head_pose = HeadPoseEstimator(width, height)
+    identity = IdentityManager()
+    assessor = Assessor()
+    enhancer = LowLightEnhancer()
+    fallback_points = synthetic_landmarks(width, height)
+    if not identity.enrolled():
+        # Benchmark the matching cost even without an enrolled driver
+        identity.enroll("benchmark", [fallback_points], persist=False)
+
+    timings = {name: [] for name in STAGES}
+    totals = []
+    faces = 0
+    processed = 0
+    clock = time.perf_counter
+
+    for i, frame in enumerate(frames):
+        record = i >= warmup
+        t_frame = t0 = clock()
+
+        frame, is_low_light = enhancer.apply(frame)
+        t1 = clock(); stage = {"enhance": t1 - t0}
+
+        points = detector.detect_points(frame)
+        t2 = clock(); stage["inference"] = t2 - t1
+
+        if points is not None:
+            faces += 1
+        else:
+            points = fallback_points
+        ear = float(detector.calculate_ear(points, detector.EYES).mean())
+        mar = detector.calculate_mar(points)
+        t3 = clock(); stage["ear_mar"] = t3 - t2
+
+        head_pose.estimate(points)
+        t4 = clock(); stage["pose"] = t4 - t3
+
+        identity.verify_user(points)
+        t5 = clock(); stage["identity"] = t5 - t4
+
+        assessor.update(ear, mar)
+        t6 = clock(); stage["assess"] = t6 - t5
+
+        ui.draw_landmarks(frame, points, detector)
+        t7 = clock(); stage["draw"] = t7 - t6
+
+        cv2.imencode('.jpg', frame)
+        t8 = clock(); stage["encode"] = t8 - t7
+
+        if record:
+            processed += 1
+            for name, seconds in stage.items():
+                timings[name].append(seconds * 1000.0)
+            totals.append((t8 - t_frame) * 1000.0)
+
+    wall = sum(totals) / 1000.0
+    return {
+        "frames": processed,
+        "faces_detected": faces,
+        "stages": {name: percentiles(samples) for name, samples in timings.items()},
+        "end_to_end": percentiles(totals),
+        "throughput_fps": round(processed / wall, 2) if wall > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def check_tracking(frames, width, height):
+    """
+    Runs full-frame and ROI-tracking detection side by side on the same frames
+    and reports how far tracking moves EAR/MAR/pitch/yaw.
+    """
+    full, tracked = Detector(tracking=False), Detector(tracking=True)
+    # One estimator each, without warm start or smoothing, so only the landmarks differ
+    poses = {full: HeadPoseEstimator(width, height, tracking=False),
+             tracked: HeadPoseEstimator(width, height, tracking=False)}
+    deltas = {name: [] for name in TRACKING_TOLERANCE}
+    missed = 0
+
+    def measure(detector, frame):
+        points = detector.detect_points(frame)
+        if points is None:
+            return None
+        ear = float(detector.calculate_ear(points, detector.EYES).mean())
+        mar = detector.calculate_mar(points)
+        pitch, yaw, _ = poses[detector].estimate(points)
+        return {"ear": ear, "mar": mar, "pitch": pitch, "yaw": yaw}
+
+    for frame in frames:
+        a, b = measure(full, frame), measure(tracked, frame)
+        if a is None:
+            continue
+        if b is None:
+            missed += 1
+            continue
+        for name in deltas:
+            deltas[name].append(abs(a[name] - b[name]))
+
+    report = {"missed_faces": missed, "within_tolerance": missed == 0}
+    for name, values in deltas.items():
+        arr = np.asarray(values)
+        mean_err = float(arr.mean()) if arr.size else 0.0
+        p95_err = float(np.percentile(arr, 95)) if arr.size else 0.0
+        report[name] = {"mean_abs": round(mean_err, 4), "p95_abs": round(p95_err, 4), "tolerance": TRACKING_TOLERANCE[name]}
+        if p95_err > TRACKING_TOLERANCE[name]:
+            report["within_tolerance"] = False
+    return report
+
+def compare(current, baseline):
+    # Prints p50/p95 changes per stage relative to a previous result file
+    print(f"{'stage':<12}{'p50 base':>10}{'p50 now':>10}{'p95 base':>10}{'p95 now':>10}{'delta':>9}")
+    rows = list(current["stages"].items()) + [("end_to_end", current["end_to_end"])]
+    for name, now in rows:
+        base = baseline["stages"].get(name) if name != "end_to_end" else baseline.get("end_to_end")
+        if not base or not base.get("count") or not now.get("count"):
+            continue
+        delta = (now["p50_ms"] - base["p50_ms"]) / base["p50_ms"] * 100 if base["p50_ms"] else 0.0
+        print(f"{name:<12}{base['p50_ms']:>10.2f}{now['p50_ms']:>10.2f}{base['p95_ms']:>10.2f}{now['p95_ms']:>10.2f}{delta:>8.1f}%")
+    print(f"throughput: {baseline['throughput_fps']} -> {current['throughput_fps']} FPS")
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency benchmark for the detection pipeline")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--video", help="Recorded clip to replay (unthrottled)")
+    group.add_argument("--synthetic", action="store_true", help="Use generated frames instead of a clip")
+    parser.add_argument("--frames", type=int, default=300, help="Maximum frames to measure")
+    parser.add_argument("--warmup", type=int, default=10, help="Frames excluded from the statistics")
+    parser.add_argument("--width", type=int, default=FRAME_WIDTH)
+    parser.add_argument("--height", type=int, default=FRAME_HEIGHT)
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    parser.add_argument("--compare", help="Previous JSON result to compare against")
+    parser.add_argument("--tracking", action="store_true", help="Benchmark the ROI-tracking detector")
+    parser.add_argument("--check-tracking", action="store_true", help="Compare ROI tracking against full-frame detection and exit non-zero beyond tolerance")
+    args = parser.parse_args()
+
+    total = args.frames + args.warmup
+    if args.video:
+        source = VideoFileSource(args.video, realtime=False)
+        width, height = source.width, source.height
+        frames = (f.image for _, f in zip(range(total), source.frames()))
+    else:
+        width, height = args.width, args.height
+        frames = synthetic_frames(total, width, height)
+
+    if args.check_tracking:
+        report = check_tracking(frames, width, height)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["within_tolerance"] else 1)
+
+    result = run(frames, width, height, warmup=args.warmup, tracking=args.tracking)
+    result["meta"] = {
+        "commit": git_commit(),
+        "source": args.video or "synthetic",
+        "tracking": args.tracking,
+        "resolution": [width, height],
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+if __name__ == '__main__':
+    main()
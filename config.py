@@ -1,15 +1,64 @@
 import cv2
 
 # Camera
-CAMERA_ID = 0
+CAMERA_ID = 0         # Device index, video file, image directory or "shm://<name>" (see src/sources.py)
 FRAME_WIDTH = 640
 FRAME_HEIGHT = 480
 
+# Fleet Mode: one inference worker process per stream, e.g. {"cab1": 0, "cab2": "shm://cab2"}
+# Empty = classic single-camera mode driven by /start_session
+STREAMS = {}
+FLEET_AUDIO_ALERTS = False   # Depot hosts usually have no speaker per cab
+FLEET_RESTART_BACKOFF = 2.0  # Seconds between restarts of a crashed worker
+FLEET_STALL_SECONDS = 10.0   # A worker without a new frame for this long exits and is restarted
+FLEET_METRICS_INTERVAL = 5.0 # Seconds between metrics snapshots forwarded from each worker to /metrics
+
+# Face Tracking (FaceMesh on a crop around the previous face instead of the full frame)
+DETECTOR_TRACKING = False
+ROI_PADDING = 0.35        # Padding around the face box, as a fraction of its size
+ROI_TARGET_SIZE = 192     # Downscale the crop so the face is about this many pixels (None = never)
+ROI_REFRESH_FRAMES = 30   # Full-frame search at least every N frames
+
+# Low Light Enhancement
+LOW_LIGHT_THRESHOLD = 70     # Mean brightness (0-255) below which a frame counts as low light
+LOW_LIGHT_HYSTERESIS = 10    # ...and above threshold + this it counts as normal again
+LOW_LIGHT_MAX_GAMMA = 2.5
+LOW_LIGHT_CLAHE = False      # Extra local contrast equalization on the face in low light
+
+# Head Pose
+HEAD_POSE_TRACKING = True    # Warm-start solvePnP from the previous frame and smooth the angles
+HEAD_POSE_EXTENDED = False   # Solve on 10 landmarks instead of 6
+HEAD_POSE_MIN_CUTOFF = 1.0   # One Euro filter: lower = less jitter when the head is still (Hz)
+HEAD_POSE_BETA = 0.05        # One Euro filter: higher = less lag on fast head turns
+
+# Distraction (Relaxed thresholds, degrees)
+DISTRACTION_PITCH = 30
+DISTRACTION_YAW = 50
+
+# Driver Identity
+IDENTITY_INTERVAL = 15      # Re-run face matching at most every N frames...
+IDENTITY_POSE_DELTA = 10.0  # ...or sooner when pitch/yaw moved by more than this (degrees)
+ENROLL_FRAMES = 10          # Frames averaged when registering a driver
+IDENTITY_THRESHOLD = 0.02   # Max mean squared landmark error for a match, in units of the face's
+                            # extent from the nose tip (the scale profiles were always compared on)
+
 # Detection Thresholds
 EAR_THRESHOLD = 0.20  # Eye Aspect Ratio threshold (below this is closed)
-EAR_FRAMES = 50       # Number of consecutive frames to trigger alert (approx 2 seconds @ 25-30 FPS)
+EAR_SECONDS = 1.7     # Eyes closed this long triggers the alert, at any frame rate
 MAR_THRESHOLD = 0.5   # Mouth Aspect Ratio threshold (above this is yawning)
-MAR_FRAMES = 50       # Number of consecutive frames to trigger alert
+MAR_SECONDS = 1.7     # Mouth open this long counts as a yawn
+PERCLOS_WINDOW = 60.0     # Seconds of history for PERCLOS (fraction of time eyes closed)
+PERCLOS_THRESHOLD = None  # Also raise DROWSY when PERCLOS reaches this, e.g. 0.15 (None = off)
+YAWN_WINDOW = 300.0       # Seconds of history for the yawns-per-minute rate
+FACE_LOST_SECONDS = 0.5   # No face this long ends drowsy/yawn/distracted episodes and alerts
+
+# Per-driver Calibration
+CALIBRATION_ENABLED = True      # Derive EAR/MAR thresholds from each driver's own distribution
+CALIBRATION_SECONDS = 60.0      # Face time before a new driver's thresholds replace the defaults above
+CALIBRATION_EAR_RATIO = 0.75    # EAR threshold = this fraction of the driver's median (open-eye) EAR
+CALIBRATION_MAR_FACTOR = 1.3    # MAR threshold = this times the driver's 95th percentile MAR (talking)
+CALIBRATION_EAR_RANGE = (0.12, 0.30)  # Calibrated thresholds are clamped to these ranges
+CALIBRATION_MAR_RANGE = (0.35, 0.90)
 
 # Colors (B, G, R)
 COLOR_GREEN = (0, 255, 0)
@@ -17,5 +66,45 @@ COLOR_RED = (0, 0, 255)
 COLOR_YELLOW = (0, 255, 255)
 COLOR_WHITE = (255, 255, 255)
 
+# Session Analytics
+SESSION_RAW_CAPACITY = 108000    # Per-frame samples kept at full rate (~1 hour @ 30 FPS)
+SESSION_TIERS = (1.0, 10.0, 60.0) # Downsampled tiers (seconds per bucket) kept for the whole session
+SESSION_LOG_DIR = "sessions"      # Append-only per-session logs (None disables)
+SESSION_LOG_FSYNC = "interval"    # "always", "interval" (every few seconds) or "never"
+SESSION_LOG_ROTATE_MB = 64        # Start a new log segment after this size
+HISTORY_DB = "history.db"         # SQLite history of all sessions behind /sessions (None disables)
+HISTORY_SERIES_RESOLUTION = 10.0  # Seconds per stored series point (picks the nearest SESSION_TIERS tier)
+
+# Event Clips
+CLIP_DIR = "clips"              # Video clips around DROWSY/DISTRACTED episodes (None disables)
+CLIP_TYPES = ("DROWSY", "DISTRACTED")
+CLIP_PRE_SECONDS = 10.0         # Footage kept from before the episode started
+CLIP_POST_SECONDS = 10.0        # Footage after the start (extended by further episodes)
+CLIP_MAX_SECONDS = 60.0         # Longest single clip
+CLIP_FPS = 10.0
+CLIP_WIDTH = 480
+CLIP_JPEG = True                # Hold the pre-roll as JPEGs (~10x less memory than raw frames)
+
+# Video Stream
+JPEG_QUALITY = 80            # Starting JPEG quality, adapted between JPEG_MIN_QUALITY and 90
+JPEG_MIN_QUALITY = 40
+PREVIEW_WIDTH = None         # Downscale the streamed preview to this width (None = full frame)
+ENCODE_TIME_BUDGET_MS = 8    # Lower quality when an encode takes longer than this
+ENCODE_SIZE_BUDGET_KB = None # Lower quality when frames get bigger than this (None = no limit)
+STREAM_MAX_FPS = None        # Per-client frame rate cap for /video_feed (?fps= overrides)
+HEADLESS_WHEN_IDLE = True    # Skip overlays and encoding while nobody watches
+
+# Web Server
+SERVER = "waitress"      # "waitress" (production, falls back if not installed) or "werkzeug" (Flask dev server)
+SERVER_THREADS = 64      # Every open /video_feed or /events connection holds one thread
+SERVER_SNDBUF_KB = 128   # Per-connection send buffer before a slow client blocks its generator
+
+# Metrics
+METRICS_ENABLED = True  # Per-stage timers and the /metrics endpoint; False removes all overhead
+
 # Alert
 ALARM_FILE = "alarm.wav"  # You will need to provide this file or I can generate a beep
+ALERT_AUDIBLE = ("DROWSY",)  # Alert types that sound the alarm
+ALERT_RELEASE_SECONDS = 1.0  # An alert must stay off this long before it is reported as ended
+ALERT_LOG_FILE = None        # Append every alert start/end as JSON lines, e.g. "alerts.log"
+ALERT_WEBHOOK_URL = None     # POST every alert start/end as JSON to this URL
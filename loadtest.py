@@ -0,0 +1,210 @@
+"""
+Streaming load test: opens many concurrent /video_feed connections, some
+reading as fast as they can and some throttled to a low bandwidth, and
+reports delivered FPS per client plus the server's own per-client stats
+(/clients) and producer timing as JSON.
+
+    python loadtest.py --synthetic --fast 20 --slow 20
+    python loadtest.py --url http://localhost:5000 --fast 5 --slow 5 --duration 30
+
+--synthetic serves generated JPEGs through the same streaming code as the
+app (no camera or model needed) and also reports whether the producer kept
+its frame rate while slow clients were connected.
+"""
+import argparse
+import json
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+import cv2
+import numpy as np
+from flask import Flask
+from config import FRAME_WIDTH, FRAME_HEIGHT
+
+BOUNDARY = b"--frame"
+
+
+class Client(threading.Thread):
+    """
+    One MJPEG viewer on a raw socket. bandwidth (bytes/s) throttles reads,
+    None reads as fast as possible.
+    """
+    def __init__(self, host, port, path, bandwidth=None, duration=10.0, recv_buffer=None):
+        super().__init__(daemon=True)
+        self.host, self.port, self.path = host, port, path
+        self.bandwidth = bandwidth
+        self.duration = duration
+        self.recv_buffer = recv_buffer
+        self.frames = 0
+        self.bytes = 0
+        self.error = None
+
+    def run(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if self.recv_buffer:
+                # A small kernel buffer makes a slow reader push back on the server sooner
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer)
+            sock.settimeout(5.0)
+            sock.connect((self.host, self.port))
+            sock.sendall(f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode())
+
+            start = time.monotonic()
+            carry = b""
+            chunk = 4096
+            while time.monotonic() - start < self.duration:
+                data = sock.recv(chunk)
+                if not data:
+                    break
+                self.bytes += len(data)
+                # Count boundaries, including ones split across reads
+                data = carry + data
+                self.frames += data.count(BOUNDARY)
+                carry = data[-(len(BOUNDARY) - 1):]
+                if self.bandwidth:
+                    time.sleep(len(data) / self.bandwidth)
+            sock.close()
+        except OSError as e:
+            self.error = str(e)
+
+
+def synthetic_server(port, fps, width, height):
+    """
+    Serves /video_feed and /clients from a FrameBroadcaster fed with generated
+    JPEGs at `fps`. Returns (broadcaster, producer timing dict).
+    """
+    import app as server
+    from src.pipeline import FrameBroadcaster
+
+    broadcaster = FrameBroadcaster()
+    timing = {"published": 0, "late": 0, "max_publish_ms": 0.0, "start": time.monotonic()}
+
+    def produce():
+        frame = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+        frame = cv2.GaussianBlur(frame, (0, 0), 3) # Compresses more like a real image
+        _, buffer = cv2.imencode(".jpg", frame)
+        payload = buffer.tobytes()
+        interval = 1.0 / fps
+        next_time = time.monotonic()
+        while not broadcaster.closed:
+            start = time.monotonic()
+            broadcaster.publish(payload)
+            spent = time.monotonic() - start
+            timing["published"] += 1
+            timing["max_publish_ms"] = max(timing["max_publish_ms"], spent * 1000)
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                timing["late"] += 1
+
+    flask_app = Flask("loadtest")
+    flask_app.add_url_rule("/video_feed", "video_feed", lambda: server.frame_stream(broadcaster))
+    flask_app.add_url_rule("/clients", "clients", lambda: {"clients": broadcaster.client_stats()})
+    threading.Thread(target=produce, daemon=True).start()
+    threading.Thread(target=server.serve, args=(flask_app, "127.0.0.1", port), daemon=True).start()
+    return broadcaster, timing
+
+
+def wait_for_server(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def summarize(clients, duration):
+    fps = sorted(c.frames / duration for c in clients)
+    if not fps:
+        return {}
+    return {
+        "count": len(clients),
+        "errors": sum(1 for c in clients if c.error),
+        "fps_min": round(fps[0], 1),
+        "fps_median": round(fps[len(fps) // 2], 1),
+        "fps_max": round(fps[-1], 1),
+        "mbytes_total": round(sum(c.bytes for c in clients) / 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent slow/fast client load test for /video_feed")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--url", help="Running server, e.g. http://localhost:5000")
+    group.add_argument("--synthetic", action="store_true", help="Serve generated frames in-process")
+    parser.add_argument("--fast", type=int, default=10, help="Clients reading as fast as possible")
+    parser.add_argument("--slow", type=int, default=10, help="Throttled clients")
+    parser.add_argument("--slow-kbps", type=float, default=200, help="Bandwidth of a slow client (KB/s)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per client")
+    parser.add_argument("--fps", type=float, default=30.0, help="Producer frame rate (--synthetic)")
+    parser.add_argument("--port", type=int, default=5055, help="Port for --synthetic")
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    args = parser.parse_args()
+
+    timing = None
+    if args.synthetic:
+        host, port = "127.0.0.1", args.port
+        broadcaster, timing = synthetic_server(port, args.fps, FRAME_WIDTH, FRAME_HEIGHT)
+        base = f"http://{host}:{port}"
+    else:
+        parsed = urllib.parse.urlparse(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+        base = args.url.rstrip("/")
+    if not wait_for_server(host, port):
+        raise SystemExit(f"Server at {host}:{port} is not reachable")
+
+    fast = [Client(host, port, "/video_feed", duration=args.duration) for _ in range(args.fast)]
+    slow = [Client(host, port, "/video_feed", bandwidth=args.slow_kbps * 1024, duration=args.duration,
+                   recv_buffer=16 * 1024) for _ in range(args.slow)]
+    for client in fast + slow:
+        client.start()
+
+    # Server-side view while everyone is still connected
+    time.sleep(args.duration * 0.8)
+    try:
+        with urllib.request.urlopen(base + "/clients", timeout=5) as response:
+            server_stats = json.load(response)
+        if isinstance(server_stats, dict):
+            server_stats = server_stats["clients"]
+    except OSError as e:
+        server_stats = {"error": str(e)}
+
+    for client in fast + slow:
+        client.join(args.duration + 10)
+
+    result = {"fast": summarize(fast, args.duration), "slow": summarize(slow, args.duration)}
+    if isinstance(server_stats, list) and server_stats:
+        lags = sorted(c["lag_ms"] for c in server_stats)
+        result["server"] = {
+            "clients": len(server_stats),
+            "lag_ms_median": lags[len(lags) // 2],
+            "lag_ms_max": lags[-1],
+            "dropped_total": sum(c["dropped"] for c in server_stats),
+        }
+    else:
+        result["server"] = server_stats
+    if timing is not None:
+        result["producer"] = {
+            "target_fps": args.fps,
+            "fps": round(timing["published"] / (time.monotonic() - timing["start"]), 1),
+            "published": timing["published"],
+            "late_ticks": timing["late"],
+            "max_publish_ms": round(timing["max_publish_ms"], 2),
+        }
+        broadcaster.close()
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == '__main__':
+    main()
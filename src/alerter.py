@@ -1,44 +1,260 @@
-import pygame
+import json
 import os
+import queue
+import threading
+import time
+import urllib.request
 import wave
-import math
-import struct
+import numpy as np
+from config import ALARM_FILE, ALERT_AUDIBLE, ALERT_LOG_FILE, ALERT_WEBHOOK_URL, ALERT_RELEASE_SECONDS
+from src.metrics import metrics
 
-class Alerter:
-    def __init__(self, alarm_file):
+
+def generate_beep(filename, duration=1.0, freq=440.0, sample_rate=44100, amplitude=16000):
+    # 440Hz sine wave beep, 16-bit mono (amplitude max 32767)
+    t = np.arange(int(sample_rate * duration)) / sample_rate
+    samples = (amplitude * np.sin(2 * np.pi * freq * t)).astype("<i2")
+    with wave.open(filename, 'w') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+
+
+class AudioSink:
+    """
+    Loops the alarm sound while any audible alert type is active. The mixer
+    is only initialized on the first alarm, so headless hosts that never
+    alert never touch the audio stack; if it can't be initialized the sink
+    disables itself.
+    """
+    name = "audio"
+
+    def __init__(self, alarm_file=ALARM_FILE, audible=ALERT_AUDIBLE):
         self.alarm_file = alarm_file
-        self.playing = False
-        
+        self.audible = set(audible)
+        self.active = set()
+        self.sound = None
+        self.failed = False
+
+    def load(self):
+        import pygame
         pygame.mixer.init()
-        
         # Determine if we need to generate a sound
         if not os.path.exists(self.alarm_file):
-            self._generate_beep(self.alarm_file)
-            
+            generate_beep(self.alarm_file)
         self.sound = pygame.mixer.Sound(self.alarm_file)
 
-    def _generate_beep(self, filename, duration=1.0, freq=440.0):
-        # Generate a 440Hz sine wave beep
-        sample_rate = 44100
-        n_samples = int(sample_rate * duration)
-        amplitude = 16000 # Max 32767
-        
-        with wave.open(filename, 'w') as wav_file:
-            wav_file.setnchannels(1)
-            wav_file.setsampwidth(2)
-            wav_file.setframerate(sample_rate)
-            
-            for i in range(n_samples):
-                value = int(amplitude * math.sin(2 * math.pi * freq * i / sample_rate))
-                data = struct.pack('<h', value)
-                wav_file.writeframesraw(data)
-
-    def alert(self):
-        if not pygame.mixer.get_busy():
+    def handle(self, event):
+        if event["type"] not in self.audible or self.failed:
+            return
+        was_playing = bool(self.active)
+        if event["active"]:
+            self.active.add(event["type"])
+        else:
+            self.active.discard(event["type"])
+
+        if self.active and not was_playing:
+            if self.sound is None:
+                try:
+                    self.load()
+                except Exception as e:
+                    print(f"Audio alerts disabled: {e}")
+                    self.failed = True
+                    return
             self.sound.play(-1) # Loop indefinitely
-            self.playing = True
+        elif not self.active and was_playing and self.sound is not None:
+            self.sound.stop()
 
-    def stop(self):
-        if self.playing:
+    def close(self):
+        if self.sound is not None:
             self.sound.stop()
-            self.playing = False
+
+
+class LogSink:
+    """
+    Appends every alert edge as one JSON line.
+    """
+    name = "log"
+
+    def __init__(self, path):
+        self.path = path
+
+    def handle(self, event):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(event) + "\n")
+
+    def close(self):
+        pass
+
+
+class WebhookSink:
+    """
+    POSTs every alert edge as JSON to a URL (fleet dashboards, chat hooks).
+    """
+    name = "webhook"
+    blocking = True # Network I/O: runs on its own thread
+
+    def __init__(self, url, timeout=2.0):
+        self.url = url
+        self.timeout = timeout
+
+    def handle(self, event):
+        request = urllib.request.Request(self.url, data=json.dumps(event).encode(),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def close(self):
+        pass
+
+
+class ThreadedSink:
+    """
+    Runs a sink on its own thread and queue, so a slow or unreachable
+    endpoint only delays its own events, never the audio alarm. Events
+    beyond `maxsize` waiting are dropped and counted as errors.
+    """
+    def __init__(self, sink, maxsize=100):
+        self.sink = sink
+        self.name = sink.name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def handle(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            metrics.inc("alert_sink_errors_total", labels=(("sink", self.name),))
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+            try:
+                self.sink.handle(event)
+            except Exception as e:
+                metrics.inc("alert_sink_errors_total", labels=(("sink", self.name),))
+                print(f"Alert sink {self.name} failed: {e}")
+        self.sink.close()
+
+    def close(self, timeout=5.0):
+        # Delivers what is queued, but an unreachable endpoint can't hold up shutdown for long
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+
+def default_sinks(alarm_file):
+    sinks = []
+    if alarm_file:
+        sinks.append(AudioSink(alarm_file))
+    if ALERT_LOG_FILE:
+        sinks.append(LogSink(ALERT_LOG_FILE))
+    if ALERT_WEBHOOK_URL:
+        sinks.append(WebhookSink(ALERT_WEBHOOK_URL))
+    return sinks
+
+
+class Alerter:
+    """
+    Alert dispatcher. The frame loop calls update(kind, active) every frame;
+    only state changes are queued, and a background thread turns them into
+    debounced edge events for the sinks (audio, log file, webhook). A rising
+    edge is delivered at once, a falling edge only after the alert stayed
+    off for `release` seconds, so a flickering state doesn't chatter.
+    Sink I/O never runs on the frame loop, and blocking sinks (network) get
+    their own thread so they can't hold up the others.
+    """
+    def __init__(self, alarm_file=ALARM_FILE, sinks=None, release=ALERT_RELEASE_SECONDS, stream=None):
+        sinks = default_sinks(alarm_file) if sinks is None else sinks
+        self.sinks = [ThreadedSink(sink) if getattr(sink, "blocking", False) else sink for sink in sinks]
+        self.release = release
+        self.stream = stream # Stream id in fleet mode, included in every event
+        self.queue = queue.Queue()
+        self.states = {} # Last state enqueued per kind (frame loop side)
+
+        self.started = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def update(self, kind, active):
+        # Called from the frame loop: O(1), never blocks
+        active = bool(active)
+        if self.states.get(kind, False) != active:
+            self.states[kind] = active
+            self.queue.put((kind, active, time.time()))
+
+    def alert(self, kind="DROWSY"):
+        self.update(kind, True)
+
+    def run(self):
+        active = {} # kind -> start time of the delivered (raised) alert
+        releasing = {} # kind -> time the state went off, pending release
+        while True:
+            # Wake up in time for the earliest pending release
+            timeout = 0.5
+            if releasing:
+                timeout = max(0.0, min(releasing.values()) + self.release - time.time())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None: # None is also stop()'s wake-up
+                kind, state, timestamp = item
+                # Judge releases by event time, a backlog must not look like a long pause
+                self.release_due(active, releasing, timestamp)
+                if state:
+                    # Raised again while releasing: the alert simply continues
+                    if releasing.pop(kind, None) is None and kind not in active:
+                        active[kind] = timestamp
+                        self.emit(kind, True, timestamp, None)
+                elif kind in active:
+                    releasing[kind] = timestamp
+
+            if not self.started:
+                if not self.queue.empty():
+                    continue
+                self.release_due(active, releasing, float("inf"))
+                break
+            if self.queue.empty():
+                self.release_due(active, releasing, time.time())
+
+        for sink in self.sinks:
+            sink.close()
+
+    def release_due(self, active, releasing, now):
+        for kind, off_time in list(releasing.items()):
+            if now - off_time >= self.release:
+                del releasing[kind]
+                self.emit(kind, False, off_time, off_time - active.pop(kind))
+
+    def emit(self, kind, active, timestamp, duration):
+        event = {"type": kind, "active": active, "time": round(timestamp, 3)}
+        if duration is not None:
+            event["duration"] = round(duration, 3)
+        if self.stream is not None:
+            event["stream"] = self.stream
+        for sink in self.sinks:
+            try:
+                sink.handle(event)
+            except Exception as e:
+                metrics.inc("alert_sink_errors_total", labels=(("sink", sink.name),))
+                print(f"Alert sink {sink.name} failed: {e}")
+
+    def stop(self):
+        """
+        Ends every active alert, delivers the remaining events and shuts the
+        sinks down.
+        """
+        for kind, active in list(self.states.items()):
+            if active:
+                self.update(kind, False)
+        self.started = False
+        self.queue.put(None)
+        self.thread.join()
@@ -1,51 +1,154 @@
 import time
 import json
+import secrets
 from datetime import datetime
+from config import SESSION_RAW_CAPACITY, SESSION_TIERS, SESSION_LOG_FSYNC, SESSION_LOG_ROTATE_MB
+from src.timeseries import SessionSeries
+from src.episodes import IntervalIndex
+from src.session_log import SessionLogWriter
+
+# Episode types tracked per session
+EPISODE_TYPES = ("DROWSY", "YAWN", "DISTRACTED", "LOW_LIGHT", "AUTH_LOST")
+
+def new_session_id(start_time, prefix=None):
+    # Local start time to the millisecond plus a random suffix, so sessions started together never collide
+    stamp = datetime.fromtimestamp(start_time)
+    session_id = f"{stamp.strftime('%Y%m%d-%H%M%S')}-{stamp.microsecond // 1000:03d}-{secrets.token_hex(2)}"
+    return f"{prefix}-{session_id}" if prefix else session_id
 
 class SessionManager:
-    def __init__(self):
+    def __init__(self, live=True, log_dir=None, session_id=None, history=None, stream=None):
+        """
+        live=False drives the session clock purely from the timestamps passed
+        to log_data/update_state (recorded clips), instead of the wall clock.
+        log_dir streams every sample and episode to a crash-safe append-only log.
+        history (a HistoryStore) records the session, its episodes and a
+        downsampled series for later queries.
+        """
         self.start_time = time.time()
-        self.events = [] # List of {timestamp, type, value}
-        self.data_points = [] # List of {timestamp, ear, mar, pitch, yaw}
+        self.session_id = session_id or new_session_id(self.start_time)
+        self.live = live
+        self.last_timestamp = 0.0
+        self.events = [] # Closed episodes: {type, start, end, duration, real_time}
+        self.episodes = {kind: IntervalIndex() for kind in EPISODE_TYPES}
+        # Columnar {timestamp, ear, mar, pitch, yaw} store, bounded in memory
+        self.data_points = SessionSeries(("ear", "mar", "pitch", "yaw"),
+                                         raw_capacity=SESSION_RAW_CAPACITY, tiers=SESSION_TIERS)
         self.status = "ACTIVE"
+        self.stream = stream # Stream id in fleet mode
+        self.driver = None # Last recognized driver
+        self.drivers = [] # Every recognized driver, in the order first seen
+        self.clips = {} # Episode type -> clip of its open episode
+
+        self.history = history
+        if history:
+            history.start_session(self)
+
+        self.log = None
+        if log_dir:
+            self.log = SessionLogWriter(log_dir, self.session_id, self.start_time, fsync=SESSION_LOG_FSYNC,
+                                        rotate_bytes=SESSION_LOG_ROTATE_MB * 1024 * 1024)
+
+    def now(self):
+        # Seconds since session start
+        if self.live:
+            return time.time() - self.start_time
+        return self.last_timestamp
+
+    def _timestamp(self, timestamp):
+        if timestamp is None:
+            timestamp = self.now()
+        self.last_timestamp = max(self.last_timestamp, timestamp)
+        return timestamp
         
-    def log_data(self, ear, mar, pitch, yaw):
-        self.data_points.append({
-            "timestamp": time.time() - self.start_time,
-            "ear": float(ear) if ear else 0,
-            "mar": float(mar) if mar else 0,
-            "pitch": float(pitch) if pitch else 0,
-            "yaw": float(yaw) if yaw else 0
-        })
-
-    def log_event(self, event_type):
-        # Avoid spamming events? (Debounce handled by assessor usually)
-        # We'll rely on the caller to only log when state changes or alert triggers
-        self.events.append({
-            "timestamp": time.time() - self.start_time,
-            "type": event_type,
-            "real_time": datetime.now().strftime("%H:%M:%S")
-        })
+    def advance(self, timestamp):
+        # Moves the clock of a non-live session, e.g. to the end of a clip whose last frames had no face
+        self._timestamp(timestamp)
+
+    def log_data(self, ear, mar, pitch, yaw, timestamp=None):
+        timestamp = self._timestamp(timestamp)
+        ear = float(ear) if ear else 0
+        mar = float(mar) if mar else 0
+        pitch = float(pitch) if pitch else 0
+        yaw = float(yaw) if yaw else 0
+        self.data_points.append(timestamp, ear, mar, pitch, yaw)
+        if self.log:
+            self.log.write_sample(timestamp, ear, mar, pitch, yaw)
+
+    def update_state(self, kind, active, timestamp=None):
+        """
+        Feeds the current boolean state of an episode type. Only transitions are
+        recorded: a rising edge opens an episode, a falling edge closes it.
+        """
+        index = self.episodes[kind]
+        if active == index.is_open():
+            return
+        timestamp = self._timestamp(timestamp)
+        if self.log:
+            self.log.write_transition(kind, active, timestamp)
+        if active:
+            index.open(timestamp)
+        else:
+            start, end = index.close(timestamp)
+            event = {
+                "type": kind,
+                "start": round(start, 3),
+                "end": round(end, 3),
+                "duration": round(end - start, 3),
+                "real_time": datetime.fromtimestamp(self.start_time + start).strftime("%H:%M:%S")
+            }
+            if kind in self.clips:
+                event["clip"] = self.clips.pop(kind)
+            self.events.append(event)
+            if self.history:
+                self.history.add_episode(self, event)
+
+    def close_episodes(self, timestamp=None):
+        # Ends every open episode, e.g. when the session stops
+        for kind, index in self.episodes.items():
+            if index.is_open():
+                self.update_state(kind, False, timestamp)
+
+    def attach_clip(self, kind, clip):
+        # Links a recorded clip to the open episode of this type
+        if self.episodes[kind].is_open():
+            self.clips[kind] = clip
+
+    def set_driver(self, name):
+        if name:
+            self.driver = name
+            if name not in self.drivers:
+                self.drivers.append(name)
+
+    def episodes_between(self, kind, t1, t2):
+        """
+        (start, end) episodes of one type overlapping [t1, t2] (session seconds).
+        """
+        return self.episodes[kind].overlapping(t1, t2, now=self.now())
+
+    def time_in(self, kind, t1=None, t2=None):
+        """
+        Total seconds spent in an episode type within [t1, t2], e.g.
+        time_in("DISTRACTED", now - 600, now) for the last 10 minutes.
+        """
+        return self.episodes[kind].total(t1, t2, now=self.now())
+
+    def episode_count(self):
+        return sum(len(index) for index in self.episodes.values())
 
     def get_summary(self):
-        duration = time.time() - self.start_time
-        total_frames = len(self.data_points)
-        avg_fps = total_frames / duration if duration > 0 else 30.0
-        
-        # Calculate roughly how many seconds each event type lasted
-        # timestamp difference approach is better but count/fps is a good approximation for continuous streams
-        seconds_per_frame = 1.0 / avg_fps if avg_fps > 0 else 0.033
+        duration = self.now()
         
-        drowsy_count = len([e for e in self.events if e['type'] == 'DROWSY'])
-        yawn_count = len([e for e in self.events if e['type'] == 'YAWN'])
-        distract_count = len([e for e in self.events if e['type'] == 'DISTRACTED'])
+        drowsy_count = len(self.episodes["DROWSY"])
+        yawn_count = len(self.episodes["YAWN"])
+        distract_count = len(self.episodes["DISTRACTED"])
         
-        drowsy_time = drowsy_count * seconds_per_frame
-        yawn_time = yawn_count * seconds_per_frame
-        distracted_time = distract_count * seconds_per_frame
+        # Exact time from episode boundaries
+        drowsy_time = self.time_in("DROWSY")
+        yawn_time = self.time_in("YAWN")
+        distracted_time = self.time_in("DISTRACTED")
 
-        # Scoring: Lose 10 points per sec of drowsiness, 2 per sec of distraction, 5 per yawn event?
-        # Actually yawning is continuousframes too.
+        # Scoring: Lose 5 points per sec of drowsiness, 2 per sec of distraction or yawning
         score = 100 - (drowsy_time * 5 + distracted_time * 2 + yawn_time * 2)
         
         return {
@@ -61,15 +164,39 @@ class SessionManager:
                 "distracted_str": f"{distracted_time:.1f}s",
                 "yawn_str": f"{yawn_time:.1f}s"
             },
+            "seconds": {
+                "drowsy": round(drowsy_time, 3),
+                "distracted": round(distracted_time, 3),
+                "yawn": round(yawn_time, 3),
+                "low_light": round(self.time_in("LOW_LIGHT"), 3),
+                "auth_lost": round(self.time_in("AUTH_LOST"), 3)
+            },
+            "averages": {
+                "ear": round(self.data_points.mean("ear"), 3),
+                "mar": round(self.data_points.mean("mar"), 3)
+            },
             "score": max(0, int(score)) 
         }
 
     def save_report(self, filepath="session_report.json"):
+        """
+        Finalizes the session. Samples and episodes were already streamed to the
+        session log, so this only closes open episodes and writes the small
+        summary + episode list.
+        """
+        if self.status == "ACTIVE":
+            self.close_episodes()
+            self.status = "FINISHED"
         report = {
+            "session_id": self.session_id,
             "summary": self.get_summary(),
             "events": self.events,
-            # "data": self.data_points # Optional: Save full data if needed
         }
+        if self.log:
+            self.log.finalize(report["summary"])
+            self.log = None
+        if self.history:
+            self.history.finish_session(self, report["summary"])
         with open(filepath, 'w') as f:
-            json.dump(report, f, indent=4)
+            json.dump(report, f)
         return report
@@ -1,66 +1,237 @@
 import time
-from collections import deque
-from config import EAR_THRESHOLD, EAR_FRAMES, MAR_THRESHOLD, MAR_FRAMES
+import numpy as np
+from config import (EAR_THRESHOLD, EAR_SECONDS, MAR_THRESHOLD, MAR_SECONDS, PERCLOS_WINDOW, PERCLOS_THRESHOLD,
+                    YAWN_WINDOW)
+
+BLINK_DEBOUNCE = 0.3 # Seconds between two eye closures for both to count as blinks
+BLINK_WINDOW = 60.0 # Blinks per minute
+MAX_GAP = 0.5 # Gaps between frames longer than this...
+GAP_FRAMES = 4 # ...and this many frame intervals (stalled camera) break runs and aren't counted as time
+
+
+class FrameGaps:
+    """
+    Time between consecutive samples. A gap (face lost, stalled camera) is a
+    delta longer than both MAX_GAP and GAP_FRAMES smoothed frame intervals,
+    so runs survive low frame rates.
+    """
+    def __init__(self, max_gap=MAX_GAP, frames=GAP_FRAMES):
+        self.max_gap = max_gap
+        self.frames = frames
+        self.interval = None # Smoothed frame interval
+        self.last_time = None
+
+    def step(self, timestamp):
+        """
+        Returns (dt, gap); dt is 0 for the first sample and across gaps.
+        """
+        if self.last_time is None:
+            self.last_time = timestamp
+            return 0.0, False
+        dt = timestamp - self.last_time
+        self.last_time = timestamp
+        if self.interval is None:
+            self.interval = dt
+            return dt, False
+        limit = max(self.max_gap, self.frames * self.interval)
+        # Gaps still count (clipped), so a frame rate that drops for good stops breaking runs after a few frames
+        self.interval = 0.9 * self.interval + 0.1 * min(dt, limit)
+        return (0.0, True) if dt > limit else (dt, False)
+
+
+class RingWindow:
+    """
+    Sliding time window of `ncols` running sums kept in a fixed ring of
+    `bins` time buckets. Adding a sample and reading the totals are O(1)
+    (amortized): buckets that fall out of the window are subtracted from the
+    totals and reused, so the window moves in steps of window / bins.
+    """
+    def __init__(self, window, bins=60, ncols=1):
+        self.window = window
+        self.bins = bins
+        self.width = window / bins
+        self.ring = np.zeros((bins, ncols))
+        self.totals = np.zeros(ncols)
+        self.current = None # Absolute index of the newest bucket
+
+    def advance(self, timestamp):
+        index = int(timestamp // self.width)
+        if self.current is None:
+            self.current = index
+        elif index > self.current:
+            # Evict every bucket we skipped over, at most one full turn
+            for i in range(self.current + 1, min(index, self.current + self.bins) + 1):
+                slot = i % self.bins
+                self.totals -= self.ring[slot]
+                self.ring[slot] = 0
+            self.current = index
+        return self.current % self.bins
+
+    def add(self, timestamp, values):
+        slot = self.advance(timestamp)
+        self.ring[slot] += values
+        self.totals += values
+
+    def sums(self, timestamp=None):
+        if timestamp is not None:
+            self.advance(timestamp)
+        return self.totals
+
 
 class Assessor:
-    def __init__(self):
-        self.ear_counter = 0
-        self.mar_counter = 0
+    """
+    Time-based drowsiness and yawn detection. Thresholds are in seconds, so
+    alert latency doesn't depend on the frame rate. Also tracks PERCLOS
+    (fraction of time the eyes were closed) and yawns per minute over sliding
+    windows. The EAR/MAR thresholds start at the config values and can be
+    replaced per driver with set_thresholds().
+    """
+    def __init__(self, ear_threshold=EAR_THRESHOLD, mar_threshold=MAR_THRESHOLD):
+        self.ear_threshold = ear_threshold
+        self.mar_threshold = mar_threshold
         self.drowsy = False
         self.yawning = False
-        
-        # Blink Rate Logic
-        self.last_ear_state = "OPEN" # OPEN or CLOSED
-        self.blinks = deque() # Timestamps of blinks
+        self.closed_since = None # Start of the current eyes-closed run
+        self.open_since = None # Start of the current mouth-open run
+        self.gaps = FrameGaps()
+
+        # [closed seconds, observed seconds]
+        self.perclos_window = RingWindow(PERCLOS_WINDOW, ncols=2)
+        self.yawn_window = RingWindow(YAWN_WINDOW)
+        self.blink_window = RingWindow(BLINK_WINDOW)
+        self.last_closure = None # Time of the last OPEN -> CLOSED transition
         self.bpm = 0
 
-    def update(self, ear, mar):
+    def update(self, ear, mar, timestamp=None):
         if ear is None or mar is None:
             return
 
-        current_time = time.time()
+        current_time = time.monotonic() if timestamp is None else timestamp
+        dt, gap = self.gaps.step(current_time)
+        if gap:
+            # Lost track for a while, don't stretch runs across the gap
+            self.closed_since = self.open_since = None
+
+        closed = ear < self.ear_threshold
+        self.perclos_window.add(current_time, (dt if closed else 0.0, dt))
 
         # Check Drowsiness (Eyes Closed) and Blink Detection
-        if ear < EAR_THRESHOLD:
-            self.ear_counter += 1
-            current_ear_state = "CLOSED"
+        if closed:
+            if self.closed_since is None:
+                self.closed_since = current_time
+                # Blink Detection (Transition from OPEN to CLOSED), debounced
+                if self.last_closure is None or current_time - self.last_closure > BLINK_DEBOUNCE:
+                    self.blink_window.add(current_time, 1)
+                self.last_closure = current_time
+            self.drowsy = current_time - self.closed_since >= EAR_SECONDS
         else:
-            self.ear_counter = 0
+            self.closed_since = None
             self.drowsy = False
-            current_ear_state = "OPEN"
-
-            # Blink Detection (Transition from OPEN to CLOSED)
-        # Add debounce: Only count blink if last blink was > 0.3 seconds ago
-        if self.last_ear_state == "OPEN" and current_ear_state == "CLOSED":
-            if not self.blinks or (current_time - self.blinks[-1] > 0.3):
-                self.blinks.append(current_time)
-            
-        self.last_ear_state = current_ear_state
-
-        # Clean old blinks (> 60 seconds ago)
-        while self.blinks and (current_time - self.blinks[0] > 60):
-            self.blinks.popleft()
-            
-        self.bpm = len(self.blinks)
-
-        if self.ear_counter >= EAR_FRAMES:
+        self.bpm = int(self.blink_window.sums(current_time)[0])
+
+        if PERCLOS_THRESHOLD is not None and self.get_perclos() >= PERCLOS_THRESHOLD:
             self.drowsy = True
 
         # Check Yawning (Mouth Open)
-        if mar > MAR_THRESHOLD:
-            self.mar_counter += 1
+        if mar > self.mar_threshold:
+            if self.open_since is None:
+                self.open_since = current_time
+            yawning = current_time - self.open_since >= MAR_SECONDS
+            if yawning and not self.yawning:
+                self.yawn_window.add(current_time, 1)
+            self.yawning = yawning
         else:
-            self.mar_counter = 0
+            self.open_since = None
             self.yawning = False
 
-        if self.mar_counter >= MAR_FRAMES:
-            self.yawning = True
+    def face_lost(self):
+        # Ends the current runs; the next face starts over (PERCLOS and rates keep their history)
+        self.closed_since = self.open_since = None
+        self.drowsy = self.yawning = False
+
+    def set_thresholds(self, ear_threshold, mar_threshold):
+        self.ear_threshold = ear_threshold
+        self.mar_threshold = mar_threshold
 
     def is_drowsy(self):
         return self.drowsy
 
     def is_yawning(self):
         return self.yawning
-        
+
     def get_bpm(self):
         return self.bpm
+
+    def get_perclos(self):
+        closed, observed = self.perclos_window.sums()
+        # Needs half a window of data before it means anything
+        if observed < PERCLOS_WINDOW / 2:
+            return 0.0
+        return float(closed / observed)
+
+    def get_yawn_rate(self):
+        # Yawns per minute over the yawn window
+        return float(self.yawn_window.sums()[0] * 60.0 / YAWN_WINDOW)
+
+
+def _run_starts(ts, active, breaks):
+    # For every sample, the timestamp at which its current run of `active` began
+    idx = np.arange(len(ts))
+    prev = np.concatenate([[False], active[:-1]])
+    begins = active & (~prev | breaks)
+    start_idx = np.maximum.accumulate(np.where(begins, idx, 0))
+    return ts[start_idx], begins
+
+def _window_sum(ts, values, window):
+    # Sum of values over (t - window, t] for every sample
+    cumulative = np.concatenate([[0.0], np.cumsum(values)])
+    lo = np.searchsorted(ts, ts - window, side="right")
+    return cumulative[1:] - cumulative[lo]
+
+def assess_series(ts, ear, mar, ear_threshold=EAR_THRESHOLD, mar_threshold=MAR_THRESHOLD):
+    """
+    Evaluates a whole recorded session at once, e.g. for offline threshold
+    tuning. ts, ear and mar are equal-length arrays (seconds, sorted).
+    Applies the same rules as Assessor.update, with exact instead of bucketed
+    sliding windows. Returns a dict of per-sample arrays: drowsy, yawning,
+    perclos, yawn_rate (per minute) and bpm.
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    ear = np.asarray(ear, dtype=np.float64)
+    mar = np.asarray(mar, dtype=np.float64)
+
+    dt = np.diff(ts, prepend=ts[:1])
+    # Face loss shows up as missing samples; the median stands in for the smoothed frame interval
+    breaks = dt > max(MAX_GAP, GAP_FRAMES * np.median(dt[1:])) if len(ts) > 1 else np.zeros(len(ts), dtype=bool)
+    dt[breaks] = 0.0
+
+    closed = ear < ear_threshold
+    closed_since, closures = _run_starts(ts, closed, breaks)
+    drowsy = closed & (ts - closed_since >= EAR_SECONDS)
+
+    closed_time = _window_sum(ts, np.where(closed, dt, 0.0), PERCLOS_WINDOW)
+    observed = _window_sum(ts, dt, PERCLOS_WINDOW)
+    perclos = np.where(observed >= PERCLOS_WINDOW / 2, closed_time / np.maximum(observed, 1e-9), 0.0)
+    if PERCLOS_THRESHOLD is not None:
+        drowsy |= perclos >= PERCLOS_THRESHOLD
+
+    # Blinks: eye closures at least BLINK_DEBOUNCE after the previous closure
+    closure_times = ts[closures]
+    debounced = np.diff(closure_times, prepend=-np.inf) > BLINK_DEBOUNCE
+    blinks = np.zeros(len(ts))
+    blinks[np.flatnonzero(closures)[debounced]] = 1
+    bpm = _window_sum(ts, blinks, BLINK_WINDOW)
+
+    mouth_open = mar > mar_threshold
+    open_since, _ = _run_starts(ts, mouth_open, breaks)
+    yawning = mouth_open & (ts - open_since >= MAR_SECONDS)
+    yawn_starts = yawning & ~np.concatenate([[False], yawning[:-1]])
+    yawn_rate = _window_sum(ts, yawn_starts.astype(np.float64), YAWN_WINDOW) * 60.0 / YAWN_WINDOW
+
+    return {
+        "drowsy": drowsy,
+        "yawning": yawning,
+        "perclos": perclos,
+        "yawn_rate": yawn_rate,
+        "bpm": bpm,
+    }
@@ -0,0 +1,161 @@
+import bisect
+import time
+from config import (CALIBRATION_SECONDS, CALIBRATION_EAR_RATIO, CALIBRATION_MAR_FACTOR, CALIBRATION_EAR_RANGE,
+                    CALIBRATION_MAR_RANGE)
+from src.assessor import FrameGaps
+
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile with the P-square algorithm (Jain &
+    Chlamtac, 1985): five markers whose heights are adjusted with a
+    piecewise-parabolic fit as samples arrive. O(1) memory and time per
+    sample, no samples are stored.
+    """
+    def __init__(self, p):
+        self.p = p
+        self.heights = [] # The first 5 samples (sorted), then the 5 marker heights
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+        self.count = 0
+
+    def add(self, x):
+        self.count += 1
+        q, n = self.heights, self.positions
+        if self.count <= 5:
+            bisect.insort(q, x)
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i]) # Linear fallback
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            return self.heights[int(round(self.p * (self.count - 1)))]
+        return self.heights[2]
+
+    def state(self):
+        return {"p": self.p, "count": self.count, "heights": list(self.heights),
+                "positions": list(self.positions), "desired": list(self.desired)}
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state["p"])
+        sketch.count = state["count"]
+        sketch.heights = list(state["heights"])
+        sketch.positions = list(state["positions"])
+        sketch.desired = list(state["desired"])
+        return sketch
+
+
+class Calibrator:
+    """
+    Per-driver EAR/MAR thresholds from the driver's own distribution. The
+    open-eye baseline is the median EAR and the speaking/smiling range the
+    95th percentile MAR, both tracked with P-square sketches, so memory and
+    per-frame cost don't grow with the session. Thresholds apply once
+    `seconds` of face time were observed (a driver with a stored calibration
+    starts calibrated) and keep adapting for the rest of the session.
+    """
+    def __init__(self, seconds=CALIBRATION_SECONDS, ear_ratio=CALIBRATION_EAR_RATIO,
+                 mar_factor=CALIBRATION_MAR_FACTOR, ear_range=CALIBRATION_EAR_RANGE, mar_range=CALIBRATION_MAR_RANGE):
+        self.seconds = seconds
+        self.ear_ratio = ear_ratio
+        self.mar_factor = mar_factor
+        self.ear_range = ear_range
+        self.mar_range = mar_range
+        self.driver = None
+        self.saved = {} # Calibration states of drivers seen earlier in this session
+        self.recognized = False # Whether any driver was recognized yet
+        self.reset()
+
+    def reset(self):
+        self.ear = P2Quantile(0.5)
+        self.mar = P2Quantile(0.95)
+        self.observed = 0.0 # Seconds of face time sampled
+        self.gaps = FrameGaps() # Gaps (face lost) don't count as calibration time
+
+    def update(self, ear, mar, timestamp=None):
+        if ear is None or mar is None:
+            return
+        dt, _ = self.gaps.step(time.monotonic() if timestamp is None else timestamp)
+        self.observed += dt
+        self.ear.add(float(ear))
+        self.mar.add(float(mar))
+
+    def calibrated(self):
+        return self.observed >= self.seconds
+
+    def thresholds(self):
+        """
+        (ear_threshold, mar_threshold) once calibrated, else None.
+        """
+        if not self.calibrated():
+            return None
+        ear = min(max(self.ear.value() * self.ear_ratio, self.ear_range[0]), self.ear_range[1])
+        mar = min(max(self.mar.value() * self.mar_factor, self.mar_range[0]), self.mar_range[1])
+        return ear, mar
+
+    def use_driver(self, name, stored=None):
+        """
+        Switches to a recognized driver, or to an unknown one (None) who
+        starts over from fresh sketches. A known driver's stored calibration
+        is resumed; without one, samples taken before the first recognition
+        of the session count for them, later ones never do.
+        """
+        if self.driver is not None:
+            self.saved[self.driver] = self.state()
+        if name is not None:
+            stored = self.saved.pop(name, None) or stored # Seen earlier in this session
+        if name is not None and stored:
+            self.ear = P2Quantile.from_state(stored["ear_sketch"])
+            self.mar = P2Quantile.from_state(stored["mar_sketch"])
+            self.observed = stored["seconds"]
+            self.gaps = FrameGaps()
+        elif self.recognized:
+            self.reset()
+        self.recognized = self.recognized or name is not None
+        self.driver = name
+
+    def state(self):
+        thresholds = self.thresholds()
+        return {
+            "ear_threshold": round(thresholds[0], 4) if thresholds else None,
+            "mar_threshold": round(thresholds[1], 4) if thresholds else None,
+            "seconds": round(self.observed, 1),
+            "ear_sketch": self.ear.state(),
+            "mar_sketch": self.mar.state(),
+        }
+
+    def states(self):
+        # Every driver calibrated in this session, for persisting
+        states = dict(self.saved)
+        if self.driver is not None:
+            states[self.driver] = self.state()
+        return states
@@ -1,43 +1,27 @@
 import cv2
-import threading
 import time
+from src.sources import FrameSource
 
-class Camera:
+class Camera(FrameSource):
     def __init__(self, src=0, width=640, height=480):
+        super().__init__()
         self.src = src
         self.cap = cv2.VideoCapture(self.src)
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        self.grabbed, self.frame = self.cap.read()
-        self.started = False
-        self.read_lock = threading.Lock()
+        self.grabbed, frame = self.cap.read()
+        if self.grabbed:
+            self.publish(frame, time.time())
+        self.max_backoff = 0.5 # Device errors: back off up to 500ms
 
-    def start(self):
-        if self.started:
-            print("Camera already started.")
-            return self
-        self.started = True
-        self.thread = threading.Thread(target=self.update, args=())
-        self.thread.start()
-        return self
+    def grab(self):
+        # Blocks on the device until the next frame is delivered,
+        # decoding straight into the next ring slot
+        grabbed, frame = self.cap.read(self.next_buffer())
+        self.grabbed = grabbed
+        if not grabbed:
+            return None
+        return frame, time.time()
 
-    def update(self):
-        while self.started:
-            grabbed, frame = self.cap.read()
-            with self.read_lock:
-                self.grabbed = grabbed
-                self.frame = frame
-
-    def read(self):
-        with self.read_lock:
-            frame = self.frame.copy() if self.frame is not None else None
-            return frame
-
-    def stop(self):
-        self.started = False
-        if hasattr(self, 'thread'):
-            self.thread.join()
+    def release(self):
         self.cap.release()
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.stop()
@@ -1,10 +1,29 @@
 import cv2
-import mediapipe as mp
 import numpy as np
-import scipy.spatial.distance as dist
+from config import DETECTOR_TRACKING, ROI_PADDING, ROI_TARGET_SIZE, ROI_REFRESH_FRAMES
+
+NUM_LANDMARKS = 478 # FaceMesh with refine_landmarks=True
+
+def landmarks_to_array(landmarks, w, h):
+    """
+    Converts a MediaPipe landmark list into a contiguous float32 (478, 3) array
+    in pixel space, so every consumer can index it instead of walking protobufs.
+    z is scaled by the frame width, matching MediaPipe's convention.
+    """
+    source = landmarks.landmark
+    points = np.fromiter(
+        (v for p in source for v in (p.x, p.y, p.z)),
+        dtype=np.float32,
+        count=len(source) * 3
+    ).reshape(-1, 3)
+    points *= np.array([w, h, w], dtype=np.float32)
+    return points
 
 class Detector:
-    def __init__(self):
+    def __init__(self, tracking=DETECTOR_TRACKING, roi_padding=ROI_PADDING,
+                 roi_target_size=ROI_TARGET_SIZE, refresh_interval=ROI_REFRESH_FRAMES):
+        # Imported here, not at module level: loading MediaPipe takes seconds
+        import mediapipe as mp
         self.mp_face_mesh = mp.solutions.face_mesh
         self.face_mesh = self.mp_face_mesh.FaceMesh(
             min_detection_confidence=0.5,
@@ -33,6 +52,27 @@ class Detector:
             [61, 291] # Left Corner / Right Corner (Horizontal)
         ]
 
+        # Index arrays for vectorized gathers
+        self.EYES = np.array([self.LEFT_EYE, self.RIGHT_EYE])
+        self.MAR_PAIRS = np.array(self.MAR_POINTS)
+
+        # ROI tracking: run FaceMesh on a padded crop around the last face
+        self.tracking = tracking
+        self.roi_padding = roi_padding
+        self.roi_target_size = roi_target_size # Face size (px) the crop is downscaled to, None = no scaling
+        self.refresh_interval = refresh_interval # Full-frame search every N frames
+        self.roi = None # (x0, y0, x1, y1) in frame pixels
+        self.frames_since_refresh = 0
+
+    def warm_up(self, width, height):
+        """
+        Runs one inference on a blank frame so graph initialization isn't paid
+        on the first real frame.
+        """
+        self.get_landmarks(np.zeros((height, width, 3), dtype=np.uint8))
+        self.roi = None
+        self.frames_since_refresh = 0
+
     def get_landmarks(self, frame):
         frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         results = self.face_mesh.process(frame_rgb)
@@ -40,24 +80,86 @@ class Detector:
             return results.multi_face_landmarks[0] # Use first face
         return None
 
-    def calculate_ear(self, landmarks, indices, w, h):
+    def compute_roi(self, points, w, h):
+        # Padded square box around the previous landmarks, clipped to the frame
+        x_min, y_min = points[:, 0].min(), points[:, 1].min()
+        x_max, y_max = points[:, 0].max(), points[:, 1].max()
+        side = max(x_max - x_min, y_max - y_min) * (1.0 + 2.0 * self.roi_padding)
+        cx, cy = (x_min + x_max) / 2.0, (y_min + y_max) / 2.0
+        x0, y0 = int(max(0, cx - side / 2)), int(max(0, cy - side / 2))
+        x1, y1 = int(min(w, cx + side / 2)), int(min(h, cy + side / 2))
+        if x1 - x0 < 32 or y1 - y0 < 32:
+            return None
+        return x0, y0, x1, y1
+
+    def detect_roi(self, frame, roi):
+        """
+        Runs FaceMesh on a crop and maps the landmarks back to full-frame pixels.
+        """
+        x0, y0, x1, y1 = roi
+        crop = frame[y0:y1, x0:x1]
+        crop_w, crop_h = x1 - x0, y1 - y0
+
+        if self.roi_target_size:
+            # The face spans about 1 / (1 + 2 * padding) of the crop
+            face_size = max(crop_w, crop_h) / (1.0 + 2.0 * self.roi_padding)
+            scale = self.roi_target_size / face_size
+            if scale < 1.0:
+                crop = cv2.resize(crop, (max(1, int(crop_w * scale)), max(1, int(crop_h * scale))), interpolation=cv2.INTER_AREA)
+
+        landmarks = self.get_landmarks(crop)
+        if not landmarks:
+            return None
+
+        # Normalized crop coordinates don't depend on the downscale factor
+        points = landmarks_to_array(landmarks, crop_w, crop_h)
+        points[:, 0] += x0
+        points[:, 1] += y0
+        return points
+
+    def detect_points(self, frame):
+        """
+        Returns the (478, 3) pixel-space landmark array for the first face, or None.
+        In tracking mode, searches the previous face ROI first and falls back to
+        the full frame on loss or every refresh_interval frames.
+        """
+        h, w = frame.shape[:2]
+
+        if self.tracking and self.roi is not None and self.frames_since_refresh < self.refresh_interval:
+            self.frames_since_refresh += 1
+            points = self.detect_roi(frame, self.roi)
+            if points is not None:
+                self.roi = self.compute_roi(points, w, h)
+                return points
+
+        # Full-frame search
+        self.frames_since_refresh = 0
+        landmarks = self.get_landmarks(frame)
+        if not landmarks:
+            self.roi = None
+            return None
+        points = landmarks_to_array(landmarks, w, h)
+        if self.tracking:
+            self.roi = self.compute_roi(points, w, h)
+        return points
+
+    def calculate_ear(self, points, indices):
         # EAR = (|p2-p6| + |p3-p5|) / (2 * |p1-p4|)
-        # indices: [p1, p2, p3, p4, p5, p6]
+        # indices: [p1, p2, p3, p4, p5, p6], or a (k, 6) array for k eyes at once
         # p1=0, p4=3 (horizontal)
-        
-        pts = np.array([(landmarks.landmark[i].x * w, landmarks.landmark[i].y * h) for i in indices])
+        eye = points[indices, :2]
         
         # Vertical distances
-        A = dist.euclidean(pts[1], pts[5])
-        B = dist.euclidean(pts[2], pts[4])
+        A = np.linalg.norm(eye[..., 1, :] - eye[..., 5, :], axis=-1)
+        B = np.linalg.norm(eye[..., 2, :] - eye[..., 4, :], axis=-1)
         
         # Horizontal distance
-        C = dist.euclidean(pts[0], pts[3])
+        C = np.linalg.norm(eye[..., 0, :] - eye[..., 3, :], axis=-1)
         
         ear = (A + B) / (2.0 * C)
         return ear
 
-    def calculate_mar(self, landmarks, w, h):
+    def calculate_mar(self, points):
         # A = dist(13, 14)
         # B = dist(37, 84)
         # C = dist(267, 314)
@@ -65,34 +167,24 @@ class Detector:
         # MAR = (A + B + C) / (3 * D) -- average vertical / horizontal
         
         # Points from self.MAR_POINTS
-        p_13 = (landmarks.landmark[13].x * w, landmarks.landmark[13].y * h)
-        p_14 = (landmarks.landmark[14].x * w, landmarks.landmark[14].y * h)
-        p_37 = (landmarks.landmark[37].x * w, landmarks.landmark[37].y * h)
-        p_84 = (landmarks.landmark[84].x * w, landmarks.landmark[84].y * h)
-        p_267 = (landmarks.landmark[267].x * w, landmarks.landmark[267].y * h)
-        p_314 = (landmarks.landmark[314].x * w, landmarks.landmark[314].y * h)
-        p_61 = (landmarks.landmark[61].x * w, landmarks.landmark[61].y * h)
-        p_291 = (landmarks.landmark[291].x * w, landmarks.landmark[291].y * h)
-        
-        A = dist.euclidean(p_13, p_14)
-        B = dist.euclidean(p_37, p_84)
-        C = dist.euclidean(p_267, p_314)
-        D = dist.euclidean(p_61, p_291)
+        d = np.linalg.norm(points[self.MAR_PAIRS[:, 0], :2] - points[self.MAR_PAIRS[:, 1], :2], axis=1)
         
-        mar = (A + B + C) / (3.0 * D)
-        return mar
+        mar = (d[0] + d[1] + d[2]) / (3.0 * d[3])
+        return float(mar)
 
     def process_frame(self, frame):
-        h, w = frame.shape[:2]
-        landmarks = self.get_landmarks(frame)
+        """
+        Returns (ear, mar, points) where points is the (478, 3) pixel-space
+        landmark array, or (None, None, None) when no face is found.
+        """
+        points = self.detect_points(frame)
         
-        if landmarks:
-            left_ear = self.calculate_ear(landmarks, self.LEFT_EYE, w, h)
-            right_ear = self.calculate_ear(landmarks, self.RIGHT_EYE, w, h)
-            avg_ear = (left_ear + right_ear) / 2.0
+        if points is not None:
+            # Left and right eye in one gather
+            avg_ear = float(self.calculate_ear(points, self.EYES).mean())
             
-            mar = self.calculate_mar(landmarks, w, h)
+            mar = self.calculate_mar(points)
             
-            return avg_ear, mar, landmarks
+            return avg_ear, mar, points
         
         return None, None, None
@@ -0,0 +1,105 @@
+import threading
+import time
+import cv2
+from src.metrics import metrics as default_metrics, SIZE_BUCKETS
+
+
+class FrameEncoder:
+    """
+    JPEG encoding stage on its own thread, so encode time never adds to
+    detection latency. Holds only the latest submitted frame, optionally
+    downscales it for preview, and adapts JPEG quality to stay within an
+    encode-time and output-size budget.
+    """
+    def __init__(self, broadcaster, quality=80, min_quality=40, max_quality=90, preview_width=None,
+                 time_budget=0.010, size_budget=None, metrics=None):
+        self.broadcaster = broadcaster
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.preview_width = preview_width
+        self.time_budget = time_budget # Seconds per encode
+        self.size_budget = size_budget # Bytes per frame, None = unlimited
+        self.metrics = metrics if metrics is not None else default_metrics
+
+        self.condition = threading.Condition()
+        self.pending = None
+        self.started = False
+
+        # Smoothed cost of recent encodes
+        self.avg_time = 0.0
+        self.avg_size = 0.0
+        self.encodes = 0
+
+    def start(self):
+        if self.started:
+            return self
+        self.started = True
+        self.metrics.gauge("jpeg_quality", lambda: self.quality)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.started = False
+            self.condition.notify_all()
+        if hasattr(self, 'thread'):
+            self.thread.join()
+
+    def submit(self, frame):
+        """
+        Hands a frame to the encoder without blocking. An older frame that
+        hasn't been encoded yet is replaced. The encoder takes ownership.
+        """
+        with self.condition:
+            self.pending = frame
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None or not self.started)
+                if not self.started:
+                    return
+                frame, self.pending = self.pending, None
+
+            payload = self.encode(frame)
+            if payload is not None:
+                self.broadcaster.publish(payload)
+
+    def encode(self, frame):
+        if self.preview_width and frame.shape[1] > self.preview_width:
+            h, w = frame.shape[:2]
+            frame = cv2.resize(frame, (self.preview_width, int(h * self.preview_width / w)), interpolation=cv2.INTER_AREA)
+
+        start = time.perf_counter()
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(self.quality)])
+        elapsed = time.perf_counter() - start
+        if not ret:
+            return None
+
+        self.metrics.observe("stage_latency_seconds", elapsed, labels=(("stage", "encode"),))
+        self.metrics.observe("encoded_frame_bytes", buffer.nbytes, buckets=SIZE_BUCKETS)
+        self.adapt(elapsed, buffer.nbytes)
+        return buffer.tobytes()
+
+    def adapt(self, elapsed, size):
+        # Back off quickly when over budget, recover slowly when well under it
+        if self.avg_time == 0.0:
+            self.avg_time, self.avg_size = elapsed, size
+        else:
+            self.avg_time = 0.9 * self.avg_time + 0.1 * elapsed
+            self.avg_size = 0.9 * self.avg_size + 0.1 * size
+
+        # Re-evaluate every 10 frames so the averages can catch up with a change
+        self.encodes += 1
+        if self.encodes % 10:
+            return
+
+        over = self.avg_time > self.time_budget or (self.size_budget and self.avg_size > self.size_budget)
+        under = self.avg_time < 0.7 * self.time_budget and (not self.size_budget or self.avg_size < 0.7 * self.size_budget)
+        if over:
+            self.quality = max(self.min_quality, self.quality - 5)
+        elif under:
+            self.quality = min(self.max_quality, self.quality + 1)
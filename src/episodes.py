@@ -0,0 +1,69 @@
+from bisect import bisect_left, bisect_right
+
+
+class IntervalIndex:
+    """
+    Non-overlapping [start, end) intervals of one episode type, appended in
+    time order. Sorted start/end lists plus a prefix sum of durations give
+    O(log n) overlap and total-time queries.
+    """
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.cumulative = [0.0] # cumulative[i] = total duration of the first i intervals
+        self.open_start = None # Start of the episode still in progress
+
+    def open(self, start):
+        if self.open_start is None:
+            self.open_start = start
+
+    def close(self, end):
+        if self.open_start is None:
+            return None
+        start = self.open_start
+        self.open_start = None
+        end = max(end, start)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.cumulative.append(self.cumulative[-1] + (end - start))
+        return start, end
+
+    def is_open(self):
+        return self.open_start is not None
+
+    def __len__(self):
+        return len(self.starts) + (1 if self.open_start is not None else 0)
+
+    def overlapping(self, t1, t2, now=None):
+        """
+        Returns the (start, end) intervals that overlap [t1, t2].
+        The open episode, if any, is treated as ending at `now`.
+        """
+        lo = bisect_right(self.ends, t1)
+        hi = bisect_left(self.starts, t2)
+        result = list(zip(self.starts[lo:hi], self.ends[lo:hi]))
+        if self.open_start is not None and now is not None and self.open_start < t2 and now > t1:
+            result.append((self.open_start, now))
+        return result
+
+    def total(self, t1=None, t2=None, now=None):
+        """
+        Total time covered inside [t1, t2] (defaults: whole session).
+        """
+        if t1 is None:
+            t1 = float("-inf")
+        if t2 is None:
+            t2 = float("inf")
+
+        lo = bisect_right(self.ends, t1)
+        hi = bisect_left(self.starts, t2)
+        total = 0.0
+        if hi > lo:
+            total = self.cumulative[hi] - self.cumulative[lo]
+            # Clip the first and last interval to the query range
+            total -= max(0.0, t1 - self.starts[lo])
+            total -= max(0.0, self.ends[hi - 1] - t2)
+
+        if self.open_start is not None and now is not None:
+            total += max(0.0, min(now, t2) - max(self.open_start, t1))
+        return total
@@ -0,0 +1,242 @@
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+import cv2
+from config import (FRAME_WIDTH, FRAME_HEIGHT, ALARM_FILE, FLEET_AUDIO_ALERTS, FLEET_RESTART_BACKOFF, FLEET_STALL_SECONDS,
+                    FLEET_METRICS_INTERVAL, SESSION_LOG_DIR, HISTORY_DB, HISTORY_SERIES_RESOLUTION)
+from src.pipeline import FrameBroadcaster
+from src.metrics import metrics
+
+
+STATUS_HEARTBEAT = 1.0 # Seconds; an unchanged status is re-sent this often, so the parent sees the worker is up
+
+
+def run_worker(stream_id, spec, frame_queue, status_queue, viewers, stop_event):
+    """
+    Entry point of a stream worker process: owns its own source, Detector,
+    Assessor, HeadPoseEstimator and SessionManager. Encoded frames go back
+    to the parent only while it has viewers (`viewers`, a shared count, so
+    HEADLESS_WHEN_IDLE applies per stream); status updates, with a snapshot
+    of its metrics every FLEET_METRICS_INTERVAL seconds, go on their own
+    queue either way. Exits non-zero if the pipeline thread dies or no frame
+    is processed for FLEET_STALL_SECONDS, so the supervisor restarts it.
+    """
+    # Heavy imports happen in the child, one MediaPipe graph per process
+    from src.sources import open_source
+    from src.detector import Detector
+    from src.assessor import Assessor
+    from src.head_pose import HeadPoseEstimator
+    from src.analytics import SessionManager, new_session_id
+    from src.identity import IdentityManager
+    from src.alerter import Alerter
+    from src.pipeline import Pipeline
+    from src.history import HistoryStore
+
+    # One worker per core: keep OpenCV from spawning its own thread pool in each
+    cv2.setNumThreads(1)
+
+    # Warm the graph up before the source starts delivering frames
+    detector = Detector()
+    detector.warm_up(FRAME_WIDTH, FRAME_HEIGHT)
+
+    source = open_source(spec, width=FRAME_WIDTH, height=FRAME_HEIGHT).start()
+    # N cabs can't share one speaker, but log/webhook sinks still apply
+    alerter = Alerter(ALARM_FILE if FLEET_AUDIO_ALERTS else None, stream=stream_id)
+    # Every worker writes the shared history database through its own connection
+    history = HistoryStore(HISTORY_DB, series_resolution=HISTORY_SERIES_RESOLUTION) if HISTORY_DB else None
+    session_manager = SessionManager(log_dir=SESSION_LOG_DIR, session_id=new_session_id(time.time(), stream_id),
+                                     history=history, stream=stream_id)
+    pipeline = Pipeline(source, detector, Assessor(), alerter,
+                        HeadPoseEstimator(FRAME_WIDTH, FRAME_HEIGHT), session_manager, IdentityManager(),
+                        viewers=lambda: viewers.value).start()
+    # Not viewers themselves: the pipeline renders by the parent's count, these only forward
+    frames = pipeline.broadcaster.subscribe()
+    statuses = pipeline.status_broadcaster.subscribe()
+
+    failed = None
+    seen_seq = 0
+    last_progress = time.monotonic()
+    last_status = last_metrics = 0.0
+    try:
+        while not stop_event.is_set():
+            frame = frames.get(timeout=0.1)
+            now = time.monotonic()
+            if frame is not None:
+                try:
+                    frame_queue.put_nowait(frame)
+                except queue.Full:
+                    pass # Parent is behind; it only ever wants the latest frame
+
+            if pipeline.last_seq != seen_seq:
+                seen_seq, last_progress = pipeline.last_seq, now
+            elif not pipeline.thread.is_alive():
+                if source.finished:
+                    break # Source played out
+                failed = "pipeline stopped"
+                break
+            elif now - last_progress > FLEET_STALL_SECONDS:
+                failed = f"no frames for {FLEET_STALL_SECONDS:.0f}s"
+                break
+
+            status = statuses.get(timeout=0)
+            if status is None and seen_seq and now - last_status >= STATUS_HEARTBEAT:
+                status = pipeline.get_status()
+            if status is None:
+                continue
+            snapshot = None
+            if metrics.enabled and now - last_metrics >= FLEET_METRICS_INTERVAL:
+                snapshot = metrics.export()
+            try:
+                status_queue.put_nowait((status, snapshot))
+                last_status = now
+                if snapshot is not None:
+                    last_metrics = now
+            except queue.Full:
+                pass # The snapshot goes with the next status
+    finally:
+        frames.close()
+        statuses.close()
+        pipeline.stop()
+        if failed is None:
+            source.stop() # A dead device can block the capture thread for good; it dies with the process
+        alerter.stop()
+        session_manager.save_report(f"session_report_{stream_id}.json")
+        if history:
+            history.close()
+    if failed:
+        print(f"Stream {stream_id} worker: {failed}, exiting for a restart")
+        sys.exit(1)
+
+
+class StreamHandle:
+    """
+    Parent-side view of one stream: the worker process, its frame and
+    status queues, the viewer count it shares with the worker and local
+    broadcasters for /stream/<id>/video_feed and /events clients.
+    """
+    def __init__(self, stream_id, spec):
+        self.stream_id = stream_id
+        self.spec = spec
+        self.broadcaster = FrameBroadcaster()
+        self.status_broadcaster = FrameBroadcaster()
+        self.lock = threading.Lock()
+        self.status = {}
+        self.process = None
+        self.queue = None
+        self.status_queue = None
+        self.viewers = None
+        self.stop_event = None
+        self.restarts = 0
+        self.last_start = 0.0
+        self.last_status_time = 0.0
+
+    def get_status(self):
+        with self.lock:
+            status = dict(self.status)
+        status["alive"] = self.process is not None and self.process.is_alive()
+        status["restarts"] = self.restarts
+        return status
+
+    def ready(self):
+        # Worker running and processing frames (it reported a status) since it was (re)started
+        return self.process is not None and self.process.is_alive() and self.last_status_time >= self.last_start
+
+
+class Fleet:
+    """
+    Runs one inference worker process per configured stream, so MediaPipe
+    scales across cores instead of contending for the GIL, and restarts
+    workers that crash.
+    """
+    def __init__(self, streams):
+        self.context = multiprocessing.get_context("spawn") # MediaPipe is not fork-safe
+        self.streams = {str(stream_id): StreamHandle(str(stream_id), spec) for stream_id, spec in streams.items()}
+        self.started = False
+
+    def start(self):
+        if self.started:
+            return self
+        self.started = True
+        for handle in self.streams.values():
+            self.spawn(handle)
+            threading.Thread(target=self.read, args=(handle,), daemon=True).start()
+            threading.Thread(target=self.read_status, args=(handle,), daemon=True).start()
+        self.supervisor = threading.Thread(target=self.supervise, daemon=True)
+        self.supervisor.start()
+        return self
+
+    def spawn(self, handle):
+        handle.queue = self.context.Queue(maxsize=2)
+        handle.status_queue = self.context.Queue(maxsize=8)
+        if handle.viewers is None:
+            handle.viewers = self.context.Value("i", 0, lock=False) # Written by the parent only
+        handle.stop_event = self.context.Event()
+        handle.process = self.context.Process(
+            target=run_worker,
+            args=(handle.stream_id, handle.spec, handle.queue, handle.status_queue, handle.viewers,
+                  handle.stop_event),
+            name=f"stream-{handle.stream_id}",
+            daemon=True)
+        handle.last_start = time.time()
+        handle.process.start()
+
+    def read(self, handle):
+        # Moves frames from the worker's queue into the local broadcaster, and tells the
+        # worker how many viewers there are (none: it stops encoding)
+        while self.started:
+            handle.viewers.value = handle.broadcaster.client_count()
+            try:
+                frame = handle.queue.get(timeout=0.2)
+            except (queue.Empty, EOFError, OSError):
+                continue
+            handle.broadcaster.publish(frame)
+
+    def read_status(self, handle):
+        while self.started:
+            try:
+                status, snapshot = handle.status_queue.get(timeout=0.5)
+            except (queue.Empty, EOFError, OSError):
+                continue
+            if snapshot is not None:
+                metrics.set_remote(handle.stream_id, snapshot)
+            with handle.lock:
+                handle.status = status
+            handle.last_status_time = time.time()
+            handle.status_broadcaster.publish(status)
+
+    def supervise(self):
+        while self.started:
+            for handle in self.streams.values():
+                process = handle.process
+                if process is None or process.is_alive():
+                    continue
+                if process.exitcode == 0:
+                    continue # Stopped on purpose or the recorded source played out
+                # Crashed (or source died): restart with backoff to avoid a hot loop
+                if time.time() - handle.last_start < FLEET_RESTART_BACKOFF:
+                    continue
+                print(f"Stream {handle.stream_id} worker exited ({process.exitcode}), restarting")
+                handle.restarts += 1
+                self.spawn(handle)
+            time.sleep(0.5)
+
+    def ready(self):
+        return all(handle.ready() for handle in self.streams.values())
+
+    def get(self, stream_id):
+        return self.streams.get(str(stream_id))
+
+    def stop(self):
+        self.started = False
+        for handle in self.streams.values():
+            if handle.stop_event is not None:
+                handle.stop_event.set()
+        for handle in self.streams.values():
+            if handle.process is not None:
+                handle.process.join(timeout=5)
+                if handle.process.is_alive():
+                    handle.process.terminate()
+            handle.broadcaster.close()
+            handle.status_broadcaster.close()
@@ -1,11 +1,59 @@
+import math
+import time
 import cv2
 import numpy as np
+from config import HEAD_POSE_TRACKING, HEAD_POSE_EXTENDED, HEAD_POSE_MIN_CUTOFF, HEAD_POSE_BETA
+
+
+class OneEuroFilter:
+    """
+    One Euro filter (Casiez et al.): a low-pass whose cutoff rises with the
+    signal's speed, so a still head doesn't jitter and a real turn isn't lagged.
+    Filters a small vector of values sampled at irregular timestamps.
+    """
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.x = None
+        self.dx = None
+        self.t = None
+
+    @staticmethod
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, x, t):
+        x = np.asarray(x, dtype=np.float64)
+        if self.x is None or t <= self.t:
+            self.x, self.dx, self.t = x, np.zeros_like(x), t
+            return x
+        dt = t - self.t
+        self.t = t
+
+        a_d = self.alpha(self.d_cutoff, dt)
+        self.dx = self.dx + a_d * ((x - self.x) / dt - self.dx)
+        cutoff = self.min_cutoff + self.beta * np.abs(self.dx)
+        self.x = self.x + self.alpha(cutoff, dt) * (x - self.x)
+        return self.x
+
 
 class HeadPoseEstimator:
-    def __init__(self, frame_width, frame_height):
+    def __init__(self, frame_width, frame_height, tracking=HEAD_POSE_TRACKING, extended=HEAD_POSE_EXTENDED,
+                 min_cutoff=HEAD_POSE_MIN_CUTOFF, beta=HEAD_POSE_BETA):
+        """
+        tracking=True warm-starts the solver from the previous frame's pose
+        and smooths the angles with a One Euro filter. extended=True solves
+        on a few more rigid landmarks (inner eye corners, nose bridge,
+        subnasale) for a steadier fit.
+        """
         self.w = frame_width
         self.h = frame_height
-        
+
         # 3D model points (Generic human face)
         self.model_points = np.array([
             (0.0, 0.0, 0.0),             # Nose tip
@@ -15,6 +63,16 @@ class HeadPoseEstimator:
             (-150.0, -150.0, -125.0),    # Left Mouth corner
             (150.0, -150.0, -125.0)      # Right Mouth corner
         ])
+        self.landmarks = list(self.POSE_LANDMARKS)
+        if extended:
+            # Approximate positions on the same generic face
+            self.model_points = np.vstack([self.model_points, [
+                (-75.0, 170.0, -110.0),  # Left eye inner corner
+                (75.0, 170.0, -110.0),   # Right eye inner corner
+                (0.0, 170.0, -75.0),     # Nose bridge
+                (0.0, -45.0, -40.0),     # Subnasale
+            ]])
+            self.landmarks += self.EXTENDED_LANDMARKS
 
         # Camera internals
         self.focal_length = self.w
@@ -26,26 +84,42 @@ class HeadPoseEstimator:
         )
         self.dist_coeffs = np.zeros((4, 1)) # Assuming no lens distortion
 
-    def get_pose(self, landmarks):
-        # 2D image points from MediaPipe landmarks
-        # Indices: Nose tip (1), Chin (152), Left Eye Left (33), Right Eye Right (263), Left Mouth (61), Right Mouth (291)
-        # Note: MP uses 263 for right eye outer corner, 33 for left eye outer corner.
-        
-        # Mapping MP landmarks to Model points
-        image_points = np.array([
-            (landmarks.landmark[1].x * self.w, landmarks.landmark[1].y * self.h),     # Nose tip
-            (landmarks.landmark[152].x * self.w, landmarks.landmark[152].y * self.h), # Chin
-            (landmarks.landmark[33].x * self.w, landmarks.landmark[33].y * self.h),   # Left eye left corner
-            (landmarks.landmark[263].x * self.w, landmarks.landmark[263].y * self.h), # Right eye right corner
-            (landmarks.landmark[61].x * self.w, landmarks.landmark[61].y * self.h),   # Left Mouth corner
-            (landmarks.landmark[291].x * self.w, landmarks.landmark[291].y * self.h)  # Right Mouth corner
-        ], dtype="double")
+        self.tracking = tracking
+        self.filter = OneEuroFilter(min_cutoff, beta)
+        self.rvec = None # Pose of the last estimate() call
+        self.tvec = None
+
+    # Indices: Nose tip (1), Chin (152), Left Eye Left (33), Right Eye Right (263), Left Mouth (61), Right Mouth (291)
+    # Note: MP uses 263 for right eye outer corner, 33 for left eye outer corner.
+    POSE_LANDMARKS = [1, 152, 33, 263, 61, 291]
+    # Left Eye Inner (133), Right Eye Inner (362), Nose Bridge (168), Subnasale (2)
+    EXTENDED_LANDMARKS = [133, 362, 168, 2]
+
+    def get_pose(self, points, guess=None):
+        # 2D image points sliced from the shared (478, 3) pixel-space landmark array
+        # Mapping MP landmarks to Model points (same order as self.model_points)
+        image_points = points[self.landmarks, :2].astype(np.float64)
+
+        if guess is not None:
+            # Starting from the previous pose the solver converges in a couple of iterations
+            (success, rotation_vector, translation_vector) = cv2.solvePnP(
+                self.model_points,
+                image_points,
+                self.camera_matrix,
+                self.dist_coeffs,
+                rvec=guess[0].copy(),
+                tvec=guess[1].copy(),
+                useExtrinsicGuess=True,
+                flags=cv2.SOLVEPNP_ITERATIVE
+            )
+            if success and translation_vector[2, 0] > 0:
+                return rotation_vector, translation_vector
 
         (success, rotation_vector, translation_vector) = cv2.solvePnP(
-            self.model_points, 
-            image_points, 
-            self.camera_matrix, 
-            self.dist_coeffs, 
+            self.model_points,
+            image_points,
+            self.camera_matrix,
+            self.dist_coeffs,
             flags=cv2.SOLVEPNP_ITERATIVE
         )
 
@@ -58,3 +132,62 @@ class HeadPoseEstimator:
 
         # Pitch: x, Yaw: y, Roll: z
         return angles[0], angles[1], angles[2]
+
+    @staticmethod
+    def normalize_pitch(pitch):
+        # RQDecomp3x3 reports a face looking at the camera as pitch ~ +/-180
+        if pitch < -90:
+            pitch += 180
+        elif pitch > 90:
+            pitch -= 180
+        return pitch
+
+    def estimate(self, points, timestamp=None):
+        """
+        Pose of one frame as normalized (pitch, yaw, roll) in degrees,
+        warm-started and smoothed when tracking. Keeps rvec/tvec for nose_axis().
+        """
+        guess = (self.rvec, self.tvec) if self.tracking and self.rvec is not None else None
+        self.rvec, self.tvec = self.get_pose(points, guess)
+        pitch, yaw, roll = self.get_euler_angles(self.rvec)
+        angles = (self.normalize_pitch(pitch), yaw, roll)
+        if not self.tracking:
+            return angles
+
+        pitch, yaw, roll = self.filter(angles, time.monotonic() if timestamp is None else timestamp)
+        return float(pitch), float(yaw), float(roll)
+
+    def reset(self):
+        # Face lost: the next frame starts from scratch
+        self.rvec = self.tvec = None
+        self.filter.reset()
+
+    def nose_axis(self, points, length=1000.0):
+        """
+        Image-space end points of the nose direction line for the last estimate.
+        """
+        nose_end, _ = cv2.projectPoints(np.array([(0.0, 0.0, length)]), self.rvec, self.tvec,
+                                        self.camera_matrix, self.dist_coeffs)
+        return (int(points[1, 0]), int(points[1, 1])), (int(nose_end[0, 0, 0]), int(nose_end[0, 0, 1]))
+
+    def solve_batch(self, points, timestamps=None):
+        """
+        Offline pose for a whole recording: points is (N, 478, 3), frames
+        without a face may be NaN. Each solve is warm-started from the
+        previous frame. Returns an (N, 3) array of (pitch, yaw, roll), NaN
+        where there was no face; smoothed when tracking and timestamps are given.
+        """
+        angles = np.full((len(points), 3), np.nan)
+        valid = ~np.isnan(points[:, 1, 0])
+        guess = None
+        for i in np.flatnonzero(valid):
+            rvec, tvec = self.get_pose(points[i], guess)
+            pitch, yaw, roll = self.get_euler_angles(rvec)
+            angles[i] = (self.normalize_pitch(pitch), yaw, roll)
+            guess = (rvec, tvec)
+
+        if self.tracking and timestamps is not None:
+            smoother = OneEuroFilter(self.filter.min_cutoff, self.filter.beta, self.filter.d_cutoff)
+            for i in np.flatnonzero(valid):
+                angles[i] = smoother(angles[i], timestamps[i])
+        return angles
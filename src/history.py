@@ -0,0 +1,297 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    driver TEXT, -- First recognized driver
+    drivers TEXT, -- JSON list of every driver recognized, in order
+    stream TEXT,
+    start_time REAL NOT NULL,
+    duration REAL,
+    score INTEGER,
+    drowsy_seconds REAL,
+    distracted_seconds REAL,
+    yawn_seconds REAL,
+    status TEXT NOT NULL,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_start ON sessions(start_time);
+CREATE INDEX IF NOT EXISTS idx_sessions_driver_start ON sessions(driver, start_time);
+
+-- Every driver of a session, for per-driver listings
+CREATE TABLE IF NOT EXISTS session_drivers (
+    driver TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    session_id TEXT NOT NULL,
+    PRIMARY KEY (driver, start_time, session_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS episodes (
+    session_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    duration REAL NOT NULL,
+    start_time REAL NOT NULL,
+    driver TEXT,
+    clip TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_episodes_session ON episodes(session_id, start);
+-- Covering indexes for the per-week aggregates, fleet-wide and per driver
+CREATE INDEX IF NOT EXISTS idx_episodes_type_start ON episodes(type, start_time, driver, duration);
+CREATE INDEX IF NOT EXISTS idx_episodes_driver_type ON episodes(driver, type, start_time, duration);
+
+CREATE TABLE IF NOT EXISTS series (
+    session_id TEXT NOT NULL,
+    t REAL NOT NULL,
+    n INTEGER,
+    ear REAL, ear_min REAL, ear_max REAL,
+    mar REAL, mar_min REAL, mar_max REAL,
+    pitch REAL, pitch_min REAL, pitch_max REAL,
+    yaw REAL, yaw_min REAL, yaw_max REAL,
+    PRIMARY KEY (session_id, t)
+) WITHOUT ROWID;
+"""
+
+SESSION_COLUMNS = ("id", "driver", "drivers", "stream", "start_time", "duration", "score",
+                   "drowsy_seconds", "distracted_seconds", "yawn_seconds", "status")
+
+
+class HistoryStore:
+    """
+    SQLite history of every session: one row per session with the summary,
+    its episodes, and a downsampled series (one SessionSeries tier). Writes
+    are queued and committed in batches by a background thread, so the frame
+    loop only ever enqueues; reads use their own per-thread connections and
+    run concurrently with the writer (WAL).
+    """
+    def __init__(self, path, batch_size=500, flush_interval=1.0, series_resolution=10.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.series_resolution = series_resolution
+        self.queue = queue.Queue()
+        self.local = threading.local()
+
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            if "drivers" not in [row[1] for row in db.execute("PRAGMA table_info(sessions)")]:
+                # Databases from before multi-driver sessions: their one driver becomes the list
+                db.execute("ALTER TABLE sessions ADD COLUMN drivers TEXT")
+                db.execute("UPDATE sessions SET drivers = json_array(driver) WHERE driver IS NOT NULL")
+                db.execute("INSERT OR IGNORE INTO session_drivers SELECT driver, start_time, id FROM sessions "
+                           "WHERE driver IS NOT NULL")
+
+        self.started = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        # Fleet workers write the same file from several processes: wait on the lock instead of failing
+        db = sqlite3.connect(self.path, timeout=30.0)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def reader(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = self.connect()
+            db.row_factory = sqlite3.Row
+        return db
+
+    # Writes (enqueue only)
+
+    def start_session(self, session):
+        self.queue.put(("INSERT OR REPLACE INTO sessions (id, stream, start_time, status) VALUES (?, ?, ?, 'ACTIVE')",
+                        [(session.session_id, session.stream, session.start_time)]))
+
+    def add_episode(self, session, event):
+        self.queue.put(("INSERT INTO episodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(session.session_id, event["type"], event["start"], event["end"], event["duration"],
+                          session.start_time + event["start"], session.driver, event.get("clip"))]))
+
+    def finish_session(self, session, summary):
+        """
+        Stores the final summary and the downsampled series of a session.
+        Its episodes were already queued as they closed.
+        """
+        seconds = summary["seconds"]
+        first = session.drivers[0] if session.drivers else None
+        self.queue.put(("UPDATE sessions SET driver = ?, drivers = ?, duration = ?, score = ?, drowsy_seconds = ?, "
+                        "distracted_seconds = ?, yawn_seconds = ?, status = 'FINISHED', summary = ? WHERE id = ?",
+                        [(first, json.dumps(session.drivers) if session.drivers else None, summary["duration_seconds"],
+                          summary["score"], seconds["drowsy"], seconds["distracted"], seconds["yawn"],
+                          json.dumps(summary), session.session_id)]))
+        self.queue.put(("INSERT OR IGNORE INTO session_drivers VALUES (?, ?, ?)",
+                        [(driver, session.start_time, session.session_id) for driver in session.drivers]))
+        # Episodes that closed before anyone was recognized go to the first driver; the others keep theirs
+        self.queue.put(("UPDATE episodes SET driver = ? WHERE session_id = ? AND driver IS NULL",
+                        [(first, session.session_id)]))
+        tier = session.data_points.tier(self.series_resolution)
+        if tier is not None:
+            rows = tier.to_array()
+            if rows.shape[1] == 14: # t, count, then mean/min/max of ear, mar, pitch, yaw
+                self.queue.put(("INSERT OR REPLACE INTO series VALUES (?" + ", ?" * 14 + ")",
+                                [(session.session_id, *row) for row in rows.tolist()]))
+
+    def run(self):
+        db = self.connect()
+        while self.started or not self.queue.empty():
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self.write_batch(db, batch)
+        db.close()
+
+    def write_batch(self, db, batch):
+        # One transaction per batch; flush() markers are released even if it fails
+        done = [item for item in batch if isinstance(item, threading.Event)]
+        try:
+            with db:
+                for item in batch:
+                    if not isinstance(item, threading.Event):
+                        db.executemany(*item)
+        except sqlite3.Error as e:
+            print(f"History write failed, {len(batch) - len(done)} statements lost: {e}")
+        for event in done:
+            event.set()
+
+    def flush(self, timeout=5.0):
+        """
+        Waits until everything queued so far is committed.
+        """
+        event = threading.Event()
+        self.queue.put(event)
+        return event.wait(timeout)
+
+    def close(self):
+        # Queued before the writer is told to stop, so it drains everything first
+        self.queue.put(threading.Event())
+        self.started = False
+        self.thread.join()
+
+    # Queries
+
+    def sessions(self, driver=None, before=None, limit=50):
+        """
+        Newest sessions first. `before` (a start_time) pages further back.
+        """
+        where, params = [], []
+        sql = f"SELECT {', '.join('s.' + c for c in SESSION_COLUMNS)} FROM sessions s"
+        if driver is not None:
+            # Any session the driver appeared in, not only the ones they started
+            sql = (f"SELECT {', '.join('s.' + c for c in SESSION_COLUMNS)} FROM session_drivers d "
+                   "JOIN sessions s ON s.id = d.session_id")
+            where.append("d.driver = ?")
+            params.append(driver)
+        if before is not None:
+            where.append("s.start_time < ?")
+            params.append(before)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {'d' if driver is not None else 's'}.start_time DESC LIMIT ?"
+        params.append(limit)
+        return [self.decode(row) for row in self.reader().execute(sql, params)]
+
+    @staticmethod
+    def decode(row):
+        result = dict(row)
+        result["drivers"] = json.loads(row["drivers"]) if row["drivers"] else []
+        return result
+
+    def session(self, session_id):
+        """
+        One session in the shape of SessionManager.save_report (session_id,
+        summary, events) plus its stored columns and downsampled series.
+        """
+        db = self.reader()
+        row = db.execute(f"SELECT {', '.join(SESSION_COLUMNS)}, summary FROM sessions WHERE id = ?",
+                         (session_id,)).fetchone()
+        if row is None:
+            return None
+        result = self.decode(row)
+        result["session_id"] = result.pop("id")
+        result["summary"] = json.loads(row["summary"]) if row["summary"] else None
+        result["events"] = []
+        for e in db.execute("SELECT * FROM episodes WHERE session_id = ? ORDER BY start", (session_id,)):
+            event = {"type": e["type"], "start": e["start"], "end": e["end"], "duration": e["duration"],
+                     "real_time": datetime.fromtimestamp(e["start_time"]).strftime("%H:%M:%S")}
+            if e["clip"]:
+                event["clip"] = e["clip"]
+            result["events"].append(event)
+        series = db.execute("SELECT t, ear, ear_min, ear_max, mar, mar_min, mar_max, pitch, yaw FROM series "
+                            "WHERE session_id = ? ORDER BY t", (session_id,)).fetchall()
+        result["series"] = {
+            "resolution": self.series_resolution,
+            "columns": ["t", "ear", "ear_min", "ear_max", "mar", "mar_min", "mar_max", "pitch", "yaw"],
+            "rows": [list(r) for r in series],
+        }
+        return result
+
+    def weekly_drowsy_minutes(self, since, driver=None):
+        """
+        Minutes of DROWSY episodes per driver and week (keyed by the local
+        date of its Monday) for episodes that started after `since` (epoch
+        seconds).
+        """
+        where, params = "type = 'DROWSY' AND start_time >= ?", [since]
+        if driver is not None:
+            where += " AND driver = ?"
+            params.append(driver)
+        db = self.reader()
+        first, last = db.execute(f"SELECT MIN(start_time), MAX(start_time) FROM episodes WHERE {where}",
+                                 params).fetchone()
+        if first is None:
+            return []
+
+        # Weeks counted from the first Monday after the epoch (1970-01-05) on the local clock,
+        # with the UTC offset in force at each episode (DST) as a CASE over the offset periods
+        periods = utc_offsets(first, last)
+        local = "start_time + ?"
+        if len(periods) > 1:
+            local = "start_time + CASE" + " WHEN start_time < ? THEN ?" * (len(periods) - 1) + " ELSE ? END"
+        offsets = [value for (_, offset), (until, _) in zip(periods, periods[1:]) for value in (until, offset)]
+        offsets.append(periods[-1][1])
+        sql = (f"SELECT driver, CAST(({local} - 345600) / 604800 AS INTEGER) AS week, "
+               f"SUM(duration) AS seconds, COUNT(*) AS episodes FROM episodes WHERE {where} "
+               "GROUP BY driver, week ORDER BY week, driver")
+        return [{
+            "driver": row["driver"],
+            "week": datetime.fromtimestamp(row["week"] * 604800 + 345600, timezone.utc).strftime("%Y-%m-%d"),
+            "minutes": round(row["seconds"] / 60.0, 2),
+            "episodes": row["episodes"],
+        } for row in db.execute(sql, offsets + params)]
+
+
+def utc_offsets(start, end):
+    """
+    Local UTC offsets between two epoch times as [(from, offset), ...],
+    checked daily, with each change (DST) located to the second.
+    """
+    start, end = int(start), int(end)
+    periods = [(start, time.localtime(start).tm_gmtoff)]
+    t = start
+    while t < end:
+        step = min(t + 86400, end)
+        if time.localtime(step).tm_gmtoff != periods[-1][1]:
+            lo, hi = t, step
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if time.localtime(mid).tm_gmtoff == periods[-1][1]:
+                    lo = mid
+                else:
+                    hi = mid
+            periods.append((hi, time.localtime(hi).tm_gmtoff))
+        t = step
+    return periods
@@ -1,74 +1,199 @@
 import json
 import os
+import threading
 import numpy as np
+from config import IDENTITY_INTERVAL, IDENTITY_POSE_DELTA, IDENTITY_THRESHOLD, FRAME_WIDTH, FRAME_HEIGHT
 
-PROFILE_FILE = "user_profile.json"
+PROFILE_FILE = "user_profile.json" # Legacy single-driver profile, imported into the gallery once
+# Legacy profiles were normalized from MediaPipe's [0, 1] coordinates, where y is squeezed by the aspect ratio
+LEGACY_ASPECT = np.array([1.0, FRAME_HEIGHT / FRAME_WIDTH, 1.0], dtype=np.float32)
+GALLERY_FILE = "driver_gallery.npy" # (N, 478, 3) float32 normalized landmarks, memory-mapped
+GALLERY_INDEX = "driver_gallery.json" # Per-row driver metadata, same order as the matrix
+
+# Rigid landmarks that barely move with expression: nose bridge, eye corners,
+# brows, cheekbones and the upper face oval (no lips, eyelids or chin)
+STABLE_LANDMARKS = [
+    1, 4, 5, 6, 168, 195, 197,
+    33, 133, 362, 263,
+    55, 285, 70, 300, 105, 334,
+    50, 280, 123, 352,
+    10, 338, 297, 332, 284, 251, 389, 356, 454, 109, 67, 103, 54, 21, 162, 127, 234,
+]
 
 class IdentityManager:
-    def __init__(self):
-        self.profile = self.load_profile()
-        self.threshold = 0.02 # MSE Threshold (Tightened to avoid false positives)
+    """
+    Gallery of enrolled drivers. Every driver is one row of a single matrix,
+    so verification is one vectorized distance computation against all of
+    them on a subset of stable landmarks. The result is reused for
+    `interval` frames unless the head turns by more than `pose_delta` degrees.
+    """
+    def __init__(self, landmarks=STABLE_LANDMARKS, interval=IDENTITY_INTERVAL, pose_delta=IDENTITY_POSE_DELTA,
+                 threshold=IDENTITY_THRESHOLD):
+        self.threshold = threshold # MSE, 0 is a perfect match
+        self.landmarks = np.asarray(landmarks)
+        self.interval = interval
+        self.pose_delta = pose_delta
+
+        # Guards drivers/gallery/matrix: enroll() runs on a request thread while the pipeline matches
+        self.lock = threading.RLock()
+        self.drivers = [] # [{"name": ...}], one per gallery row
+        self.gallery = None
+        self.matrix = None # (N, len(landmarks) * 3) matching view, norms and names, built on first use
+        self.load_gallery()
 
-    def load_profile(self):
-        if os.path.exists(PROFILE_FILE):
+        # Cached verification result
+        self.last_result = (False, 0.0, None)
+        self.last_pose = None
+        self.frames_since_check = 0
+
+    def load_gallery(self):
+        if os.path.exists(GALLERY_FILE) and os.path.exists(GALLERY_INDEX):
+            try:
+                with open(GALLERY_INDEX, "r") as f:
+                    self.drivers = json.load(f)["drivers"]
+                # Memory-mapped, startup cost doesn't grow with the gallery
+                self.gallery = np.load(GALLERY_FILE, mmap_mode="r")
+            except (OSError, ValueError, KeyError):
+                self.drivers, self.gallery = [], None
+        elif os.path.exists(PROFILE_FILE):
             try:
                 with open(PROFILE_FILE, "r") as f:
-                    return json.load(f)
-            except:
-                return None
-        return None
+                    profile = np.array(json.load(f), dtype=np.float32)
+                # Rescaled to the pixel-space normalization used since, at the configured frame size
+                profile = self._normalize_landmarks(profile * LEGACY_ASPECT)
+                self.store([{"name": "driver"}], profile[None])
+                print(f"Imported {PROFILE_FILE} as 'driver', converted for a {FRAME_WIDTH}x{FRAME_HEIGHT} camera. "
+                      "Re-register if recognition fails.")
+            except (OSError, ValueError) as e:
+                print(f"Skipped legacy profile {PROFILE_FILE}: {e}")
+
+    def store(self, drivers, gallery):
+        # Matrix first, index last: a crash in between leaves the old index pointing at a superset
+        with self.lock:
+            tmp = GALLERY_FILE + ".tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(gallery, dtype=np.float32))
+            os.replace(tmp, GALLERY_FILE)
+            self.write_index(drivers)
+            self.gallery = np.load(GALLERY_FILE, mmap_mode="r")
+            self.matrix = None
+
+    def write_index(self, drivers):
+        with self.lock:
+            with open(GALLERY_INDEX + ".tmp", "w") as f:
+                json.dump({"drivers": drivers}, f)
+            os.replace(GALLERY_INDEX + ".tmp", GALLERY_INDEX)
+            self.drivers = drivers
 
-    def save_profile(self, landmarks):
+    def enrolled(self):
+        return len(self.drivers) > 0
+
+    def names(self):
+        return [driver["name"] for driver in self.drivers]
+
+    def enroll(self, name, samples, persist=True):
         """
-        Saves the normalized landmarks as the user profile.
-        Expects landmarks to be a list of dicts or objects with x, y, z.
+        Enrolls (or re-enrolls) a driver from several (478, 3) landmark
+        arrays. The per-point median of the normalized samples is stored, so a
+        blink or a twitch in one frame doesn't end up in the profile.
         """
-        normalized_points = self._normalize_landmarks(landmarks)
-        with open(PROFILE_FILE, "w") as f:
-            json.dump(normalized_points, f)
-        self.profile = normalized_points
+        profile = np.median(np.stack([self._normalize_landmarks(p) for p in samples]), axis=0).astype(np.float32)
+        with self.lock:
+            drivers = list(self.drivers)
+            rows = np.array(self.gallery) if self.gallery is not None else np.empty((0,) + profile.shape, np.float32)
+            if name in self.names():
+                rows[self.names().index(name)] = profile
+            else:
+                drivers.append({"name": name})
+                rows = np.concatenate([rows, profile[None]])
+            if persist:
+                self.store(drivers, rows)
+            else:
+                self.drivers, self.gallery, self.matrix = drivers, rows, None
+            # Rebuilt before the lock is released, so no reader can cache a matrix of the old gallery
+            self.matching_matrix()
+            self.last_pose = None # Re-check on the next frame
         return True
 
-    def verify_user(self, landmarks):
+    def calibration(self, name):
+        # Stored EAR/MAR calibration of a driver (see src.calibration), or None
+        for driver in self.drivers:
+            if driver["name"] == name:
+                return driver.get("calibration")
+        return None
+
+    def save_calibration(self, name, calibration):
         """
-        Compares current landmarks with profile.
-        Returns (is_match, score)
+        Stores a driver's calibration in their gallery entry. Only the small
+        JSON index is rewritten.
         """
-        if self.profile is None:
-            return False, 0.0
-        
-        current_points = self._normalize_landmarks(landmarks)
-        profile_points = self.profile
-        
-        # Calculate Mean Squared Error
-        mse = np.mean(np.square(np.array(current_points) - np.array(profile_points)))
-        
-        # Score: 0 is perfect match. 
-        # Convert to a confidence-like score? 
-        # Let's return raw MSE for debugging and a boolean.
-        is_match = bool(mse < self.threshold)
-        return is_match, float(mse)
-
-    def _normalize_landmarks(self, landmarks):
+        with self.lock:
+            drivers = [dict(driver) for driver in self.drivers]
+            for driver in drivers:
+                if driver["name"] == name:
+                    driver["calibration"] = calibration
+                    self.write_index(drivers)
+                    return True
+        return False
+
+    def save_profile(self, landmarks, name="driver"):
+        # Single-frame enrollment, kept for callers of the old API
+        return self.enroll(name, [landmarks])
+
+    def matching_matrix(self):
+        # (subset matrix, squared row norms, names), one consistent snapshot of the gallery
+        with self.lock:
+            if self.matrix is None:
+                matrix = self._subset(np.asarray(self.gallery, dtype=np.float32))
+                self.matrix = (matrix, np.einsum("ij,ij->i", matrix, matrix), self.names())
+            return self.matrix
+
+    def _subset(self, normalized):
+        # (..., 478, 3) normalized landmarks -> (..., K * 3), still scaled by the whole face so
+        # errors are in the same units as IDENTITY_THRESHOLD
+        sub = normalized[..., self.landmarks, :]
+        return sub.reshape(sub.shape[:-2] + (-1,))
+
+    def verify_user(self, landmarks, pose=None):
+        """
+        Compares current landmarks with every enrolled driver.
+        pose is the latest (pitch, yaw); while it stays within pose_delta the
+        previous result is reused for up to `interval` frames.
+        Returns (is_match, score, name)
+        """
+        if not self.drivers:
+            return False, 0.0, None
+
+        self.frames_since_check += 1
+        if self.last_pose is not None and self.frames_since_check < self.interval:
+            if pose is None or max(abs(pose[0] - self.last_pose[0]), abs(pose[1] - self.last_pose[1])) < self.pose_delta:
+                return self.last_result
+
+        matrix, norms, names = self.matching_matrix()
+        query = self._subset(self._normalize_landmarks(landmarks))
+        # Mean Squared Error against all drivers at once: |g|^2 - 2 g.q + |q|^2
+        mse = (norms - 2.0 * (matrix @ query) + query @ query) / query.size
+        best = int(np.argmin(mse))
+        score = float(max(mse[best], 0.0))
+
+        # Score: 0 is perfect match
+        is_match = bool(score < self.threshold)
+        self.last_result = (is_match, score, names[best] if is_match else None)
+        self.last_pose = pose if pose is not None else (0.0, 0.0)
+        self.frames_since_check = 0
+        return self.last_result
+
+    def _normalize_landmarks(self, points):
         """
         Normalize landmarks to be invariant to scale and translation.
         1. Center around the nose tip (Index 1).
         2. Scale by the bounding box width or inter-ocular distance.
         """
-        points = []
-        if hasattr(landmarks, "landmark"):
-            source = landmarks.landmark
-        else:
-            source = landmarks
-
-        # Extract points
-        coords = np.array([(p.x, p.y, p.z) for p in source])
-        
         # 1. Translation: Center at Nose Tip (Index 1)
         # Note: MediaPipe FaceMesh Index 1 is nose tip
-        nose_tip = coords[1]
-        centered = coords - nose_tip
-        
+        nose_tip = points[1]
+        centered = points - nose_tip
+
         # 2. Scaling: Normalize by distance between eyes (Index 33 and 263 are outer corners of eyes approx)
         # Or just max absolute value to fit in -1 to 1 range
         # Using max extent is safer for general shape
@@ -77,5 +202,5 @@ class IdentityManager:
             normalized = centered / max_dist
         else:
             normalized = centered
-            
-        return normalized.tolist()
+
+        return normalized
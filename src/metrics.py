@@ -0,0 +1,248 @@
+import bisect
+import threading
+import time
+from config import METRICS_ENABLED
+
+# Latency buckets in seconds (0.5ms .. 1s), size buckets in bytes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.2, 0.5, 1.0)
+SIZE_BUCKETS = (8_000, 16_000, 32_000, 64_000, 128_000, 256_000, 512_000)
+
+PREFIX = "driver_guard_"
+QUANTILES = (0.5, 0.95, 0.99) # Reported for the recent stage latencies
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with bounded memory.
+    Keeps cumulative counts for Prometheus plus a rolling window made of a few
+    rotating sub-histograms, used for recent quantile estimates.
+    """
+    def __init__(self, buckets, window=60.0, slots=6):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+        self.slot_length = window / slots
+        self.window = [[0] * (len(self.buckets) + 1) for _ in range(slots)]
+        self.window_index = 0
+        self.window_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += value
+            self.count += 1
+
+            now = time.monotonic()
+            if now - self.window_start >= self.slot_length:
+                # Rotate; clear every slot we skipped over
+                skipped = min(int((now - self.window_start) / self.slot_length), len(self.window))
+                for _ in range(skipped):
+                    self.window_index = (self.window_index + 1) % len(self.window)
+                    self.window[self.window_index] = [0] * len(self.counts)
+                self.window_start = now
+            self.window[self.window_index][i] += 1
+
+    def quantile(self, q):
+        """
+        Estimates a quantile over the rolling window (bucket upper bound).
+        """
+        with self.lock:
+            merged = [sum(col) for col in zip(*self.window)]
+        n = sum(merged)
+        if n == 0:
+            return 0.0
+        rank = q * n
+        running = 0
+        for i, c in enumerate(merged):
+            running += c
+            if running >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+        return self.buckets[-1]
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.total, self.count
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """
+    Collects counters, histograms and callback gauges, and renders them in the
+    Prometheus text exposition format. When disabled every call is a no-op.
+    Registries of other processes (fleet workers) are merged in with
+    set_remote(), labelled with their stream.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {} # (name, labels) -> Histogram
+        self.counters = {}   # (name, labels) -> value
+        self.gauges = {}     # (name, labels) -> callable
+        self.remote = {}     # stream -> export() of a worker's registry
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def histogram(self, name, labels=(), buckets=LATENCY_BUCKETS):
+        key = (name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            with self.lock:
+                hist = self.histograms.setdefault(key, Histogram(buckets))
+        return hist
+
+    def timer(self, stage):
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self.histogram("stage_latency_seconds", (("stage", stage),)))
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        if self.enabled:
+            self.histogram(name, labels, buckets).observe(value)
+
+    def inc(self, name, amount=1, labels=()):
+        if not self.enabled:
+            return
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, fn, labels=()):
+        """
+        Registers a gauge whose value is read from fn() at scrape time.
+        """
+        with self.lock:
+            self.gauges[(name, labels)] = fn
+
+    def export(self):
+        """
+        Current values as plain (picklable) data, for forwarding to the
+        parent process.
+        """
+        with self.lock:
+            counters = list(self.counters.items())
+            gauges = list(self.gauges.items())
+            histograms = list(self.histograms.items())
+        values = []
+        for key, fn in gauges:
+            try:
+                values.append((key, float(fn())))
+            except Exception:
+                continue
+        return {
+            "counters": counters,
+            "gauges": values,
+            "histograms": [(key, hist.buckets, *hist.snapshot(), tuple(hist.quantile(q) for q in QUANTILES))
+                           for key, hist in histograms],
+        }
+
+    def set_remote(self, stream, snapshot):
+        with self.lock:
+            self.remote[stream] = snapshot
+
+    def render(self):
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name in typed:
+                return
+            typed.add(name)
+            if name in self.help:
+                lines.append(f"# HELP {PREFIX}{name} {self.help[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        # This process, then every worker's last snapshot with a stream label
+        snapshots = [((), self.export())]
+        with self.lock:
+            snapshots += [((("stream", stream),), snapshot) for stream, snapshot in sorted(self.remote.items())]
+        counters, gauges, histograms = [], [], []
+        for extra, snapshot in snapshots:
+            counters += [((name, extra + labels), value) for (name, labels), value in snapshot["counters"]]
+            gauges += [((name, extra + labels), value) for (name, labels), value in snapshot["gauges"]]
+            histograms += [((name, extra + labels), *rest) for (name, labels), *rest in snapshot["histograms"]]
+        counters.sort()
+        gauges.sort()
+        histograms.sort(key=lambda h: h[0])
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+
+        for (name, labels), buckets, counts, total, count, _ in histograms:
+            header(name, "histogram")
+            running = 0
+            for bound, c in zip(buckets, counts):
+                running += c
+                lines.append(f"{PREFIX}{name}_bucket{_labels(labels + (('le', repr(bound)),))} {running}")
+            lines.append(f"{PREFIX}{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+
+        # Recent quantiles from the rolling windows
+        recent = [(key, quantiles) for key, *_, quantiles in histograms if key[0] == "stage_latency_seconds"]
+        if recent:
+            header("stage_latency_recent_seconds", "gauge")
+            for (name, labels), quantiles in recent:
+                for q, value in zip(QUANTILES, quantiles):
+                    lines.append(f"{PREFIX}stage_latency_recent_seconds{_labels(labels + (('quantile', str(q)),))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+# Process-wide registry used by the pipeline and the /metrics endpoint
+metrics = MetricsRegistry(enabled=METRICS_ENABLED)
+metrics.describe("stage_latency_seconds", "Per-stage frame processing latency")
+metrics.describe("stage_latency_recent_seconds", "Per-stage latency quantiles over the last minute")
+metrics.describe("encoded_frame_bytes", "Size of encoded JPEG frames")
+metrics.describe("frames_processed_total", "Frames run through the pipeline")
+metrics.describe("camera_frames_dropped_total", "Camera frames that were never processed")
+metrics.describe("alert_activations_total", "Alerts raised, by type")
+metrics.describe("alert_sink_errors_total", "Alert events a sink failed to deliver")
+metrics.describe("time_to_first_frame_seconds", "From session start request to the first processed frame")
+metrics.describe("model_load_seconds", "Time to load and warm up the FaceMesh graph")
+metrics.describe("jpeg_quality", "Current adaptive JPEG quality of the video stream")
+metrics.describe("client_frame_lag_seconds", "Delay from publishing a frame to handing it to a viewer's connection")
+metrics.describe("clips_recorded_total", "Event clips started, by triggering episode type")
+metrics.describe("clip_frames_dropped_total", "Clip frames dropped because the writer fell behind")
+metrics.describe("stream_clients", "Connected /video_feed clients")
+metrics.describe("session_data_points", "Samples held by the SessionManager")
+metrics.describe("session_episodes", "Episodes recorded by the SessionManager")
@@ -0,0 +1,492 @@
+import threading
+import time
+import cv2
+from config import (JPEG_QUALITY, JPEG_MIN_QUALITY, PREVIEW_WIDTH, ENCODE_TIME_BUDGET_MS, ENCODE_SIZE_BUDGET_KB,
+                    HEADLESS_WHEN_IDLE, LOW_LIGHT_THRESHOLD, LOW_LIGHT_HYSTERESIS, LOW_LIGHT_MAX_GAMMA, LOW_LIGHT_CLAHE,
+                    DISTRACTION_PITCH, DISTRACTION_YAW, FRAME_WIDTH, FRAME_HEIGHT, CLIP_DIR, CLIP_TYPES,
+                    CLIP_PRE_SECONDS, CLIP_POST_SECONDS, CLIP_MAX_SECONDS, CLIP_FPS, CLIP_WIDTH, CLIP_JPEG,
+                    CALIBRATION_ENABLED, FACE_LOST_SECONDS)
+from src.vision_utils import LowLightEnhancer
+from src.metrics import metrics as default_metrics
+from src.encoder import FrameEncoder
+from src.recorder import ClipRecorder
+from src.calibration import Calibrator
+import src.ui as ui
+
+
+class Subscription:
+    """
+    A single viewer of a FrameBroadcaster.
+    Holds only the latest published payload (a bounded queue of one), so a
+    slow viewer skips frames instead of delaying the producer or the other
+    viewers. Skipped frames and delivery lag are tracked per viewer.
+    max_fps caps how often this viewer is handed a payload.
+    """
+    def __init__(self, broadcaster, max_fps=None, name=None):
+        self.broadcaster = broadcaster
+        self.name = name # e.g. the client's address
+        self.payload = None
+        self.pending = False
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.last_time = 0.0
+
+        # Delivery stats
+        self.connected_at = time.monotonic()
+        self.published_at = 0.0 # When the payload in the slot was published
+        self.current_published_at = 0.0 # ...and the one last handed out
+        self.delivered = 0
+        self.dropped = 0 # Overwritten before this viewer took them
+        self.lag = 0.0 # Smoothed publish -> sent delay (seconds)
+        self.max_lag = 0.0
+
+    def get(self, timeout=1.0):
+        """
+        Blocks until a payload newer than the last one returned is available.
+        Returns None on timeout or when the broadcaster is closed.
+        """
+        if self.min_interval:
+            # Frames published meanwhile just overwrite the slot, we take the newest after the wait
+            wait = self.last_time + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.last_time = time.monotonic()
+        condition = self.broadcaster.condition
+        with condition:
+            if not self.pending:
+                condition.wait_for(lambda: self.pending or self.broadcaster.closed, timeout)
+            if not self.pending:
+                return None
+            self.pending = False
+            self.current_published_at = self.published_at
+            self.delivered += 1
+            return self.payload
+
+    def mark_sent(self):
+        """
+        Call once the last payload from get() has been written to the client.
+        Returns its lag: time from publish until it was sent.
+        """
+        lag = time.monotonic() - self.current_published_at
+        self.lag = lag if self.delivered <= 1 else 0.9 * self.lag + 0.1 * lag
+        self.max_lag = max(self.max_lag, lag)
+        return lag
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.connected_at, 1e-6)
+        return {
+            "client": self.name,
+            "connected_seconds": round(elapsed, 1),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "fps": round(self.delivered / elapsed, 1),
+            "lag_ms": round(self.lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+        }
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+    def __iter__(self):
+        while not self.broadcaster.closed:
+            payload = self.get()
+            if payload is not None:
+                yield payload
+
+
+class FrameBroadcaster:
+    """
+    Fans out payloads (encoded JPEG frames) produced once to N subscribers.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.subscribers = set()
+        self.closed = False
+
+    def subscribe(self, max_fps=None, name=None):
+        subscription = Subscription(self, max_fps, name)
+        with self.condition:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.condition:
+            self.subscribers.discard(subscription)
+
+    def publish(self, payload):
+        now = time.monotonic()
+        with self.condition:
+            for subscription in self.subscribers:
+                if subscription.pending:
+                    subscription.dropped += 1
+                subscription.payload = payload
+                subscription.pending = True
+                subscription.published_at = now
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def client_count(self):
+        with self.condition:
+            return len(self.subscribers)
+
+    def client_stats(self):
+        with self.condition:
+            subscribers = list(self.subscribers)
+        return [subscription.stats() for subscription in subscribers]
+
+
+class Pipeline:
+    """
+    Runs detection, analytics and alerting exactly once per camera frame on a
+    background thread. Annotated frames go to a FrameEncoder thread, which
+    publishes the JPEG to a FrameBroadcaster; with no viewers connected the
+    overlays and encoding are skipped altogether.
+    """
+    def __init__(self, camera, detector, assessor, alerter, head_pose, session_manager, identity_manager, metrics=None,
+                 viewers=None):
+        self.camera = camera
+        self.detector = detector
+        self.assessor = assessor
+        self.alerter = alerter
+        self.head_pose = head_pose
+        self.session_manager = session_manager
+        self.identity_manager = identity_manager
+        self.enhancer = LowLightEnhancer(threshold=LOW_LIGHT_THRESHOLD, hysteresis=LOW_LIGHT_HYSTERESIS,
+                                         max_gamma=LOW_LIGHT_MAX_GAMMA, clahe=LOW_LIGHT_CLAHE)
+
+        self.metrics = metrics if metrics is not None else default_metrics
+        self.broadcaster = FrameBroadcaster()
+        self.status_broadcaster = FrameBroadcaster() # Status dicts for /events (SSE) clients
+        self.viewers = viewers # Callable giving the viewer count when they are elsewhere (fleet workers)
+        self.encoder = FrameEncoder(self.broadcaster, quality=JPEG_QUALITY, min_quality=JPEG_MIN_QUALITY,
+                                    preview_width=PREVIEW_WIDTH, time_budget=ENCODE_TIME_BUDGET_MS / 1000,
+                                    size_budget=ENCODE_SIZE_BUDGET_KB * 1024 if ENCODE_SIZE_BUDGET_KB else None,
+                                    metrics=self.metrics)
+        self.recorder = None
+        if CLIP_DIR:
+            self.recorder = ClipRecorder(CLIP_DIR, session_manager.session_id, pre=CLIP_PRE_SECONDS,
+                                         post=CLIP_POST_SECONDS, max_seconds=CLIP_MAX_SECONDS, fps=CLIP_FPS,
+                                         width=CLIP_WIDTH, frame_size=(FRAME_WIDTH, FRAME_HEIGHT), jpeg=CLIP_JPEG,
+                                         metrics=self.metrics)
+        self.calibrator = Calibrator() if CALIBRATION_ENABLED else None
+        self.default_thresholds = (assessor.ear_threshold, assessor.mar_threshold) # Until a driver is calibrated
+        self.lock = threading.Lock()
+        self.status = {
+            "ear": 0,
+            "mar": 0,
+            "pitch": 0,
+            "yaw": 0,
+            "drowsy": False,
+            "yawning": False,
+            "distracted": False,
+            "authenticated": False,
+            "auth_score": 0.0,
+            "driver": None,
+            "low_light": False,
+            "ear_threshold": assessor.ear_threshold,
+            "mar_threshold": assessor.mar_threshold,
+            "calibrated": False,
+            "fps": 0
+        }
+        self.latest_landmarks = None
+
+        # Identity State
+        self.user_authenticated = False
+        self.user_score = 1.0 # MSE Score
+        self.driver = None # Name of the recognized driver
+
+        self.started = False
+        self.prev_time = 0
+        self.fps = 0.0
+        self.last_seq = 0
+        self.started_at = None
+        self.first_frame_seconds = None # Time to first annotated frame
+        self.alert_state = {"DROWSY": False, "YAWN": False, "DISTRACTED": False}
+        self.lost_since = None # First frame of the current stretch without a face
+
+    def register_metrics(self):
+        m = self.metrics
+        m.gauge("stream_clients", self.broadcaster.client_count)
+        m.gauge("session_data_points", lambda: len(self.session_manager.data_points))
+        m.gauge("session_episodes", self.session_manager.episode_count)
+        m.gauge("time_to_first_frame_seconds", lambda: self.first_frame_seconds)
+
+    def start(self, requested_at=None):
+        """
+        requested_at (time.monotonic()) is when the session was asked for, so
+        time to first frame includes opening the camera.
+        """
+        if self.started:
+            return self
+        self.started_at = requested_at if requested_at is not None else time.monotonic()
+        self.register_metrics()
+        self.encoder.start()
+        self.started = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.started = False
+        if hasattr(self, 'thread'):
+            self.thread.join()
+        self.encoder.stop()
+        if self.recorder:
+            self.recorder.stop()
+        self.save_calibration()
+        self.broadcaster.close()
+        self.status_broadcaster.close()
+
+    def save_calibration(self):
+        # Persists the calibration of every driver recognized in this session with their profile
+        if self.calibrator is None or self.identity_manager is None:
+            return
+        for name, calibration in self.calibrator.states().items():
+            try:
+                self.identity_manager.save_calibration(name, calibration)
+            except OSError as e:
+                print(f"Error saving calibration for {name}: {e}")
+
+    def get_status(self):
+        with self.lock:
+            return dict(self.status)
+
+    def get_latest_landmarks(self):
+        with self.lock:
+            return self.latest_landmarks
+
+    def run(self):
+        m = self.metrics
+        while self.started:
+            # Blocks until the camera delivers a frame we haven't processed yet,
+            # and borrows the ring slot read-only instead of copying it
+            captured = self.camera.wait_for_frame(self.last_seq, timeout=0.5, copy=False)
+            if captured is None:
+                if self.camera.finished:
+                    break # Recorded source played out
+                continue
+
+            # Frames the camera produced while we were busy
+            if self.last_seq and captured.seq > self.last_seq + 1:
+                m.inc("camera_frames_dropped_total", captured.seq - self.last_seq - 1)
+            self.last_seq = captured.seq
+
+            # Nobody watching: analytics and alerts still run, overlays and JPEGs don't
+            viewers = self.viewers() if self.viewers else self.broadcaster.client_count()
+            render = not HEADLESS_WHEN_IDLE or viewers > 0
+
+            with m.timer("total"):
+                frame = self.process(captured.image, render=render, timestamp=captured.timestamp)
+            m.inc("frames_processed_total")
+            if self.first_frame_seconds is None:
+                self.first_frame_seconds = time.monotonic() - self.started_at
+                print(f"First frame processed {self.first_frame_seconds:.2f}s after start")
+
+            if self.recorder:
+                with m.timer("record"):
+                    self.recorder.push(frame)
+
+            if render:
+                # Encoded once for every viewer, off this thread. The encoder keeps
+                # the frame, so it can't stay a view into the camera ring.
+                if not frame.flags.writeable:
+                    frame = frame.copy()
+                self.encoder.submit(frame)
+
+        self.encoder.stop()
+        self.broadcaster.close()
+        self.status_broadcaster.close()
+
+    def count_alert(self, kind, active):
+        # Counts rising edges only, so a 3s episode is one activation
+        if active and not self.alert_state[kind]:
+            self.metrics.inc("alert_activations_total", labels=(("type", kind),))
+        self.alert_state[kind] = active
+
+    def face_lost(self, timestamp):
+        """
+        A driver out of view is neither drowsy, yawning nor distracted: once
+        no face was found for FACE_LOST_SECONDS, those episodes close, their
+        alerts are released and the assessor starts over with the next face.
+        Shorter misses (detection dropouts) leave everything as it was.
+        """
+        if self.lost_since is None:
+            self.lost_since = timestamp
+        if timestamp - self.lost_since < FACE_LOST_SECONDS or not any(self.alert_state.values()):
+            return
+        self.assessor.face_lost()
+        with self.lock:
+            self.status = dict(self.status, drowsy=False, yawning=False, distracted=False)
+        self.status_broadcaster.publish(self.status)
+        for kind in ("DROWSY", "YAWN", "DISTRACTED"):
+            self.session_manager.update_state(kind, False)
+            self.count_alert(kind, False)
+            self.alerter.update(kind, False)
+            if self.recorder and kind in CLIP_TYPES:
+                self.recorder.update(kind, False)
+
+    def face_roi(self, frame):
+        # Face box from the previous frame, only needed for CLAHE
+        if self.enhancer.clahe is None:
+            return None
+        if self.detector.roi is not None:
+            return self.detector.roi
+        with self.lock:
+            points = self.latest_landmarks
+        if points is None:
+            return None
+        h, w = frame.shape[:2]
+        return self.detector.compute_roi(points, w, h)
+
+    def process(self, frame, render=True, timestamp=None):
+        """
+        Runs the full analysis on a single frame and returns it, annotated
+        unless render is False. timestamp is the frame's capture time, so
+        time-based rules follow the source rather than processing time.
+        """
+        m = self.metrics
+
+        # FPS (smoothed, a single inter-frame delta is too noisy)
+        curr_time = time.time()
+        delta = curr_time - self.prev_time
+        if self.prev_time and delta > 0:
+            self.fps = 1 / delta if self.fps == 0 else 0.9 * self.fps + 0.1 / delta
+        self.prev_time = curr_time
+        fps = self.fps
+
+        # Low Light Enhancement
+        with m.timer("enhance"):
+            frame, is_low_light = self.enhancer.apply(frame, self.face_roi(frame))
+
+        with m.timer("detect"):
+            ear, mar, points = self.detector.process_frame(frame)
+        pitch, yaw, roll = 0, 0, 0
+        distracted = False
+
+        with self.lock:
+            self.latest_landmarks = points
+
+        # Identity Verification (matching runs at a reduced cadence, cached while the head stays still)
+        if points is not None and self.identity_manager:
+            if self.identity_manager.enrolled():
+                with m.timer("identity"):
+                    match, score, driver = self.identity_manager.verify_user(
+                        points, pose=(self.status["pitch"], self.status["yaw"]))
+                self.user_authenticated = match
+                self.user_score = score
+                self.driver = driver
+                self.session_manager.set_driver(driver)
+                if self.calibrator and driver != self.calibrator.driver:
+                    # An unknown face (None) gets a calibration of its own too
+                    self.calibrator.use_driver(driver, self.identity_manager.calibration(driver) if driver else None)
+                    # Never carry the previous driver's thresholds over to an uncalibrated one
+                    self.assessor.set_thresholds(*(self.calibrator.thresholds() or self.default_thresholds))
+            else:
+                self.user_authenticated = False # No profile yet
+                self.driver = None
+
+        # Episodes that don't need a face
+        self.session_manager.update_state("LOW_LIGHT", is_low_light)
+        auth_lost = bool(points is not None and self.identity_manager and self.identity_manager.enrolled()
+                         and not self.user_authenticated)
+        self.session_manager.update_state("AUTH_LOST", auth_lost)
+
+        if points is None:
+            self.head_pose.reset()
+            self.face_lost(time.monotonic() if timestamp is None else timestamp)
+        else:
+            self.lost_since = None
+            # Overlays are drawn in place; take a private copy of a borrowed camera buffer
+            if render and not frame.flags.writeable:
+                frame = frame.copy()
+
+            # Drowsiness & Yawn, with the driver's own thresholds once calibrated
+            with m.timer("assess"):
+                if self.calibrator:
+                    # Drowsy or yawning stretches aren't part of the baseline
+                    if not (self.assessor.is_drowsy() or self.assessor.is_yawning()):
+                        self.calibrator.update(ear, mar, timestamp=timestamp)
+                    thresholds = self.calibrator.thresholds()
+                    if thresholds:
+                        self.assessor.set_thresholds(*thresholds)
+                self.assessor.update(ear, mar, timestamp=timestamp)
+            drowsy = self.assessor.is_drowsy()
+            yawning = self.assessor.is_yawning()
+
+            # Head Pose (normalized, warm-started and smoothed by the estimator)
+            with m.timer("pose"):
+                pitch, yaw, roll = self.head_pose.estimate(points, timestamp=timestamp)
+
+            # Distraction Logic (Relaxed thresholds)
+            if abs(pitch) > DISTRACTION_PITCH or abs(yaw) > DISTRACTION_YAW:
+                distracted = True
+
+            # Update Shared State
+            with self.lock:
+                self.status = {
+                    "ear": float(ear),
+                    "mar": float(mar),
+                    "pitch": float(pitch),
+                    "yaw": float(yaw),
+                    "drowsy": drowsy,
+                    "yawning": yawning,
+                    "distracted": distracted,
+                    "bpm": self.assessor.get_bpm(),
+                    "perclos": self.assessor.get_perclos(),
+                    "yawn_rate": self.assessor.get_yawn_rate(),
+                    "fps": fps,
+                    "authenticated": self.user_authenticated,
+                    "auth_score": float(self.user_score),
+                    "driver": self.driver,
+                    "low_light": is_low_light,
+                    "ear_threshold": round(self.assessor.ear_threshold, 4),
+                    "mar_threshold": round(self.assessor.mar_threshold, 4),
+                    "calibrated": bool(self.calibrator and self.calibrator.calibrated())
+                }
+            self.status_broadcaster.publish(self.status)
+
+            # Analytics
+            self.session_manager.log_data(ear, mar, pitch, yaw)
+            self.session_manager.update_state("DROWSY", drowsy)
+            self.session_manager.update_state("YAWN", yawning)
+            self.session_manager.update_state("DISTRACTED", distracted)
+            self.count_alert("DROWSY", drowsy)
+            self.count_alert("YAWN", yawning)
+            self.count_alert("DISTRACTED", distracted)
+
+            # Alerts (only state changes reach the dispatcher thread)
+            self.alerter.update("DROWSY", drowsy)
+            self.alerter.update("YAWN", yawning)
+            self.alerter.update("DISTRACTED", distracted)
+
+            # Event clips, linked to the episode that triggered them
+            if self.recorder:
+                for kind, active in (("DROWSY", drowsy), ("DISTRACTED", distracted)):
+                    if kind in CLIP_TYPES:
+                        clip = self.recorder.update(kind, active)
+                        if clip:
+                            self.session_manager.attach_clip(kind, clip)
+
+            if not render:
+                return frame
+
+            if drowsy:
+                cv2.putText(frame, "DROWSY!", (10, 300), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+            elif distracted:
+                cv2.putText(frame, "DISTRACTED!", (10, 380), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
+
+            if yawning:
+                cv2.putText(frame, "YAWNING!", (10, 340), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+
+            with m.timer("draw"):
+                # Draw Landmarks
+                ui.draw_landmarks(frame, points, self.detector)
+
+                # Draw Pose Axis (Nose tip)
+                p1, p2 = self.head_pose.nose_axis(points)
+                cv2.line(frame, p1, p2, (255, 0, 0), 2)
+
+        return frame
@@ -0,0 +1,209 @@
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from src.metrics import metrics as default_metrics
+
+
+class FrameRing:
+    """
+    Preallocated ring of the last `capacity` frames, either raw (fixed-size
+    BGR slots) or as JPEGs in fixed-size byte slots. Memory is allocated once
+    and never grows: capacity * slot size.
+    """
+    def __init__(self, capacity, width, height, jpeg=True, quality=70, slot_bytes=None):
+        self.capacity = capacity
+        self.width, self.height = width, height
+        self.jpeg = jpeg
+        self.quality = quality
+        if jpeg:
+            # Generous for a JPEG at this size; bigger encodes are retried at lower quality
+            self.slot_bytes = slot_bytes or width * height // 4
+            self.slots = np.zeros((capacity, self.slot_bytes), dtype=np.uint8)
+            self.lengths = np.zeros(capacity, dtype=np.int64)
+        else:
+            self.slots = np.zeros((capacity, height, width, 3), dtype=np.uint8)
+        self.times = np.zeros(capacity)
+        self.head = 0 # Next slot to write
+        self.count = 0
+
+    def push(self, frame, timestamp):
+        """
+        Stores a frame (resized to the ring's size) and returns its slot.
+        Returns None if it couldn't be stored.
+        """
+        slot = self.head
+        resize = frame.shape[1] != self.width or frame.shape[0] != self.height
+        if self.jpeg:
+            if resize:
+                frame = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+            for quality in (self.quality, self.quality // 2):
+                ret, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if ret and len(buffer) <= self.slot_bytes:
+                    break
+            else:
+                return None
+            self.slots[slot, :len(buffer)] = buffer.ravel()
+            self.lengths[slot] = len(buffer)
+        elif resize:
+            cv2.resize(frame, (self.width, self.height), dst=self.slots[slot], interpolation=cv2.INTER_AREA)
+        else:
+            self.slots[slot] = frame
+        self.times[slot] = timestamp
+        self.head = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return slot
+
+    def get(self, slot):
+        # JPEG bytes or a view of the raw slot
+        if self.jpeg:
+            return self.slots[slot, :self.lengths[slot]].tobytes()
+        return self.slots[slot]
+
+    def since(self, timestamp):
+        # Slots stored at or after timestamp, oldest first
+        slots = [(self.head - self.count + i) % self.capacity for i in range(self.count)]
+        return [slot for slot in slots if self.times[slot] >= timestamp]
+
+    def nbytes(self):
+        return self.slots.nbytes
+
+
+class ClipRecorder:
+    """
+    Event-triggered clip recording. The frame loop only downscales sampled
+    frames (`fps`, `width`) into a few preallocated intake slots; a
+    background thread encodes them into a FrameRing holding the last `pre`
+    seconds and writes the clips. When an episode starts, the pre-roll plus
+    everything up to `post` seconds later (extended while episodes keep
+    starting, capped at `max_seconds`) goes into one video file, so
+    encoding and disk I/O never run on the frame loop.
+    All buffers are allocated up front: memory is the ring plus `intake`
+    raw frames, whatever the session length. If the thread falls behind,
+    frames are dropped and counted.
+    """
+    def __init__(self, directory, prefix, pre=10.0, post=10.0, max_seconds=60.0, fps=10.0, width=480,
+                 frame_size=(640, 480), jpeg=True, intake=8, metrics=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.pre = pre
+        self.post = post
+        self.max_seconds = max_seconds
+        self.fps = fps
+        w, h = frame_size
+        width = min(width or w, w)
+        self.size = (width, int(h * width / w) // 2 * 2) # Even sizes for the video codecs
+        self.ring = FrameRing(int(pre * fps) + 1, *self.size, jpeg=jpeg)
+        self.intake = np.zeros((intake, self.size[1], self.size[0], 3), dtype=np.uint8)
+        self.free = queue.Queue()
+        for slot in range(intake):
+            self.free.put(slot)
+        self.metrics = metrics if metrics is not None else default_metrics
+
+        # Frame loop side
+        self.states = {} # Last state per kind
+        self.last_push = None
+        self.clip = None # {"name", "start", "end"} while recording
+        self.clips = 0
+        self.dropped = 0
+
+        self.queue = queue.Queue()
+        os.makedirs(directory, exist_ok=True)
+        self.started = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def nbytes(self):
+        return self.ring.nbytes() + self.intake.nbytes
+
+    def push(self, frame, timestamp=None):
+        """
+        Called from the frame loop with every frame; keeps only `fps` of them.
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if self.last_push is not None and timestamp - self.last_push < 1.0 / self.fps:
+            return
+        self.last_push = timestamp
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            self.metrics.inc("clip_frames_dropped_total")
+            return
+        cv2.resize(frame, self.size, dst=self.intake[slot], interpolation=cv2.INTER_AREA)
+        self.queue.put(("frame", slot, timestamp))
+        if self.clip is not None and timestamp >= self.clip["end"]:
+            self.queue.put(("close", None, timestamp))
+            self.clip = None
+
+    def update(self, kind, active, timestamp=None):
+        """
+        Feeds the state of an episode type. On a rising edge a clip is
+        started (or the one being recorded is extended); returns its file
+        name, relative to the clip directory.
+        """
+        active = bool(active)
+        if self.states.get(kind, False) == active:
+            return None
+        self.states[kind] = active
+        if not active:
+            return None
+
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if self.clip is not None:
+            self.clip["end"] = min(max(self.clip["end"], timestamp + self.post), self.clip["start"] + self.max_seconds)
+            return self.clip["name"]
+
+        self.clips += 1
+        name = f"{self.prefix}-{self.clips:03d}-{kind.lower()}.mp4"
+        self.clip = {"name": name, "start": timestamp, "end": timestamp + self.post}
+        self.queue.put(("open", name, timestamp))
+        self.metrics.inc("clips_recorded_total", labels=(("type", kind),))
+        return name
+
+    def run(self):
+        writer = None
+        while self.started or not self.queue.empty():
+            try:
+                kind, value, timestamp = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if kind == "frame":
+                    frame = self.intake[value]
+                    self.ring.push(frame, timestamp)
+                    if writer is not None:
+                        writer.write(frame)
+                    self.free.put(value)
+                elif kind == "open":
+                    path = os.path.join(self.directory, value)
+                    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, self.size)
+                    if not writer.isOpened():
+                        print(f"Could not open clip {path}")
+                        writer = None
+                        continue
+                    # Pre-roll
+                    for slot in self.ring.since(timestamp - self.pre):
+                        frame = self.ring.get(slot)
+                        if isinstance(frame, bytes):
+                            frame = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+                        writer.write(frame)
+                elif kind == "close" and writer is not None:
+                    writer.release()
+                    writer = None
+            except cv2.error as e:
+                print(f"Clip writer error: {e}")
+                if kind == "frame":
+                    self.free.put(value)
+        if writer is not None:
+            writer.release()
+
+    def stop(self):
+        """
+        Finishes the clip being recorded and waits for the writer to drain.
+        """
+        self.clip = None
+        self.started = False
+        self.thread.join()
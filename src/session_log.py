@@ -0,0 +1,167 @@
+import glob
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+
+# Record kinds (one compact JSON object per line):
+#   {"k":"h","id":..,"start":..}                 header, first line of every segment
+#   {"k":"s","t":..,"e":..,"m":..,"p":..,"y":..}  per-frame sample
+#   {"k":"o","type":..,"t":..}                    episode opened
+#   {"k":"c","type":..,"t":..}                    episode closed
+#   {"k":"f","summary":{..}}                      footer written by finalize()
+
+
+class SessionLogWriter:
+    """
+    Streams session records to append-only, size-rotated NDJSON segments from
+    a background thread. The frame loop only enqueues; records are written in
+    batches and fsync'd according to the policy ("always", "interval", "never"),
+    so a crash loses at most the last unsynced batch.
+    """
+    def __init__(self, directory, session_id, start_time, batch_size=256, flush_interval=1.0,
+                 fsync="interval", fsync_interval=5.0, rotate_bytes=64 * 1024 * 1024, max_pending=10000):
+        self.directory = directory
+        self.session_id = session_id
+        self.start_time = start_time
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.rotate_bytes = rotate_bytes
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.segment = 0
+        self.file = None
+        self.last_sync = time.monotonic()
+        self.open_segment()
+
+        self.started = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"{self.session_id}.{segment:03d}.ndjson")
+
+    def open_segment(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+        self.file = open(self.segment_path(self.segment), "ab")
+        self.file.write(self.encode({"k": "h", "id": self.session_id, "start": self.start_time, "segment": self.segment}))
+
+    @staticmethod
+    def encode(record):
+        return (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+    def put(self, record):
+        # Never blocks the frame loop; if the disk can't keep up we drop and count
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_sample(self, timestamp, ear, mar, pitch, yaw):
+        self.put({"k": "s", "t": round(timestamp, 4), "e": round(ear, 4), "m": round(mar, 4),
+                  "p": round(pitch, 2), "y": round(yaw, 2)})
+
+    def write_transition(self, kind, active, timestamp):
+        self.put({"k": "o" if active else "c", "type": kind, "t": round(timestamp, 4)})
+
+    def run(self):
+        while self.started or not self.queue.empty():
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self.write_batch(batch)
+
+    def write_batch(self, batch):
+        self.file.write(b"".join(self.encode(record) for record in batch))
+        self.file.flush()
+        now = time.monotonic()
+        if self.fsync == "always" or (self.fsync == "interval" and now - self.last_sync >= self.fsync_interval):
+            self.sync()
+        if self.file.tell() >= self.rotate_bytes:
+            self.segment += 1
+            self.open_segment()
+
+    def sync(self):
+        if self.fsync != "never":
+            os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def finalize(self, summary):
+        """
+        Drains the queue, appends the footer and closes the log.
+        """
+        self.queue.put({"k": "f", "summary": summary})
+        self.started = False
+        self.thread.join()
+        self.sync()
+        self.file.close()
+
+
+def read_records(directory, session_id):
+    """
+    Yields every record of a session log, segment by segment, through mmap.
+    A truncated last line (crash mid-write) is skipped.
+    """
+    for path in sorted(glob.glob(os.path.join(directory, f"{glob.escape(session_id)}.*.ndjson"))):
+        if os.path.getsize(path) == 0:
+            continue
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def replay(directory, session_id):
+    """
+    Rebuilds a SessionManager from a (possibly unfinished) session log.
+    """
+    from src.analytics import SessionManager
+
+    session = SessionManager(live=False, session_id=session_id)
+    for record in read_records(directory, session_id):
+        kind = record["k"]
+        if kind == "s":
+            session.log_data(record["e"], record["m"], record["p"], record["y"], timestamp=record["t"])
+        elif kind == "o" or kind == "c":
+            session.update_state(record["type"], kind == "o", timestamp=record["t"])
+        elif kind == "h" and record.get("segment", 0) == 0:
+            session.start_time = record["start"]
+    return session
+
+
+def read_summary(directory, session_id):
+    """
+    Returns the summary of a session log. Finalized logs end with a footer
+    that is read straight from the mapped tail; unfinished (crashed) logs are
+    replayed.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, f"{glob.escape(session_id)}.*.ndjson")))
+    if paths and os.path.getsize(paths[-1]) > 0:
+        with open(paths[-1], "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = mm.rfind(b'{"k":"f"')
+            if pos != -1:
+                end = mm.find(b"\n", pos)
+                try:
+                    return json.loads(mm[pos:end if end != -1 else len(mm)])["summary"]
+                except ValueError:
+                    pass
+    return replay(directory, session_id).get_summary()
+
+
+def list_sessions(directory):
+    return sorted({os.path.basename(p).rsplit(".", 2)[0] for p in glob.glob(os.path.join(directory, "*.ndjson"))})
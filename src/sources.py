@@ -0,0 +1,391 @@
+import os
+import threading
+import time
+from collections import namedtuple
+import cv2
+import numpy as np
+
+# A captured frame: monotonically increasing sequence number, capture timestamp
+# (seconds; wall clock for live sources, media time for recorded clips) and the BGR image.
+Frame = namedtuple("Frame", ["seq", "timestamp", "image"])
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+class FrameSource:
+    """
+    Base class for everything that feeds frames into the pipeline.
+    Subclasses implement grab() -> (image, timestamp) or None, and may override
+    release(). Frames are captured on a background thread by start(), or pulled
+    synchronously with frames() for offline processing.
+
+    Captured frames live in a small ring of preallocated buffers. Subclasses
+    that can decode in place should write into next_buffer() to avoid
+    allocating a new image per frame. The slot of the last frame handed out
+    with copy=False is pinned: it is skipped until another frame is borrowed.
+    """
+    def __init__(self, ring_size=4):
+        self.started = False
+        self.finished = False # Set once a finite source has no more frames
+        self.condition = threading.Condition()
+        self.ring = [None] * ring_size # Frame per slot
+        self.head = 0 # Slot the next frame is written to
+        self.frame_slot = None # Slot of the latest frame
+        self.borrowed = None # Slot pinned by a copy=False reader
+        self.frame = None
+        self.seq = 0
+        self.poll_interval = 0.005 # Back-off when grab() has nothing new
+        self.max_backoff = self.poll_interval
+
+    def grab(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def next_seq(self):
+        return self.seq + 1
+
+    def next_buffer(self):
+        """
+        Returns the buffer of the slot the next frame will be written to,
+        or None until the ring has been filled once. Never the latest frame's
+        slot, nor the one borrowed with copy=False.
+        """
+        with self.condition:
+            slot = self.ring[self.next_slot()]
+            return slot.image if slot is not None else None
+
+    def next_slot(self):
+        # Called with the condition held
+        while self.head in (self.borrowed, self.frame_slot) and len(self.ring) > 2:
+            self.head = (self.head + 1) % len(self.ring)
+        return self.head
+
+    def publish(self, image, timestamp):
+        with self.condition:
+            slot = self.next_slot()
+            self.seq = self.next_seq()
+            self.frame = Frame(self.seq, timestamp, image)
+            self.ring[slot] = self.frame
+            self.frame_slot = slot
+            self.head = (slot + 1) % len(self.ring)
+            self.condition.notify_all()
+
+    def start(self):
+        if self.started:
+            print("Source already started.")
+            return self
+        self.started = True
+        self.thread = threading.Thread(target=self.update, args=(), daemon=True)
+        self.thread.start()
+        return self
+
+    def update(self):
+        failures = 0
+        while self.started:
+            grabbed = self.grab()
+            if grabbed is None:
+                if self.finished:
+                    break
+                # Nothing new yet: back off instead of spinning a core
+                failures += 1
+                time.sleep(min(self.poll_interval * (2 ** min(failures - 1, 8)), self.max_backoff))
+                continue
+            failures = 0
+            image, timestamp = grabbed
+            self.publish(image, timestamp)
+
+        # Wake up anyone blocked in wait_for_frame()
+        with self.condition:
+            self.condition.notify_all()
+
+    def frames(self):
+        """
+        Yields every frame synchronously without the capture thread.
+        Meant for benchmarks and offline analysis where no frame may be skipped.
+        """
+        while not self.finished:
+            grabbed = self.grab()
+            if grabbed is None:
+                if self.finished:
+                    break
+                time.sleep(self.poll_interval)
+                continue
+            image, timestamp = grabbed
+            self.publish(image, timestamp)
+            yield self.frame
+
+    def _export(self, frame, copy):
+        # Called with the condition held, frame is always the latest one
+        if copy:
+            return Frame(frame.seq, frame.timestamp, frame.image.copy())
+        self.borrowed = self.frame_slot
+        view = frame.image.view()
+        view.flags.writeable = False
+        return Frame(frame.seq, frame.timestamp, view)
+
+    def read_frame(self, copy=True):
+        """
+        Returns the latest Frame. copy=False hands out a read-only view of the
+        ring slot instead of a full-frame copy; it stays valid until the next
+        copy=False read, so only one consumer per source should borrow.
+        """
+        with self.condition:
+            if self.frame is None:
+                return None
+            return self._export(self.frame, copy)
+
+    def wait_for_frame(self, after_seq, timeout=1.0, copy=True):
+        """
+        Blocks until a frame newer than after_seq is available and returns it,
+        so a fast consumer never processes the same frame twice.
+        Returns None on timeout or once a finite source is exhausted.
+        """
+        with self.condition:
+            newer = lambda: (self.frame is not None and self.frame.seq > after_seq) or self.finished or not self.started
+            if not self.condition.wait_for(newer, timeout):
+                return None
+            if self.frame is None or self.frame.seq <= after_seq:
+                return None
+            return self._export(self.frame, copy)
+
+    def read(self):
+        frame = self.read_frame()
+        return frame.image if frame is not None else None
+
+    def stop(self):
+        self.started = False
+        if hasattr(self, 'thread'):
+            self.thread.join()
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class VideoFileSource(FrameSource):
+    """
+    Plays back a recorded MP4/AVI. With realtime=True frames are paced to the
+    clip's native FPS, otherwise they are decoded as fast as possible.
+    """
+    def __init__(self, path, realtime=True, loop=False):
+        super().__init__()
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open video file: {path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.next_due = None
+        self.index = 0
+
+    def grab(self):
+        grabbed, image = self.cap.read(self.next_buffer())
+        if not grabbed:
+            if self.loop and self.index > 0:
+                # Rewind; timestamps keep increasing across loops
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                return None
+            self.finished = True
+            return None
+
+        # Media time, independent of how fast we decode
+        timestamp = self.index / self.fps
+        self.index += 1
+
+        if self.realtime:
+            now = time.monotonic()
+            if self.next_due is None:
+                self.next_due = now
+            delay = self.next_due - now
+            if delay > 0:
+                time.sleep(delay)
+            self.next_due = max(self.next_due, now - 1.0 / self.fps) + 1.0 / self.fps
+
+        return image, timestamp
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageSequenceSource(FrameSource):
+    """
+    Plays back a directory of still images in filename order.
+    fps=None yields them unthrottled.
+    """
+    def __init__(self, directory, fps=None, loop=False):
+        super().__init__()
+        self.directory = directory
+        self.fps = fps
+        self.loop = loop
+        self.files = sorted(
+            os.path.join(directory, f) for f in os.listdir(directory)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.files:
+            raise IOError(f"No images found in: {directory}")
+        self.index = 0 # Next file, wraps around when looping
+        self.played = 0 # Files played so far, keeps counting across loops
+        self.next_due = None
+
+    def grab(self):
+        if self.index >= len(self.files):
+            if not self.loop:
+                self.finished = True
+                return None
+            self.index = 0
+
+        image = cv2.imread(self.files[self.index])
+        interval = 1.0 / self.fps if self.fps else 0.0
+        # Media time; timestamps keep increasing across loops
+        timestamp = self.played * interval if self.fps else time.time()
+        self.index += 1
+        self.played += 1
+        if image is None:
+            return None
+
+        if self.fps:
+            now = time.monotonic()
+            if self.next_due is None:
+                self.next_due = now
+            delay = self.next_due - now
+            if delay > 0:
+                time.sleep(delay)
+            self.next_due = max(self.next_due, now - interval) + interval
+
+        return image, timestamp
+
+
+class SharedMemoryRing:
+    """
+    Fixed layout of a frame ring in multiprocessing shared memory:
+    8 int64 control words, then per-slot sequence numbers and timestamps,
+    then the slot images.
+    """
+    CONTROL_WORDS = 8 # [write_seq, slots, height, width, channels, 0, 0, 0]
+
+    def __init__(self, shm, slots, height, width, channels):
+        self.shm = shm
+        self.slots = slots
+        self.shape = (height, width, channels)
+        buf = shm.buf
+        offset = 0
+        self.control = np.ndarray((self.CONTROL_WORDS,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self.CONTROL_WORDS * 8
+        self.slot_seq = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += slots * 8
+        self.slot_ts = np.ndarray((slots,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += slots * 8
+        self.images = np.ndarray((slots, height, width, channels), dtype=np.uint8, buffer=buf, offset=offset)
+
+    @classmethod
+    def size(cls, slots, height, width, channels):
+        return cls.CONTROL_WORDS * 8 + slots * 16 + slots * height * width * channels
+
+
+class SharedMemoryProducer:
+    """
+    Writer side of the shared-memory ring, used by an external capture process:
+
+        producer = SharedMemoryProducer("cab0", (480, 640, 3))
+        producer.write(frame)
+    """
+    def __init__(self, name, shape, slots=4):
+        from multiprocessing import shared_memory
+        height, width, channels = shape
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=True, size=SharedMemoryRing.size(slots, height, width, channels))
+        self.ring = SharedMemoryRing(self.shm, slots, height, width, channels)
+        self.ring.control[:] = [0, slots, height, width, channels, 0, 0, 0]
+        self.ring.slot_seq[:] = 0
+        self.seq = 0
+
+    def write(self, image, timestamp=None):
+        self.seq += 1
+        slot = self.seq % self.ring.slots
+        ring = self.ring
+        ring.slot_seq[slot] = -1 # Mark slot as being written
+        ring.images[slot][...] = image
+        ring.slot_ts[slot] = timestamp if timestamp is not None else time.time()
+        ring.slot_seq[slot] = self.seq
+        ring.control[0] = self.seq
+        return self.seq
+
+    def close(self):
+        self.ring = None # Drop the array views before closing the segment
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedMemorySource(FrameSource):
+    """
+    Reader side of the shared-memory ring. Frames keep the producer's
+    sequence numbers, so gaps show up as dropped frames.
+    """
+    def __init__(self, name, poll_interval=0.002):
+        super().__init__()
+        from multiprocessing import shared_memory
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13: stop the resource tracker from unlinking the producer's segment
+            from multiprocessing import resource_tracker
+            self.shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        control = np.ndarray((SharedMemoryRing.CONTROL_WORDS,), dtype=np.int64, buffer=self.shm.buf)
+        slots, height, width, channels = (int(v) for v in control[1:5])
+        del control
+        self.shm_ring = SharedMemoryRing(self.shm, slots, height, width, channels)
+        self.poll_interval = poll_interval
+        self.last_seq = 0
+
+    def grab(self):
+        ring = self.shm_ring
+        seq = int(ring.control[0])
+        if seq <= self.last_seq:
+            return None
+
+        slot = seq % ring.slots
+        image = self.next_buffer()
+        if image is None or image.shape != ring.shape:
+            image = np.empty(ring.shape, dtype=np.uint8)
+        np.copyto(image, ring.images[slot])
+        timestamp = float(ring.slot_ts[slot])
+
+        # Torn read check: the producer lapped us while copying
+        if int(ring.slot_seq[slot]) != seq:
+            return None
+
+        self.last_seq = seq
+        return image, timestamp
+
+    def next_seq(self):
+        return self.last_seq
+
+    def release(self):
+        self.shm_ring = None # Drop the array views before closing the segment
+        self.shm.close()
+
+
+def open_source(spec, width=640, height=480):
+    """
+    Builds a FrameSource from a config value:
+    device index -> Camera, "shm://<name>" -> SharedMemorySource,
+    directory -> ImageSequenceSource, anything else -> VideoFileSource.
+    """
+    from src.camera import Camera
+
+    if isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+        return Camera(src=int(spec), width=width, height=height)
+    if spec.startswith("shm://"):
+        return SharedMemorySource(spec[len("shm://"):])
+    if os.path.isdir(spec):
+        return ImageSequenceSource(spec, fps=30)
+    return VideoFileSource(spec, realtime=True)
@@ -0,0 +1,332 @@
+import threading
+from collections import deque
+import numpy as np
+
+
+class ChunkedColumns:
+    """
+    Append-only 2D float64 buffer made of fixed-size preallocated chunks.
+    Appends are O(1) and never copy existing rows; with max_rows set the
+    oldest chunks are dropped so memory stays bounded. Readers on other
+    threads take a snapshot of the chunk list and fill under a small lock;
+    rows below the fill are never rewritten, so the rest runs unlocked.
+    """
+    def __init__(self, ncols, chunk_size=4096, max_rows=None):
+        self.ncols = ncols
+        self.chunk_size = chunk_size
+        self.max_chunks = None if max_rows is None else max(1, -(-max_rows // chunk_size)) + 1
+        self.chunks = deque()
+        self.fill = chunk_size # Rows used in the last chunk
+        self.dropped = 0 # Rows discarded from the front
+        self.lock = threading.Lock()
+
+    def append(self, row):
+        with self.lock:
+            if self.fill == self.chunk_size:
+                self.chunks.append(np.empty((self.chunk_size, self.ncols), dtype=np.float64))
+                self.fill = 0
+                if self.max_chunks is not None and len(self.chunks) > self.max_chunks:
+                    self.chunks.popleft()
+                    self.dropped += self.chunk_size
+            self.chunks[-1][self.fill] = row
+            self.fill += 1
+
+    def snapshot(self):
+        # Chunks and the fill of the last one, consistent with each other
+        with self.lock:
+            return list(self.chunks), self.fill
+
+    def __len__(self):
+        chunks, fill = self.snapshot()
+        if not chunks:
+            return 0
+        return (len(chunks) - 1) * self.chunk_size + fill
+
+    def to_array(self):
+        parts, fill = self.snapshot()
+        if not parts:
+            return np.empty((0, self.ncols), dtype=np.float64)
+        parts[-1] = parts[-1][:fill]
+        return np.concatenate(parts)
+
+    def between(self, lo, hi):
+        """
+        Rows whose first column (non-decreasing, e.g. a timestamp) is within
+        [lo, hi]. Only the chunks overlapping the range are copied.
+        """
+        chunks, fill = self.snapshot()
+        if not chunks:
+            return np.empty((0, self.ncols), dtype=np.float64)
+        firsts = np.array([chunk[0, 0] for chunk in chunks])
+        i = max(0, int(np.searchsorted(firsts, lo, side="right")) - 1)
+        j = int(np.searchsorted(firsts, hi, side="right"))
+        parts = chunks[i:j]
+        if not parts:
+            return np.empty((0, self.ncols), dtype=np.float64)
+        if j == len(chunks):
+            parts[-1] = parts[-1][:fill]
+        data = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        a = np.searchsorted(data[:, 0], lo, side="left")
+        b = np.searchsorted(data[:, 0], hi, side="right")
+        return data[a:b].copy()
+
+    def first(self):
+        # First retained value of the first column
+        chunks, _ = self.snapshot()
+        return float(chunks[0][0, 0]) if chunks else None
+
+    def nbytes(self):
+        return len(self.chunks) * self.chunk_size * self.ncols * 8
+
+
+class Tier:
+    """
+    Downsampled copy of a series: one row per `resolution` seconds with the
+    mean, min and max of every value column. Rows are
+    [bucket_start, count, mean_0, min_0, max_0, mean_1, ...]. The bucket
+    being filled is guarded by a lock, so readers see it whole.
+    """
+    def __init__(self, resolution, nvalues, chunk_size=1024, max_rows=None):
+        self.resolution = resolution
+        self.nvalues = nvalues
+        self.rows = ChunkedColumns(2 + 3 * nvalues, chunk_size=chunk_size, max_rows=max_rows)
+        self.lock = threading.Lock()
+        self.bucket = None
+        self.count = 0
+        self.sums = np.zeros(nvalues)
+        self.mins = np.full(nvalues, np.inf)
+        self.maxs = np.full(nvalues, -np.inf)
+
+    def add(self, timestamp, values):
+        bucket = int(timestamp // self.resolution)
+        with self.lock:
+            if self.bucket is not None and bucket != self.bucket:
+                self._flush()
+            self.bucket = bucket
+            self.count += 1
+            self.sums += values
+            np.minimum(self.mins, values, out=self.mins)
+            np.maximum(self.maxs, values, out=self.maxs)
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.count == 0:
+            return
+        row = np.empty(2 + 3 * self.nvalues)
+        row[0] = self.bucket * self.resolution
+        row[1] = self.count
+        row[2::3] = self.sums / self.count
+        row[3::3] = self.mins
+        row[4::3] = self.maxs
+        self.rows.append(row)
+        self.count = 0
+        self.sums[:] = 0
+        self.mins[:] = np.inf
+        self.maxs[:] = -np.inf
+
+    def partial(self):
+        # The bucket still being filled as a (1, ncols) row; called with the lock held
+        partial = np.empty((1, 2 + 3 * self.nvalues))
+        partial[0, 0] = self.bucket * self.resolution
+        partial[0, 1] = self.count
+        partial[0, 2::3] = self.sums / self.count
+        partial[0, 3::3] = self.mins
+        partial[0, 4::3] = self.maxs
+        return partial
+
+    def to_array(self):
+        """
+        Completed buckets plus the one still being filled.
+        """
+        with self.lock:
+            rows = self.rows.to_array()
+            if self.count == 0:
+                return rows
+            return np.concatenate([rows, self.partial()])
+
+    def between(self, lo, hi):
+        with self.lock:
+            rows = self.rows.between(lo, hi)
+            if self.count and lo <= self.bucket * self.resolution <= hi:
+                rows = np.concatenate([rows, self.partial()])
+            return rows
+
+
+class SessionSeries:
+    """
+    Columnar per-frame store for a session: timestamp plus value columns,
+    with running aggregates kept on append and optional downsampling tiers
+    for long sessions.
+    """
+    def __init__(self, columns=("ear", "mar", "pitch", "yaw"), raw_capacity=None, tiers=(), chunk_size=4096):
+        self.columns = tuple(columns)
+        self.index = {name: i + 1 for i, name in enumerate(self.columns)} # Column 0 is the timestamp
+        self.raw = ChunkedColumns(1 + len(self.columns), chunk_size=chunk_size, max_rows=raw_capacity)
+        self.tiers = [Tier(resolution, len(self.columns)) for resolution in tiers]
+
+        # Running aggregates over the whole session
+        self.count = 0
+        self.sums = np.zeros(len(self.columns))
+        self.mins = np.full(len(self.columns), np.inf)
+        self.maxs = np.full(len(self.columns), -np.inf)
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self._row = np.empty(1 + len(self.columns))
+
+    def append(self, timestamp, *values):
+        row = self._row
+        row[0] = timestamp
+        row[1:] = values
+        self.raw.append(row)
+
+        vals = row[1:]
+        self.count += 1
+        self.sums += vals
+        np.minimum(self.mins, vals, out=self.mins)
+        np.maximum(self.maxs, vals, out=self.maxs)
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+
+        for tier in self.tiers:
+            tier.add(timestamp, vals)
+
+    def __len__(self):
+        return self.count
+
+    def mean(self, column):
+        return float(self.sums[self.index[column] - 1] / self.count) if self.count else 0.0
+
+    def min(self, column):
+        return float(self.mins[self.index[column] - 1]) if self.count else 0.0
+
+    def max(self, column):
+        return float(self.maxs[self.index[column] - 1]) if self.count else 0.0
+
+    def to_array(self):
+        """
+        Retained raw rows as an (n, 1 + ncolumns) array.
+        """
+        return self.raw.to_array()
+
+    def tier(self, resolution):
+        # Downsampled tier closest to the requested resolution (None without tiers)
+        if not self.tiers:
+            return None
+        return min(self.tiers, key=lambda t: abs(t.resolution - resolution))
+
+    def query(self, t1, t2, points=300, columns=None, mode="minmax"):
+        """
+        Values of `columns` between t1 and t2, downsampled to about `points`
+        points per column: {"source", "resolution", "series": {name: {"t", "v"}}}.
+        Reads from the coarsest source (a tier, or the raw samples) that still
+        has `points` rows in the range, so the rows touched per request are
+        bounded by the tier spacing, not the session length. mode "minmax"
+        keeps the extremes of every bucket (no eye closure is averaged away),
+        "lttb" (Largest-Triangle-Three-Buckets) the visual shape.
+        """
+        columns = list(columns or self.columns)
+        span = max(t2 - t1, 1e-9)
+        source, resolution = None, None
+
+        # Raw samples can serve the range if they still reach back to t1
+        first = self.raw.first()
+        sources = []
+        if first is not None and self.count > 1 and first <= max(t1, self.first_timestamp):
+            rate = (self.count - 1) / max(self.last_timestamp - self.first_timestamp, 1e-9)
+            sources.append(("raw", 1.0 / rate))
+        sources += [(tier, tier.resolution) for tier in sorted(self.tiers, key=lambda t: t.resolution)]
+        for candidate, res in sources:
+            if source is None or span / res >= points:
+                source, resolution = candidate, res
+        series = {}
+        if source == "raw":
+            data = self.raw.between(t1, t2)
+            x = data[:, 0]
+            for name in columns:
+                y = data[:, self.index[name]]
+                series[name] = downsample(x, y, y, points, mode)
+        elif source is not None:
+            data = source.between(t1, t2)
+            x = data[:, 0]
+            for name in columns:
+                col = 2 + 3 * (self.index[name] - 1) # mean, min, max
+                if mode == "minmax":
+                    series[name] = downsample(x, data[:, col + 1], data[:, col + 2], points, mode)
+                else:
+                    series[name] = downsample(x, data[:, col], data[:, col], points, mode)
+        return {
+            "source": "raw" if source == "raw" else "tier" if source is not None else None,
+            "resolution": resolution,
+            "series": series,
+        }
+
+    def column(self, name):
+        data = self.to_array()
+        return data[:, 0 if name == "timestamp" else self.index[name]]
+
+    def nbytes(self):
+        return self.raw.nbytes() + sum(t.rows.nbytes() for t in self.tiers)
+
+
+def lttb(x, y, n):
+    """
+    Largest-Triangle-Three-Buckets: indices of n points that keep the
+    visual shape of the line (x, y).
+    """
+    m = len(x)
+    if n >= m or n < 3:
+        return np.arange(m)
+    edges = np.linspace(1, m - 1, n - 1).astype(np.int64) # n - 2 buckets between first and last point
+    sums_x = np.add.reduceat(x[1:m - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:m - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    # Average of the following bucket (the last point for the last bucket)
+    next_x = np.append(sums_x[1:] / sizes[1:], x[m - 1])
+    next_y = np.append(sums_y[1:] / sizes[1:], y[m - 1])
+
+    idx = np.empty(n, dtype=np.int64)
+    idx[0], idx[-1] = 0, m - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+
+def minmax(lows, highs, n):
+    """
+    The minimum of `lows` and the maximum of `highs` in each of n // 2
+    buckets, in time order: (row indices, whether each point is a maximum).
+    """
+    m = len(lows)
+    if n >= m:
+        return np.arange(m), np.zeros(m, dtype=bool)
+    edges = np.linspace(0, m, max(1, n // 2) + 1).astype(np.int64)
+    idx, is_max = [], []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        low = lo + int(np.argmin(lows[lo:hi]))
+        high = lo + int(np.argmax(highs[lo:hi]))
+        if high < low:
+            idx += [high, low]
+            is_max += [True, False]
+        else:
+            idx += [low, high]
+            is_max += [False, True]
+    return np.array(idx, dtype=np.int64), np.array(is_max)
+
+
+def downsample(x, lows, highs, n, mode="lttb"):
+    # {"t", "v"} lists of about n points; lows and highs differ only for tier min/max columns
+    if mode == "minmax":
+        idx, is_max = minmax(lows, highs, n)
+        values = np.where(is_max, highs[idx], lows[idx])
+    else:
+        idx = lttb(x, lows, n)
+        values = lows[idx]
+    return {"t": np.round(x[idx], 3).tolist(), "v": np.round(values, 4).tolist()}
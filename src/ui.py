@@ -12,17 +12,12 @@ def draw_info(frame, ear, mar, is_drowsy, is_yawning):
     if is_yawning:
         cv2.putText(frame, "YAWNING ALERT!", (10, 340), cv2.FONT_HERSHEY_SIMPLEX, 0.7, COLOR_YELLOW, 2)
 
-def draw_landmarks(frame, landmarks, w, h, detector_class):
+def draw_landmarks(frame, points, detector_class):
     # Optional: Draw eye and mouth landmarks for visual feedback
     # We need the indices from the detector class to draw them specifically
     
-    for idx in detector_class.LEFT_EYE + detector_class.RIGHT_EYE:
-        x = int(landmarks.landmark[idx].x * w)
-        y = int(landmarks.landmark[idx].y * h)
-        cv2.circle(frame, (x, y), 1, COLOR_GREEN, -1)
+    for x, y in points[detector_class.EYES.ravel(), :2].astype(int):
+        cv2.circle(frame, (int(x), int(y)), 1, COLOR_GREEN, -1)
         
-    for pair in detector_class.MAR_POINTS:
-        for idx in pair:
-            x = int(landmarks.landmark[idx].x * w)
-            y = int(landmarks.landmark[idx].y * h)
-            cv2.circle(frame, (x, y), 1, COLOR_YELLOW, -1)
+    for x, y in points[detector_class.MAR_PAIRS.ravel(), :2].astype(int):
+        cv2.circle(frame, (int(x), int(y)), 1, COLOR_YELLOW, -1)
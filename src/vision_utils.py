@@ -1,26 +1,95 @@
 import cv2
 import numpy as np
 
+_GAMMA_TABLES = {}
+
+def gamma_table(gamma):
+    """
+    256-entry gamma correction LUT, built once per (0.1-rounded) gamma.
+    Output = (Input/255) ^ (1/gamma) * 255
+    """
+    gamma = round(gamma, 1)
+    table = _GAMMA_TABLES.get(gamma)
+    if table is None:
+        table = ((np.arange(256) / 255.0) ** (1.0 / gamma) * 255).astype(np.uint8)
+        _GAMMA_TABLES[gamma] = table
+    return table
+
+def estimate_brightness(frame, stride=8):
+    """
+    Mean HSV Value (max of B, G, R) over a strided sample of the frame,
+    without converting the full frame.
+    """
+    sample = frame[::stride, ::stride]
+    if sample.ndim == 3:
+        sample = sample.max(axis=2)
+    return float(sample.mean())
+
 def enhance_low_light(frame, brightness_threshold=70, gamma=2.5):
     """
     Checks if the frame is too dark and applies gamma correction if needed.
+    Stateless; the pipeline uses LowLightEnhancer.
     Returns: (enhanced_frame, is_low_light)
     """
-    # Convert to HSV to check brightness (Value channel)
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    v_channel = hsv[:, :, 2]
-    avg_brightness = np.mean(v_channel)
-    
-    is_low_light = avg_brightness < brightness_threshold
-    
-    if is_low_light:
-        # Gamma Correction: Power Law Transform
-        # Output = (Input/255) ^ (1/gamma) * 255
-        inv_gamma = 1.0 / gamma
-        table = np.array([((i / 255.0) ** inv_gamma) * 255
-                          for i in np.arange(0, 256)]).astype("uint8")
-        
-        enhanced_frame = cv2.LUT(frame, table)
-        return enhanced_frame, True
-    
+    if estimate_brightness(frame) < brightness_threshold:
+        return cv2.LUT(frame, gamma_table(gamma)), True
     return frame, False
+
+
+class LowLightEnhancer:
+    """
+    Frame-to-frame stable low-light correction.
+    Brightness is smoothed with an EMA, the low-light flag switches with
+    hysteresis (on below `threshold`, off above `threshold + hysteresis`) and
+    gamma follows the smoothed brightness, so neither flickers on noise.
+    With clahe=True the face ROI (if given) also gets local contrast
+    equalization while in low light.
+    """
+    def __init__(self, threshold=70, hysteresis=10, target_brightness=110, max_gamma=2.5,
+                 smoothing=0.2, stride=8, clahe=False, clahe_clip=2.0):
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.target_brightness = target_brightness # Gamma aims to lift the mean to about this
+        self.max_gamma = max_gamma
+        self.smoothing = smoothing # EMA weight of the newest frame
+        self.stride = stride
+        self.clahe = cv2.createCLAHE(clipLimit=clahe_clip, tileGridSize=(4, 4)) if clahe else None
+
+        self.brightness = None
+        self.low_light = False
+        self.gamma = 1.0
+
+    def update(self, brightness):
+        if self.brightness is None:
+            self.brightness = brightness
+        else:
+            self.brightness += self.smoothing * (brightness - self.brightness)
+
+        if self.low_light:
+            self.low_light = self.brightness < self.threshold + self.hysteresis
+        else:
+            self.low_light = self.brightness < self.threshold
+
+        # Gamma that maps the smoothed mean brightness to the target
+        level = min(max(self.brightness, 1.0), 254.0) / 255.0
+        gamma = np.log(level) / np.log(self.target_brightness / 255.0)
+        self.gamma = float(min(max(gamma, 1.0), self.max_gamma))
+        return self.low_light
+
+    def apply(self, frame, roi=None):
+        """
+        Returns (enhanced_frame, is_low_light). The input frame is never
+        modified; roi is an (x0, y0, x1, y1) face box for the CLAHE mode.
+        """
+        if not self.update(estimate_brightness(frame, self.stride)):
+            return frame, False
+
+        enhanced = cv2.LUT(frame, gamma_table(self.gamma))
+        if self.clahe is not None and roi is not None:
+            x0, y0, x1, y1 = roi
+            face = enhanced[y0:y1, x0:x1]
+            if face.size:
+                lab = cv2.cvtColor(face, cv2.COLOR_BGR2LAB)
+                lab[:, :, 0] = self.clahe.apply(np.ascontiguousarray(lab[:, :, 0]))
+                face[:] = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        return enhanced, True
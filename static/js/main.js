@@ -2,6 +2,11 @@
 let liveChart = null;
 let reportChart = null;
 let pollingInterval = null;
+let statusSource = null;
+let liveStatus = {};
+let lastChartUpdate = 0;
+let chartRange = 'live';
+let historyTimer = null;
 
 function initLiveChart() {
     const ctx = document.getElementById('liveChart').getContext('2d');
@@ -55,8 +60,8 @@ async function startSession() {
             document.getElementById('btn-stop').disabled = false;
             document.getElementById('btn-stop').style.opacity = 1;
 
-            // Start Polling
-            startPolling();
+            // Start receiving status pushes
+            startStatusStream();
         }
     } catch (e) {
         console.error("Failed to start session:", e);
@@ -68,11 +73,22 @@ async function stopSession() {
     if (!confirm("End current session and view report?")) return;
 
     try {
-        // Stop Polling
-        if (pollingInterval) clearInterval(pollingInterval);
+        // Stop status updates
+        stopStatusStream();
+        clearInterval(historyTimer);
+        historyTimer = null;
 
         const response = await fetch('/stop_session');
-        const report = await response.json();
+        let report = await response.json();
+
+        // Load the report back from the history store (same shape, plus the stored series)
+        if (report.session_id) {
+            const stored = await fetch(`/sessions/${encodeURIComponent(report.session_id)}`);
+            const saved = stored.ok ? await stored.json() : null;
+            if (saved && saved.summary) {
+                report = saved;
+            }
+        }
 
         // Show Report View
         showReport(report);
@@ -82,6 +98,35 @@ async function stopSession() {
     }
 }
 
+function startStatusStream() {
+    stopStatusStream();
+
+    // Fall back to polling on browsers without Server-Sent Events
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+
+    liveStatus = {};
+    statusSource = new EventSource('/events');
+    statusSource.onmessage = (event) => {
+        // The server sends the full status first, then only changed fields
+        Object.assign(liveStatus, JSON.parse(event.data));
+        renderStatus(liveStatus);
+    };
+    statusSource.onerror = (e) => {
+        console.error("Status stream error", e);
+    };
+}
+
+function stopStatusStream() {
+    if (statusSource) {
+        statusSource.close();
+        statusSource = null;
+    }
+    if (pollingInterval) clearInterval(pollingInterval);
+}
+
 function startPolling() {
     if (pollingInterval) clearInterval(pollingInterval);
     pollingInterval = setInterval(async () => {
@@ -91,56 +136,64 @@ function startPolling() {
 
             if (data.error) return; // Stopped
 
-            // Update Text
-            document.getElementById('ear-val').innerText = data.ear.toFixed(2);
-            document.getElementById('mar-val').innerText = data.mar.toFixed(2);
-            document.getElementById('pitch-val').innerText = data.pitch.toFixed(1);
-            document.getElementById('yaw-val').innerText = data.yaw.toFixed(1);
-            document.getElementById('bpm-val').innerText = data.bpm;
-            document.getElementById('fps-val').innerText = data.fps.toFixed(1);
-
-            // Update Status Indicators
-            updateIndicator('status-drowsy', data.drowsy, 'drowsy');
-            updateIndicator('status-yawn', data.yawning, 'yawn');
-            updateIndicator('status-distracted', data.distracted, 'distracted');
-
-            // Auth Indicator
-            const authEl = document.getElementById('status-auth');
-            if (data.authenticated) {
-                authEl.innerText = "UNLOCKED";
-                authEl.className = "status-indicator status-active auth";
-                authEl.style.background = "var(--accent-green)";
-                authEl.style.color = "#000";
-            } else {
-                authEl.innerText = "LOCKED";
-                authEl.className = "status-indicator";
-                authEl.style.background = "";
-                authEl.style.color = "";
-            }
-
-            // Low Light Indicator
-            updateIndicator('status-low-light', data.low_light, 'low-light');
-
-            // Update Chart
-            if (liveChart) {
-                updateLiveChart(data.ear, data.mar);
-            }
-
+            renderStatus(data);
         } catch (e) {
             console.error("Error fetching status", e);
         }
     }, 500);
 }
 
+function renderStatus(data) {
+    // Update Text
+    document.getElementById('ear-val').innerText = data.ear.toFixed(2);
+    document.getElementById('mar-val').innerText = data.mar.toFixed(2);
+    document.getElementById('pitch-val').innerText = data.pitch.toFixed(1);
+    document.getElementById('yaw-val').innerText = data.yaw.toFixed(1);
+    document.getElementById('bpm-val').innerText = data.bpm;
+    document.getElementById('fps-val').innerText = data.fps.toFixed(1);
+
+    // Update Status Indicators
+    updateIndicator('status-drowsy', data.drowsy, 'drowsy');
+    updateIndicator('status-yawn', data.yawning, 'yawn');
+    updateIndicator('status-distracted', data.distracted, 'distracted');
+
+    // Auth Indicator
+    const authEl = document.getElementById('status-auth');
+    if (data.authenticated) {
+        authEl.innerText = data.driver ? data.driver.toUpperCase() : "UNLOCKED";
+        authEl.className = "status-indicator status-active auth";
+        authEl.style.background = "var(--accent-green)";
+        authEl.style.color = "#000";
+    } else {
+        authEl.innerText = "LOCKED";
+        authEl.className = "status-indicator";
+        authEl.style.background = "";
+        authEl.style.color = "";
+    }
+
+    // Low Light Indicator
+    updateIndicator('status-low-light', data.low_light, 'low-light');
+
+    // Update Chart (pushes arrive at frame rate, keep the chart at ~5 points/s)
+    const now = Date.now();
+    if (liveChart && chartRange === 'live' && now - lastChartUpdate >= 200) {
+        lastChartUpdate = now;
+        updateLiveChart(data.ear, data.mar);
+    }
+}
+
 async function registerFace() {
     if (!document.getElementById('btn-start').disabled) {
         alert("Please START the session first to turn on the camera.");
         return;
     }
 
+    const name = prompt("Driver name:", "driver");
+    if (!name) return;
+
     document.getElementById('btn-register').innerText = "Scanning...";
     try {
-        const response = await fetch('/register_face');
+        const response = await fetch('/register_face?name=' + encodeURIComponent(name));
         const data = await response.json();
         alert(data.message);
     } catch (e) {
@@ -158,6 +211,52 @@ function updateLiveChart(ear, mar) {
     liveChart.update();
 }
 
+function setChartRange(range) {
+    chartRange = range;
+    clearInterval(historyTimer);
+    historyTimer = null;
+
+    const x = liveChart.options.scales.x;
+    if (range === 'live') {
+        // Back to the rolling window of pushed samples
+        x.type = 'category';
+        x.display = false;
+        liveChart.data.labels = Array(50).fill('');
+        liveChart.data.datasets.forEach(ds => ds.data = Array(50).fill(0));
+        liveChart.update();
+        return;
+    }
+    x.type = 'linear';
+    x.display = true;
+    x.ticks = { color: '#94a3b8', callback: (value) => formatSeconds(value) };
+    loadHistory();
+    historyTimer = setInterval(loadHistory, 5000);
+}
+
+async function loadHistory() {
+    // Downsampled on the server to about one point per pixel, whatever the session length
+    const from = chartRange === 'session' ? 0 : -Number(chartRange);
+    const points = Math.min(1000, Math.max(100, Math.round(liveChart.width || 300)));
+    try {
+        const response = await fetch(`/history?from=${from}&points=${points}&columns=ear,mar`);
+        if (!response.ok || chartRange === 'live') return;
+        const history = await response.json();
+        const toPoints = (s) => s.t.map((t, i) => ({ x: t, y: s.v[i] }));
+        liveChart.data.labels = [];
+        liveChart.data.datasets[0].data = toPoints(history.series.ear);
+        liveChart.data.datasets[1].data = toPoints(history.series.mar);
+        liveChart.update();
+    } catch (e) {
+        console.error("Failed to load history:", e);
+    }
+}
+
+function formatSeconds(seconds) {
+    const mins = Math.floor(seconds / 60);
+    const secs = Math.floor(seconds % 60);
+    return `${mins}:${secs < 10 ? '0' + secs : secs}`;
+}
+
 function updateIndicator(id, isActive, className) {
     const el = document.getElementById(id);
     if (isActive) {
@@ -191,25 +290,27 @@ function showReport(report) {
     }
 
     // Render Report Chart
-    renderReportChart(report.events || [], summary.counts);
+    renderReportChart(report.events || [], summary);
 }
 
-function renderReportChart(events, counts) {
+function renderReportChart(events, summary) {
     const ctx = document.getElementById('reportChart').getContext('2d');
 
-    // Use the counts calculated in python for consistency, or we can recalculate relative distribution
+    // Exact episode durations from the server, remaining time counts as focused
+    const secs = summary.seconds;
+    const focused = Math.max(0, summary.duration_seconds - secs.drowsy - secs.distracted - secs.yawn);
 
     new Chart(ctx, {
         type: 'doughnut', // Doughnut is better for relative time distribution
         data: {
-            labels: ['Drowsy Time', 'Distracted Time', 'Yawning Time', 'Focused (Est)'],
+            labels: ['Drowsy Time', 'Distracted Time', 'Yawning Time', 'Focused'],
             datasets: [{
-                label: 'Session Breakdown (Frames)',
+                label: 'Session Breakdown (Seconds)',
                 data: [
-                    counts.drowsy,
-                    counts.distracted,
-                    counts.yawn,
-                    // Estimate focused frames? Not critical, let's just show events
+                    secs.drowsy,
+                    secs.distracted,
+                    secs.yawn,
+                    focused
                 ],
                 backgroundColor: ['#ef4444', '#3b82f6', '#eab308', '#22c55e'],
                 borderWidth: 0
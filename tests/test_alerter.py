@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.alerter import Alerter, LogSink, WebhookSink
+
+
+class Hook:
+    """
+    Local HTTP stand-in for a webhook endpoint: records every JSON body
+    POSTed to it, optionally answering after `delay` seconds.
+    """
+    def __init__(self, delay=0.0):
+        self.events = []
+        self.delay = delay
+        hook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(hook.delay)
+                hook.events.append(json.loads(body))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/alerts"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def wait_for(self, count, timeout=3.0):
+        deadline = time.monotonic() + timeout
+        while len(self.events) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.events
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def hook():
+    hook = Hook()
+    yield hook
+    hook.close()
+
+
+def test_webhook_gets_start_and_end(hook):
+    alerter = Alerter(sinks=[WebhookSink(hook.url)], release=0.2, stream="cab1")
+    alerter.update("DROWSY", True)
+    time.sleep(0.1)
+    alerter.update("DROWSY", False)
+
+    start, end = hook.wait_for(2)
+    assert start["type"] == end["type"] == "DROWSY"
+    assert start["active"] and not end["active"]
+    assert start["stream"] == "cab1"
+    assert end["duration"] == pytest.approx(0.1, abs=0.05)
+    alerter.stop()
+    assert len(hook.events) == 2
+
+
+def test_release_debounces_a_flickering_state(hook):
+    alerter = Alerter(sinks=[WebhookSink(hook.url)], release=0.5)
+    alerter.update("YAWN", True)
+    for _ in range(5):
+        time.sleep(0.02)
+        alerter.update("YAWN", False)
+        time.sleep(0.02)
+        alerter.update("YAWN", True)
+    time.sleep(0.6)
+    assert [e["active"] for e in hook.wait_for(1)] == [True] # Still one alert
+
+    alerter.update("YAWN", False)
+    time.sleep(0.2)
+    assert len(hook.events) == 1 # Not released yet
+    assert [e["active"] for e in hook.wait_for(2)] == [True, False]
+    alerter.stop()
+
+
+def test_stop_ends_active_alerts(hook):
+    alerter = Alerter(sinks=[WebhookSink(hook.url)], release=10.0)
+    alerter.update("DISTRACTED", True)
+    alerter.stop()
+    assert [e["active"] for e in hook.events] == [True, False]
+
+
+def test_slow_webhook_does_not_delay_other_sinks(tmp_path):
+    hook = Hook(delay=0.5)
+    path = tmp_path / "alerts.log"
+    alerter = Alerter(sinks=[WebhookSink(hook.url), LogSink(str(path))], release=0.0)
+    try:
+        alerter.update("DROWSY", True)
+        deadline = time.monotonic() + 0.3
+        while not path.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert path.exists() and not hook.events
+        alerter.stop()
+        assert [e["active"] for e in hook.events] == [True, False]
+    finally:
+        hook.close()
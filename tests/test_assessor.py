@@ -0,0 +1,17 @@
+from src.assessor import Assessor
+from config import EAR_SECONDS
+
+
+def test_face_lost_ends_the_eyes_closed_run():
+    assessor = Assessor(ear_threshold=0.2, mar_threshold=0.5)
+    t = 0.0
+    while t < EAR_SECONDS + 0.5:
+        assessor.update(0.1, 0.1, timestamp=t)
+        t += 0.1
+    assert assessor.is_drowsy()
+
+    assessor.face_lost()
+    assert not assessor.is_drowsy()
+    # Closed eyes on the next face have to last EAR_SECONDS again
+    assessor.update(0.1, 0.1, timestamp=t)
+    assert not assessor.is_drowsy()
@@ -0,0 +1,43 @@
+import pytest
+
+from src.episodes import IntervalIndex
+
+
+def make_index(*intervals):
+    index = IntervalIndex()
+    for start, end in intervals:
+        index.open(start)
+        index.close(end)
+    return index
+
+
+def test_total_whole_session():
+    index = make_index((0, 2), (5, 6), (10, 14))
+    assert index.total() == pytest.approx(7.0)
+    assert len(index) == 3
+
+
+def test_total_clips_to_the_query_range():
+    index = make_index((0, 2), (5, 6), (10, 14))
+    assert index.total(1, 12) == pytest.approx(1 + 1 + 2)
+    assert index.total(5.5, 5.75) == pytest.approx(0.25)
+    assert index.total(2, 5) == 0.0
+    assert index.total(20, 30) == 0.0
+
+
+def test_total_counts_the_open_episode_until_now():
+    index = make_index((0, 2))
+    index.open(8)
+    assert index.is_open()
+    assert index.total() == pytest.approx(2.0) # Without `now` the open episode isn't counted
+    assert index.total(now=11) == pytest.approx(5.0)
+    assert index.total(9, 20, now=11) == pytest.approx(2.0)
+    assert index.overlapping(1, 9, now=11) == [(0, 2), (8, 11)]
+
+
+def test_close_never_goes_backwards():
+    index = IntervalIndex()
+    index.open(5)
+    assert index.close(4) == (5, 5)
+    assert index.close(6) is None
+    assert index.total() == 0.0
@@ -0,0 +1,40 @@
+import json
+
+import numpy as np
+
+from src.identity import IdentityManager, PROFILE_FILE
+from config import FRAME_WIDTH, FRAME_HEIGHT
+
+
+def face(seed):
+    # MediaPipe-style [0, 1] landmarks
+    return np.random.default_rng(seed).uniform(0, 1, (478, 3)).astype(np.float32)
+
+
+def to_pixels(points):
+    return points * np.array([FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH], dtype=np.float32)
+
+
+def test_legacy_profile_is_converted_to_pixel_space(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    legacy = face(0) - face(0)[1]
+    with open(PROFILE_FILE, "w") as f:
+        json.dump((legacy / np.abs(legacy).max()).tolist(), f)
+
+    manager = IdentityManager()
+    assert manager.names() == ["driver"]
+    match, score, name = manager.verify_user(to_pixels(face(0)))
+    assert match and name == "driver" and score < 1e-6
+
+
+def test_enroll_rebuilds_the_matching_matrix(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = IdentityManager(interval=1) # No cached results
+    manager.enroll("alice", [to_pixels(face(1))])
+    assert manager.verify_user(to_pixels(face(1)))[2] == "alice"
+
+    manager.enroll("bob", [to_pixels(face(2))])
+    matrix, norms, names = manager.matching_matrix()
+    assert names == ["alice", "bob"] and len(matrix) == len(norms) == 2
+    assert manager.verify_user(to_pixels(face(2)))[2] == "bob"
+    assert not manager.verify_user(to_pixels(face(3)))[0]
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from src.timeseries import SessionSeries, lttb, minmax
+
+
+@pytest.fixture
+def signal():
+    x = np.arange(10000, dtype=float) / 30.0
+    y = np.sin(x / 10.0)
+    y[4321] = 5.0 # One spike that must survive downsampling
+    y[7000] = -5.0
+    return x, y
+
+
+def test_lttb_point_count_and_endpoints(signal):
+    x, y = signal
+    idx = lttb(x, y, 300)
+    assert len(idx) == 300
+    assert idx[0] == 0 and idx[-1] == len(x) - 1
+    assert np.all(np.diff(idx) > 0)
+    assert 4321 in idx and 7000 in idx
+
+
+def test_lttb_keeps_short_series():
+    x = np.arange(5, dtype=float)
+    assert lttb(x, x, 300).tolist() == [0, 1, 2, 3, 4]
+    assert lttb(x, x, 2).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_minmax_keeps_every_bucket_extreme(signal):
+    x, y = signal
+    idx, is_max = minmax(y, y, 300)
+    assert len(idx) == len(is_max) == 300
+    assert np.all(np.diff(idx) >= 0) # Time order
+    assert int(np.argmax(y)) in idx[is_max]
+    assert int(np.argmin(y)) in idx[~is_max]
+    assert minmax(y[:10], y[:10], 300)[0].tolist() == list(range(10))
+
+
+@pytest.mark.parametrize("mode", ["minmax", "lttb"])
+def test_query_point_counts_and_range(signal, mode):
+    x, y = signal
+    series = SessionSeries(columns=("ear",), tiers=(1.0, 10.0))
+    for t, v in zip(x, y):
+        series.append(t, v)
+
+    result = series.query(0.0, x[-1], points=100, mode=mode)
+    ear = result["series"]["ear"]
+    assert result["source"] == "tier" and result["resolution"] == 1.0
+    assert len(ear["t"]) == len(ear["v"]) <= 100
+    assert ear["t"][0] >= 0.0 and ear["t"][-1] <= x[-1]
+    if mode == "minmax":
+        assert max(ear["v"]) == pytest.approx(5.0) and min(ear["v"]) == pytest.approx(-5.0)
+
+    recent = series.query(x[-1] - 10.0, x[-1], points=100, mode=mode)
+    assert recent["source"] == "raw"
+    t = recent["series"]["ear"]["t"]
+    assert len(t) <= 100 and t[0] >= round(x[-1] - 10.0, 3) and t[-1] == round(x[-1], 3)